@@ -0,0 +1,225 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper module used to populate cache/ with platform/development archives.
+
+This is shared by initialize_build_template.py and prefetch.py.
+
+This module depends on the Python standard library only.
+"""
+
+import os
+import pathlib
+import re
+import sys
+import typing
+
+import _archive_store
+import _cache_lock
+import _download
+import _hashing
+import _mirrors
+import _slim_archive
+import _trace
+import source_archive_url
+
+default_cache_dir = pathlib.Path(__file__).parent / "cache"
+
+# https://semver.org/#is-there-a-suggested-regular-expression-regex-to-check-a-semver-string
+_semver_re = re.compile(
+    r"^(?P<major>0|[1-9]\d*)\.(?P<minor>0|[1-9]\d*)\.(?P<patch>0|[1-9]\d*)"
+    r"(?:-(?P<prerelease>(?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*)"
+    r"(?:\.(?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*))*))?"
+    r"(?:\+(?P<buildmetadata>[0-9a-zA-Z-]+(?:\.[0-9a-zA-Z-]+)*))?$"
+)
+
+
+def is_semver(version: str) -> bool:
+    """Return True if version is a valid SemVer version."""
+    return _semver_re.match(version) is not None
+
+
+def archive_url(
+    version: str, url_template: str = source_archive_url.source_archive_url
+) -> str:
+    """Return the upstream URL of the archive of android-tools version."""
+    return url_template % {"version": version}
+
+
+def archive_filename(url: str) -> str:
+    """Return the name under which the archive fetched from url is cached."""
+    return url[url.rfind("/") + 1 :]
+
+
+def _remove_leftovers(cache_dir: pathlib.Path, entry_names: tuple[str, ...]) -> None:
+    """Remove temporary files of entry_names left by abruptly terminated runs."""
+    # Temporary files of other cache entries may belong to processes running right
+    # now, only files of this entry are removed.
+    entry_tmp_prefixes = tuple("tmp." + name for name in entry_names)
+    cachedir_tmp_listing = [
+        filename
+        for filename in os.listdir(cache_dir)
+        if filename.startswith(entry_tmp_prefixes)
+    ]
+    for filename in cachedir_tmp_listing:
+        partial_filename = filename.removesuffix(_download.state_suffix)
+        if (
+            partial_filename in cachedir_tmp_listing
+            and partial_filename + _download.state_suffix in cachedir_tmp_listing
+        ):
+            # Interrupted download which may be resumed later.
+            continue
+        print(
+            f"WARNING: Found temporary file '{filename}' in cache directory",
+            f"'{cache_dir}'. Was a previous download abruptly terminated?",
+            "Removing...",
+            file=sys.stderr,
+        )
+        (cache_dir / filename).unlink()
+
+
+def populate(
+    version: str,
+    url_template: str = source_archive_url.source_archive_url,
+    mirrors: list[str] | None = None,
+    connections: int = 4,
+    slim: bool = True,
+    pipeline: bool = False,
+    quota: int | None = None,
+    progress: typing.Callable[[int], None] | None = None,
+    events: typing.TextIO | None = None,
+    cache_dir: pathlib.Path = default_cache_dir,
+) -> tuple[pathlib.Path, str]:
+    """Make sure that the archive of android-tools version is cached.
+
+    Arguments:
+        version: Version of android-tools.
+        url_template: Upstream URL of the archive, %(version)s is replaced with
+          version.
+        mirrors: Mirrors to try before the upstream URL (see _mirrors). If None, the
+          mirrors are read from the environment.
+        connections: Maximum number of concurrent connections per download.
+        slim: Create the slim archive (see _slim_archive).
+        pipeline: Create the slim archive while the archive is being fetched.
+        quota: If set, evict least recently used archives until the cache fits into
+          quota bytes.
+        progress: Passed to _download.fetch_with_progress().
+        events: Passed to _download.fetch_with_progress().
+        cache_dir: The cache directory.
+
+    Returns a tuple of the archive the build should use (the slim archive if slim is
+    True) and the SHA-256 digest of the original archive.
+    """
+    url = archive_url(version, url_template)
+    cache_filename = archive_filename(url)
+    cache_path = cache_dir / cache_filename
+    slim_path = cache_dir / _slim_archive.slim_filename(cache_filename)
+
+    # Several processes may share the cache directory. Only one of them may fetch
+    # the archive or create files derived from it at a time, the others wait for it
+    # and reuse the result.
+
+    os.makedirs(cache_dir, exist_ok=True)
+    lock = _cache_lock.CacheLock(cache_path)
+    with _trace.span("wait for cache lock", archive=cache_filename):
+        lock.acquire()
+    try:
+        # Check for previous failed attempts to download source archive.
+
+        _remove_leftovers(cache_dir, (cache_filename, slim_path.name))
+
+        # If the source archive is not present, download it.
+
+        archive_sha256 = _hashing.read_manifest(cache_path)
+        if not os.access(cache_path, os.F_OK):
+            # The cache is likely empty, let's populate it.
+            # The partially fetched file is kept if the download fails. The name is
+            # deterministic so that the next run can resume the download.
+            partial_path = cache_dir / ("tmp." + cache_filename)
+            if mirrors is None:
+                mirrors = _mirrors.from_environment()
+            locations = _mirrors.order_locations(
+                [
+                    _mirrors.locate(mirror, version, cache_filename)
+                    for mirror in mirrors
+                ],
+                url,
+            )
+            slim_stream = None
+            if pipeline and slim:
+                slim_stream = _slim_archive.SlimArchiveStream(slim_path)
+            try:
+                with _trace.span("fetch", archive=cache_filename):
+                    archive_sha256 = _mirrors.fetch(
+                        locations,
+                        partial_path,
+                        connections=connections,
+                        sink=None if slim_stream is None else slim_stream.write,
+                        progress=progress,
+                        events=events,
+                    )
+            except BaseException:
+                if slim_stream is not None:
+                    slim_stream.abort()
+                raise
+            os.rename(partial_path, cache_path)
+            _hashing.write_manifest(cache_path, archive_sha256)
+            if slim_stream is not None:
+                with _trace.span("finish slim archive", archive=cache_filename):
+                    slim_stream.finish(cache_filename, archive_sha256)
+        elif archive_sha256 is None:
+            # The archive was fetched by an older version of this script or it was
+            # restored by actions/cache. Hash it once here instead of in every
+            # generate_sbom.py run.
+            with _trace.span("hashing", file=cache_filename):
+                archive_sha256 = _hashing.sha256_file(cache_path)
+            _hashing.write_manifest(cache_path, archive_sha256)
+
+        # Deduplicate the archive and record that it has been used.
+        store = _archive_store.ArchiveStore(cache_dir)
+        with _trace.span("store archive", archive=cache_filename):
+            store.add(cache_filename, archive_sha256)
+
+        # Extract the subtree needed for the build into a slim archive.
+
+        if not slim:
+            source_path = cache_path
+        else:
+            source_path = slim_path
+            provenance = _slim_archive.read_provenance(source_path)
+            if (
+                not os.access(source_path, os.F_OK)
+                or provenance is None
+                or provenance.get("source_sha256") != archive_sha256
+                or provenance.get("member_prefixes")
+                != list(_slim_archive.member_prefixes)
+            ):
+                print(f"Creating {source_path.name}...", file=sys.stderr)
+                with _trace.span("slim archive", archive=cache_filename):
+                    _slim_archive.create_slim_archive(
+                        cache_path, source_path, archive_sha256
+                    )
+
+        if quota is not None:
+            with _trace.span("collect garbage"):
+                evicted = store.collect_garbage(quota, {archive_sha256})
+            for entry in evicted:
+                print(
+                    f"Evicted {', '.join(entry['names'])} from the cache.",
+                    file=sys.stderr,
+                )
+    finally:
+        lock.release()
+
+    return source_path, archive_sha256
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Content-addressed store of the archives cached in cache/.
+
+Archives are stored as blobs named by their SHA-256 digest (cache/blobs/<digest>).
+The archive names used by initialize_build_template.py (and by actions/cache in the
+release workflow) are hard links to the blobs, identical archives are therefore
+stored only once. An index (cache/store.json) maps the names to digests and records
+when each blob was last used.
+
+If a byte quota is set, the least recently used archives are evicted together with
+the files derived from them (manifests, slim archives, indices) until the cache fits
+into the quota. Archives locked by other processes are never evicted.
+
+This module depends on the Python standard library only.
+"""
+
+import argparse
+import datetime
+import json
+import os
+import pathlib
+import re
+import sys
+import time
+import typing
+
+script_dir = pathlib.Path(__file__).parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(script_dir.absolute()))
+
+    import _cache_lock
+    import _fileio
+    import _hashing
+    import _slim_archive
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+default_cache_dir = script_dir / "cache"
+
+_size_re = re.compile(r"^(\d+)([KMGT]?)(?:i?B)?$", re.IGNORECASE)
+
+
+def parse_size(value: str) -> int:
+    """Parse a size like 500M or 2GiB (powers of 1024) into bytes."""
+    match = _size_re.match(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid size '{value}'!")
+    return int(match[1]) * 1024 ** "_KMGT".index(match[2].upper() or "_")
+
+
+def _link_or_copy(src: pathlib.Path, dst: pathlib.Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        # The filesystem doesn't support hard links. A copy-on-write clone still
+        # doesn't take any space.
+        _fileio.clone_file(src, dst)
+
+
+class ArchiveStore:
+    """Content-addressed store of archives in cache_dir.
+
+    Arguments:
+        cache_dir: The cache directory.
+    """
+
+    def __init__(self, cache_dir: pathlib.Path = default_cache_dir) -> None:
+        self.cache_dir = cache_dir
+        self.blob_dir = cache_dir / "blobs"
+        self.index_path = cache_dir / "store.json"
+
+    def _lock(self) -> _cache_lock.CacheLock:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        return _cache_lock.CacheLock(self.index_path)
+
+    def _load(self) -> dict:
+        try:
+            with open(self.index_path, "r") as file:
+                index = json.load(file)
+        except (FileNotFoundError, ValueError):
+            index = None
+        if not isinstance(index, dict):
+            index = {}
+        index.setdefault("names", {})
+        index.setdefault("blobs", {})
+        return index
+
+    def _save(self, index: dict) -> None:
+        tmp_path = self.index_path.with_name("tmp." + self.index_path.name)
+        with open(tmp_path, "w") as file:
+            json.dump(index, file)
+        os.replace(tmp_path, self.index_path)
+
+    def add(self, name: str, sha256: str) -> None:
+        """Store archive cache_dir/name with digest sha256 and mark it as used.
+
+        If an identical archive is stored already, cache_dir/name is replaced with a
+        link to it.
+        """
+        path = self.cache_dir / name
+        blob = self.blob_dir / sha256
+        with self._lock():
+            index = self._load()
+            if not os.access(blob, os.F_OK):
+                os.makedirs(self.blob_dir, exist_ok=True)
+                _link_or_copy(path, blob)
+            elif not os.path.samefile(path, blob):
+                tmp_path = path.with_name("tmp." + path.name)
+                tmp_path.unlink(missing_ok=True)
+                _link_or_copy(blob, tmp_path)
+                os.replace(tmp_path, path)
+                # The manifest is bound to the replaced file.
+                _hashing.write_manifest(path, sha256)
+            index["names"][name] = sha256
+            index["blobs"][sha256] = {
+                "size": os.path.getsize(blob),
+                "last_access": time.time(),
+            }
+            self._save(index)
+
+    def _entry_files(self, names: typing.Iterable[str]) -> list[pathlib.Path]:
+        """Return the named archives and the files derived from them."""
+        names = list(names)
+        prefixes = tuple(names) + tuple(
+            _slim_archive.slim_filename(name) for name in names
+        )
+        if not prefixes:
+            return []
+        return [
+            self.cache_dir / filename
+            for filename in os.listdir(self.cache_dir)
+            if filename.startswith(prefixes)
+            and not filename.endswith(_cache_lock.lock_suffix)
+        ]
+
+    def _prune(self, index: dict) -> None:
+        """Forget missing files and remove blobs without any name."""
+        for name, sha256 in list(index["names"].items()):
+            if not os.access(self.cache_dir / name, os.F_OK):
+                del index["names"][name]
+        used = set(index["names"].values())
+        for sha256 in list(index["blobs"]):
+            if sha256 not in used:
+                (self.blob_dir / sha256).unlink(missing_ok=True)
+                del index["blobs"][sha256]
+        if os.access(self.blob_dir, os.F_OK):
+            for filename in os.listdir(self.blob_dir):
+                if filename not in index["blobs"]:
+                    (self.blob_dir / filename).unlink()
+
+    def stats(self) -> list[dict]:
+        """Return info about the stored archives, least recently used first."""
+        with self._lock():
+            index = self._load()
+            self._prune(index)
+            self._save(index)
+            entries = []
+            for sha256, blob in index["blobs"].items():
+                names = [
+                    name for name, digest in index["names"].items() if digest == sha256
+                ]
+                derived = [
+                    path
+                    for path in self._entry_files(names)
+                    if not os.path.samefile(path, self.blob_dir / sha256)
+                ]
+                entries.append(
+                    {
+                        "sha256": sha256,
+                        "names": names,
+                        "last_access": blob["last_access"],
+                        "size": blob["size"]
+                        + sum(os.path.getsize(path) for path in derived),
+                    }
+                )
+        entries.sort(key=lambda entry: entry["last_access"])
+        return entries
+
+    def collect_garbage(
+        self, quota: int | None = None, keep: typing.Iterable[str] = ()
+    ) -> list[dict]:
+        """Evict least recently used archives until the cache fits into quota.
+
+        Entries that disappeared are always forgotten. Archives with digests in keep
+        and archives locked by other processes are not evicted. Return the evicted
+        entries (see stats()).
+        """
+        keep = set(keep)
+        evicted = []
+        entries = self.stats()
+        total = sum(entry["size"] for entry in entries)
+        for entry in entries:
+            if quota is None or total <= quota:
+                break
+            if entry["sha256"] in keep:
+                continue
+            locks = [
+                _cache_lock.CacheLock(self.cache_dir / name) for name in entry["names"]
+            ]
+            acquired = []
+            try:
+                for lock in locks:
+                    if not lock.acquire(blocking=False):
+                        break
+                    acquired.append(lock)
+                else:
+                    with self._lock():
+                        for path in self._entry_files(entry["names"]):
+                            path.unlink(missing_ok=True)
+                        index = self._load()
+                        self._prune(index)
+                        self._save(index)
+                    total -= entry["size"]
+                    evicted.append(entry)
+            finally:
+                for lock in acquired:
+                    lock.release()
+        return evicted
+
+
+def _print_entries(entries: list[dict], quota: int | None) -> None:
+    for entry in entries:
+        last_access = datetime.datetime.fromtimestamp(entry["last_access"])
+        print(
+            f"{entry['sha256'][:16]} {entry['size'] / 2**20:>9.1f} MiB",
+            f"{last_access:%Y-%m-%d %H:%M}",
+            ", ".join(entry["names"]),
+        )
+    total = sum(entry["size"] for entry in entries)
+    limit = "unlimited" if quota is None else f"{quota / 2**20:.1f} MiB"
+    print(f"Total: {total / 2**20:.1f} MiB, quota: {limit}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=default_cache_dir,
+        type=pathlib.Path,
+        help="The cache directory. Default: %(default)s",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("stats", help="List the stored archives.")
+    gc_parser = subparsers.add_parser(
+        "gc",
+        help=" ".join(
+            (
+                "Forget removed archives and evict least recently used archives",
+                "until the cache fits into the quota.",
+            )
+        ),
+    )
+    gc_parser.add_argument(
+        "--quota",
+        type=parse_size,
+        help="Maximum size of the cache, for example 1G or 500MiB.",
+    )
+    args = parser.parse_args()
+
+    store = ArchiveStore(args.cache_dir)
+    if args.command == "stats":
+        _print_entries(store.stats(), None)
+    else:
+        for entry in store.collect_garbage(args.quota):
+            print(f"Evicted {', '.join(entry['names'])}", file=sys.stderr)
+        _print_entries(store.stats(), args.quota)
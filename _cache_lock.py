@@ -0,0 +1,151 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper module used to lock entries of the cache directory.
+
+Several CI jobs or shells may share a single cache/ directory. A lock makes sure
+that only one of them fetches an archive (or creates files derived from it) while
+the others wait and reuse the result.
+
+The lock is an OS-level lock (flock() on POSIX, msvcrt.locking() on Windows) of a
+file next to the cache entry. The operating system releases it when its owner
+exits, even if the owner crashes, so a lock can never become stale. The lock file
+records the owner for diagnostics. It is never removed, removing it would let
+processes which have it open lock a file nobody else sees.
+
+This module depends on the Python standard library only.
+"""
+
+import json
+import os
+import pathlib
+import socket
+import sys
+import time
+
+try:
+    import fcntl
+except ModuleNotFoundError:
+    # Windows.
+    fcntl = None
+    import msvcrt
+
+lock_suffix = ".lock"
+
+# msvcrt.locking() locks a byte range, which can't be read by others while it is
+# locked. A byte far beyond the recorded owner is locked instead of the file.
+_windows_lock_offset = 2**30
+
+
+def _try_lock(fd: int) -> bool:
+    """Lock fd without blocking, return False if it's locked by someone else."""
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            os.lseek(fd, _windows_lock_offset, os.SEEK_SET)
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+    except OSError as e:
+        # msvcrt.locking() reports a locked region with EACCES or EDEADLOCK.
+        if isinstance(e, BlockingIOError) or fcntl is None:
+            return False
+        raise
+    return True
+
+
+def _unlock(fd: int) -> None:
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, _windows_lock_offset, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+class CacheLock:
+    """Advisory lock of a cache entry shared by several processes.
+
+    The lock can't be acquired twice, not even by two CacheLock objects of the same
+    process.
+
+    Arguments:
+        path: The cache entry. The lock file is path with lock_suffix appended.
+        poll_interval: Check whether the lock was released every poll_interval
+          seconds.
+    """
+
+    def __init__(self, path: pathlib.Path, poll_interval: float = 0.5) -> None:
+        self.lock_path = path.with_name(path.name + lock_suffix)
+        self._poll_interval = poll_interval
+        self._fd = None
+
+    def _read_owner(self) -> dict | None:
+        """Return the owner recorded in the lock file or None if it's unknown."""
+        try:
+            with open(self.lock_path, "r") as file:
+                owner = json.load(file)
+        except (OSError, ValueError):
+            return None
+        return owner if isinstance(owner, dict) else None
+
+    def _write_owner(self) -> None:
+        owner = {"pid": os.getpid(), "host": socket.gethostname()}
+        data = json.dumps(owner).encode()
+        os.lseek(self._fd, 0, os.SEEK_SET)
+        os.write(self._fd, data)
+        os.ftruncate(self._fd, len(data))
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """Acquire the lock, return False if it's held and blocking is False."""
+        fd = os.open(
+            self.lock_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644
+        )
+        announced = False
+        try:
+            while not _try_lock(fd):
+                if not blocking:
+                    os.close(fd)
+                    return False
+                if not announced:
+                    owner = self._read_owner()
+                    holder = ""
+                    if owner is not None:
+                        holder = f" (pid {owner.get('pid')} on {owner.get('host')})"
+                    print(
+                        f"Waiting for another process{holder} holding",
+                        f"'{self.lock_path}'...",
+                        file=sys.stderr,
+                    )
+                    announced = True
+                time.sleep(self._poll_interval)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        self._write_owner()
+        return True
+
+    def release(self) -> None:
+        """Release the lock."""
+        fd, self._fd = self._fd, None
+        try:
+            _unlock(fd)
+        finally:
+            os.close(fd)
+
+    def __enter__(self) -> "CacheLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.release()
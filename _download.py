@@ -0,0 +1,824 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper module used to fetch the platform/development source archive.
+
+This module depends on the Python standard library only.
+"""
+
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import pathlib
+import re
+import sys
+import threading
+import time
+import typing
+import urllib.error
+import urllib.parse
+import urllib.request
+
+import _cache_lock
+import _fileio
+import source_archive_url
+
+# Do not split the archive into parts smaller than this. Additional connections
+# wouldn't pay off for small files.
+_min_part_size = 8 * 2**20
+
+_content_range_re = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+# Suffix of the file holding the state of an interrupted download.
+state_suffix = ".json"
+
+_max_redirects = 10
+
+# Number of seconds a connection may stall before the download fails. A stalled
+# server would otherwise hang the build forever.
+_timeout = 60.0
+
+# Sizes of files fetched earlier. They are used to estimate the progress of downloads
+# of files whose size isn't sent by the server.
+default_size_history_path = pathlib.Path(__file__).parent / "cache" / "sizes.json"
+
+# Serializes writes of progress events of concurrent downloads.
+_events_lock = threading.Lock()
+
+
+class _Cancelled(Exception):
+    """Raised in a part of a download when another part has failed."""
+
+
+class _ConnectionPool:
+    """Thread safe pool of keep-alive HTTP connections.
+
+    Connections are reused by later requests to the same server: by the parts of a
+    single download or by downloads of several archives.
+    """
+
+    def __init__(self) -> None:
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _get(
+        self, scheme: str, netloc: str
+    ) -> tuple[http.client.HTTPConnection, bool]:
+        """Return a connection to netloc and whether it is an idle reused one."""
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=_timeout), False
+        return http.client.HTTPConnection(netloc, timeout=_timeout), False
+
+    def _put(
+        self, scheme: str, netloc: str, connection: http.client.HTTPConnection
+    ) -> None:
+        with self._lock:
+            self._idle.setdefault((scheme, netloc), []).append(connection)
+
+    def request(self, url: str, headers: dict[str, str]) -> "_PooledResponse":
+        """Send a GET request, return the response."""
+        parsed = urllib.parse.urlsplit(url)
+        target = parsed.path or "/"
+        if parsed.query:
+            target += "?" + parsed.query
+        while True:
+            connection, reused = self._get(parsed.scheme, parsed.netloc)
+            try:
+                connection.request("GET", target, headers=headers)
+                response = connection.getresponse()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if reused:
+                    # The server has closed the idle connection in the meantime.
+                    continue
+                raise
+            return _PooledResponse(
+                response,
+                lambda: self._put(parsed.scheme, parsed.netloc, connection),
+                connection.close,
+            )
+
+
+class _PooledResponse:
+    """HTTP response which returns its connection to the pool when closed."""
+
+    def __init__(
+        self,
+        response: http.client.HTTPResponse,
+        reuse: typing.Callable[[], None],
+        discard: typing.Callable[[], None],
+    ) -> None:
+        self._response = response
+        self._reuse = reuse
+        self._discard = discard
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def readinto(self, buffer: bytearray | memoryview) -> int:
+        return self._response.readinto(buffer)
+
+    def read(self, size: int = -1) -> bytes:
+        return self._response.read(size)
+
+    def close(self) -> None:
+        if self._response is None:
+            return
+        # A connection can be reused only if the whole response has been read.
+        if self._response.isclosed() and not self._response.will_close:
+            self._reuse()
+        else:
+            self._response.close()
+            self._discard()
+        self._response = None
+
+    def __enter__(self) -> "_PooledResponse":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+_pool = _ConnectionPool()
+
+
+def _load_sizes(path: pathlib.Path) -> dict:
+    try:
+        with open(path, "r") as file:
+            sizes = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return sizes if isinstance(sizes, dict) else {}
+
+
+def estimate_size(
+    url: str, history_path: pathlib.Path | None = default_size_history_path
+) -> tuple[int, str]:
+    """Return the expected size of the file fetched from url and its source.
+
+    The size of the last download of url is used. If url hasn't been fetched yet, the
+    size of the most recently fetched file is used (new versions of the archive are
+    about as large as the old ones). The source of these estimates is "history". The
+    approximate size from source_archive_url is used as a last resort, its source is
+    "approximate".
+    """
+    sizes = {} if history_path is None else _load_sizes(history_path)
+    sizes = {
+        key: value
+        for key, value in sizes.items()
+        if isinstance(value, int) and value > 0
+    }
+    if url in sizes:
+        return sizes[url], "history"
+    if sizes:
+        return list(sizes.values())[-1], "history"
+    return source_archive_url.source_archive_approximate_size, "approximate"
+
+
+# Serializes the updates of the size history by the threads of this process,
+# CacheLock serializes them between processes.
+_size_history_lock = threading.Lock()
+
+
+def record_size(
+    url: str, size: int, history_path: pathlib.Path = default_size_history_path
+) -> None:
+    """Remember that the file fetched from url had size bytes.
+
+    The history only improves estimates, failing to update it is reported as a
+    warning.
+    """
+    try:
+        os.makedirs(history_path.parent, exist_ok=True)
+        with _size_history_lock, _cache_lock.CacheLock(history_path):
+            sizes = _load_sizes(history_path)
+            # The most recently fetched file is kept last.
+            sizes.pop(url, None)
+            sizes[url] = size
+            tmp_path = history_path.with_name(f"{history_path.name}.{os.getpid()}.new")
+            with open(tmp_path, "w") as file:
+                json.dump(sizes, file)
+            os.replace(tmp_path, history_path)
+    except OSError as e:
+        print(
+            f"WARNING: Couldn't record the size of {url} in {history_path}: {e}",
+            file=sys.stderr,
+        )
+
+
+class _Progress:
+    """Thread safe simplistic progress indicator.
+
+    The progress is printed to stderr. If events is set, it is also written to it as
+    JSON lines which can be processed by other programs. Each line is an object with
+    the "event" (start, first_byte, progress or done), "url" and "time" (Unix time)
+    keys and with the following keys specific to the event:
+
+      start: total_bytes, total_source (content-length if the size of the file was
+        sent by the server, history if it was estimated from earlier downloads or
+        approximate) and resumed_bytes (bytes fetched by an interrupted download)
+      first_byte: ttfb_s (seconds from the start of the fetch to the first byte)
+      progress: fetched_bytes, total_bytes, bytes_per_s (since the previous progress
+        event), average_bytes_per_s (since the first byte) and eta_s
+      done: fetched_bytes, elapsed_s, ttfb_s and average_bytes_per_s
+
+    Arguments:
+        url: Fetched URL.
+        print_delay: Print progress every print_delay seconds.
+        callback: If set, it is called with the number of newly fetched bytes instead
+          of printing progress.
+        events: Text file to write events to.
+        size_history: File with the sizes of earlier downloads (see estimate_size()).
+    """
+
+    def __init__(
+        self,
+        url: str,
+        print_delay: float,
+        callback: typing.Callable[[int], None] | None = None,
+        events: typing.TextIO | None = None,
+        size_history: pathlib.Path | None = default_size_history_path,
+    ) -> None:
+        self._url = url
+        self._print_delay = print_delay
+        self._callback = callback
+        self._events = events
+        self._size_history = size_history
+        self._start = time.monotonic()
+        self._total = None
+        self._total_source = None
+        self._fetched_size = 0
+        self._resumed_size = 0
+        self._first_byte = None
+        self._log_delay = self._start
+        self._event_time = self._start
+        self._event_size = 0
+        self._lock = threading.Lock()
+
+    @property
+    def fetched_size(self) -> int:
+        """Return the number of bytes fetched so far."""
+        return self._fetched_size
+
+    def _emit(self, event: str, **fields: typing.Any) -> None:
+        if self._events is None:
+            return
+        line = json.dumps(
+            {"event": event, "url": self._url, "time": time.time(), **fields}
+        )
+        # Several downloads may share the file.
+        with _events_lock:
+            self._events.write(line + "\n")
+            self._events.flush()
+
+    def begin(self, total: int | None, fetched_size: int = 0) -> None:
+        """Start counting progress of a file of size total (None if unknown).
+
+        fetched_size is the number of bytes fetched before (by an interrupted
+        download).
+        """
+        with self._lock:
+            if total is not None:
+                self._total = total
+                self._total_source = "content-length"
+            else:
+                self._total, self._total_source = estimate_size(
+                    self._url, self._size_history
+                )
+            if self._callback is not None and fetched_size > self._fetched_size:
+                self._callback(fetched_size - self._fetched_size)
+            self._fetched_size = fetched_size
+            self._resumed_size = fetched_size
+            self._event_size = fetched_size
+            self._emit(
+                "start",
+                total_bytes=self._total,
+                total_source=self._total_source,
+                resumed_bytes=fetched_size,
+            )
+
+    def _average(self, now: float) -> float:
+        elapsed = now - self._first_byte
+        return (self._fetched_size - self._resumed_size) / max(elapsed, 1e-3)
+
+    def update(self, size: int) -> None:
+        """Register size new bytes and print progress if enough time has passed."""
+        with self._lock:
+            now = time.monotonic()
+            if self._first_byte is None:
+                self._first_byte = now
+                self._emit("first_byte", ttfb_s=now - self._start)
+            self._fetched_size += size
+            if self._callback is not None:
+                self._callback(size)
+
+            event_delay = now - self._event_time
+            if self._events is not None and event_delay >= self._print_delay:
+                average = self._average(now)
+                remaining = max(self._total - self._fetched_size, 0)
+                self._emit(
+                    "progress",
+                    fetched_bytes=self._fetched_size,
+                    total_bytes=self._total,
+                    bytes_per_s=(self._fetched_size - self._event_size) / event_delay,
+                    average_bytes_per_s=average,
+                    eta_s=remaining / average if average > 0 else None,
+                )
+                self._event_time = now
+                self._event_size = self._fetched_size
+
+            if self._callback is not None:
+                return
+            if (now - self._log_delay) < self._print_delay:
+                return
+            self._log_delay = now
+
+            tilde = "" if self._total_source == "content-length" else "~"
+            progress = round(self._fetched_size / self._total * 100, 1)
+            progress_str = f"{tilde}{progress}"
+            print(
+                f"{round(self._fetched_size / 2**20):>4}MiB / {tilde}",
+                round(self._total / 2**20),
+                f"MiB = {progress_str:>6} %",
+                sep="",
+                file=sys.stderr,
+            )
+
+    def finish(self) -> None:
+        """Report that the whole file has been fetched."""
+        with self._lock:
+            now = time.monotonic()
+            first_byte = now if self._first_byte is None else self._first_byte
+            self._emit(
+                "done",
+                fetched_bytes=self._fetched_size,
+                elapsed_s=now - self._start,
+                ttfb_s=first_byte - self._start,
+                average_bytes_per_s=(self._fetched_size - self._resumed_size)
+                / max(now - first_byte, 1e-3),
+            )
+
+
+class _Download:
+    """State of a download which can be saved and resumed later.
+
+    The fetched file is split into parts. Each part is a [start, end, received] list
+    where start and end are inclusive offsets of the part in the file (end is None if
+    the size of the file is unknown) and received is the number of bytes of the part
+    which have already been written to out.
+
+    The SHA-256 digest of the file is computed while the data is written if it is
+    written sequentially. Data written out of order (by concurrently fetched parts or
+    by a previous interrupted download) is read back from out only when needed. The
+    data is passed to sink (if set) in the same order.
+
+    Arguments:
+        url: Remote file to fetch.
+        out: Seekable file to write output to.
+        state_path: File into which the state of the download is saved.
+        parts: Parts of the file.
+        etag: Strong ETag validator of the remote file.
+        last_modified: Last-Modified validator of the remote file.
+        print_delay: Save state every print_delay seconds.
+        progress: Progress indicator of the download.
+        sink: Function called with the contents of the file in order.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        out: typing.BinaryIO,
+        state_path: pathlib.Path,
+        parts: list[list],
+        etag: str | None,
+        last_modified: str | None,
+        print_delay: float,
+        progress: _Progress,
+        sink: typing.Callable[[memoryview], None] | None = None,
+    ) -> None:
+        self.url = url
+        self.out = out
+        self.state_path = state_path
+        self.parts = parts
+        self.etag = etag
+        self.last_modified = last_modified
+        self.total = None if parts[-1][1] is None else parts[-1][1] + 1
+        self.progress = progress
+        progress.begin(self.total, sum(part[2] for part in parts))
+        self._print_delay = print_delay
+        self._save_time = time.monotonic()
+        self._out_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._sha256 = hashlib.sha256()
+        self._hashed_size = 0
+        self._sink = sink
+        # Set when a part fails, the other parts stop fetching.
+        self.cancelled = threading.Event()
+
+    @property
+    def if_range(self) -> str | None:
+        """Return the value of the If-Range header used when resuming."""
+        return self.etag if self.etag is not None else self.last_modified
+
+    def write(self, part: list, data: bytes | memoryview) -> None:
+        """Write data to the current position of part."""
+        # out may be shared between several threads. Its position must therefore be
+        # set before each write.
+        with self._out_lock:
+            position = part[0] + part[2]
+            self.out.seek(position)
+            self.out.write(data)
+            part[2] += len(data)
+            if position == self._hashed_size:
+                self._consume(data)
+        self.progress.update(len(data))
+        if time.monotonic() - self._save_time >= self._print_delay:
+            self.save()
+
+    def hash_until(self, end: int | None = None) -> None:
+        """Read back and hash data written to out until end (or until EOF if None)."""
+        with self._out_lock:
+            self.out.flush()
+            self.out.seek(self._hashed_size)
+            size = None if end is None else end - self._hashed_size
+            for chunk in _fileio.iter_readinto(self.out, size):
+                self._consume(chunk)
+
+    def _consume(self, data: bytes | memoryview) -> None:
+        """Process data following the already hashed data, the caller holds the lock."""
+        self._sha256.update(data)
+        self._hashed_size += len(data)
+        if self._sink is not None:
+            self._sink(memoryview(data))
+
+    def hexdigest(self) -> str:
+        """Return the SHA-256 digest of the whole (completely fetched) file."""
+        self.hash_until()
+        return self._sha256.hexdigest()
+
+    def save(self) -> None:
+        """Save the state of the download to state_path."""
+        if self.if_range is None:
+            # The archives served by googlesource aren't stable. It isn't safe to
+            # resume the download if the remote file cannot be validated.
+            return
+        if not self._save_lock.acquire(blocking=False):
+            # Another thread is saving the state right now.
+            return
+        try:
+            with self._out_lock:
+                self.out.flush()
+                state = {
+                    "url": self.url,
+                    "etag": self.etag,
+                    "last_modified": self.last_modified,
+                    "parts": [list(part) for part in self.parts],
+                }
+            new_state_path = self.state_path.with_name(self.state_path.name + ".new")
+            with open(new_state_path, "w") as file:
+                json.dump(state, file)
+            os.replace(new_state_path, self.state_path)
+            self._save_time = time.monotonic()
+        finally:
+            self._save_lock.release()
+
+
+def _is_complete(part: list) -> bool:
+    return part[1] is not None and part[2] == part[1] - part[0] + 1
+
+
+def _request(
+    url: str,
+    start: int | None = None,
+    end: int | None = None,
+    if_range: str | None = None,
+) -> typing.Any:
+    """Open url, request bytes start to end (inclusive) if start is not None."""
+    headers = {"User-Agent": "Python-urllib/%d.%d" % sys.version_info[:2]}
+    if start is not None:
+        headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        if if_range is not None:
+            headers["If-Range"] = if_range
+    scheme = urllib.parse.urlsplit(url).scheme
+    if scheme not in ("http", "https") or scheme in urllib.request.getproxies():
+        # Let urllib handle proxies and other schemes.
+        return urllib.request.urlopen(
+            urllib.request.Request(url, headers=headers), timeout=_timeout
+        )
+    for _ in range(_max_redirects + 1):
+        response = _pool.request(url, headers)
+        location = response.headers.get("Location")
+        if response.status in (301, 302, 303, 307, 308) and location is not None:
+            response.close()
+            url = urllib.parse.urljoin(url, location)
+            continue
+        if response.status >= 400:
+            response.close()
+            raise urllib.error.HTTPError(
+                url, response.status, response.reason, response.headers, None
+            )
+        return response
+    raise OSError(f"Too many redirects while fetching '{url}'!")
+
+
+def _content_range(response: typing.Any) -> tuple[int, int, int] | None:
+    """Return the (start, end, total) Content-Range of a partial response."""
+    if response.status != 206:
+        return None
+    match = _content_range_re.match(response.headers.get("Content-Range", ""))
+    if match is None:
+        return None
+    return int(match[1]), int(match[2]), int(match[3])
+
+
+def _copy(
+    download: _Download, part: list, response: typing.Any, chunk_size: int
+) -> None:
+    """Copy response to the current position of part until the part is complete."""
+    end = part[1]
+    size = None if end is None else end + 1 - part[0] - part[2]
+    for chunk in _fileio.iter_readinto(response, size, chunk_size):
+        if download.cancelled.is_set():
+            raise _Cancelled()
+        download.write(part, chunk)
+    if end is not None and not _is_complete(part):
+        raise OSError(
+            f"Connection closed prematurely while fetching bytes {part[0]}-{end} of "
+            f"'{download.url}'!"
+        )
+
+
+def _fetch_part(download: _Download, part: list, chunk_size: int) -> None:
+    """Fetch the rest of part in a new request."""
+    start = part[0] + part[2]
+    try:
+        with _request(download.url, start, part[1], download.if_range) as response:
+            content_range = _content_range(response)
+            if content_range is None or content_range[0] != start:
+                raise OSError(
+                    f"Server didn't honor range request 'bytes={start}-{part[1]}' "
+                    f"of '{download.url}'! Has the remote file changed?"
+                )
+            _copy(download, part, response, chunk_size)
+    except BaseException:
+        download.cancelled.set()
+        raise
+
+
+def _fetch_parts(
+    download: _Download,
+    parts: list[list],
+    response: typing.Any,
+    connections: int,
+    chunk_size: int,
+) -> None:
+    """Fetch parts concurrently, the first part is read from response."""
+    try:
+        if len(parts) == 1:
+            _copy(download, parts[0], response, chunk_size)
+            return
+        executor = concurrent.futures.ThreadPoolExecutor(
+            max(1, min(connections - 1, len(parts) - 1))
+        )
+        try:
+            futures = [
+                executor.submit(_fetch_part, download, part, chunk_size)
+                for part in parts[1:]
+            ]
+            try:
+                _copy(download, parts[0], response, chunk_size)
+            except _Cancelled:
+                # Another part has failed, its error is raised below.
+                pass
+            for future in concurrent.futures.as_completed(futures):
+                error = future.exception()
+                if error is not None and not isinstance(error, _Cancelled):
+                    raise error
+            if download.cancelled.is_set():
+                raise OSError(f"Fetching '{download.url}' has been cancelled!")
+        except BaseException:
+            # Stop the parts which are still being fetched, shutdown() would
+            # otherwise wait until they finish.
+            download.cancelled.set()
+            raise
+        finally:
+            executor.shutdown(cancel_futures=True)
+    except BaseException:
+        download.save()
+        raise
+
+
+def _load_state(url: str, path: pathlib.Path, state_path: pathlib.Path) -> dict | None:
+    """Load the state of an interrupted download of url, return None if not usable."""
+    try:
+        with open(state_path, "r") as file:
+            state = json.load(file)
+        size = os.path.getsize(path)
+    except (FileNotFoundError, ValueError):
+        return None
+    if state.get("url") != url or (
+        state.get("etag") is None and state.get("last_modified") is None
+    ):
+        return None
+    parts = state.get("parts")
+    if not parts or any(start + received > size for start, _, received in parts):
+        return None
+    return state
+
+
+def _resume(download: _Download, connections: int, chunk_size: int) -> bool:
+    """Resume download, return False if the remote file has changed."""
+    pending = [part for part in download.parts if not _is_complete(part)]
+    if not pending:
+        return True
+    start = pending[0][0] + pending[0][2]
+    with _request(download.url, start, pending[0][1], download.if_range) as response:
+        # If the validator doesn't match, the server sends the whole file with status
+        # 200.
+        content_range = _content_range(response)
+        if (
+            content_range is None
+            or content_range[0] != start
+            or (download.total is not None and content_range[2] != download.total)
+        ):
+            return False
+        # Data from the interrupted download has to be hashed. Doing it now allows
+        # the first pending part to be hashed while it is being fetched. It must be
+        # done only after the remote file is validated, sink would otherwise receive
+        # stale data.
+        download.hash_until(start)
+        _fetch_parts(download, pending, response, connections, chunk_size)
+    return True
+
+
+def _fetch_new(
+    url: str,
+    out: typing.BinaryIO,
+    state_path: pathlib.Path,
+    connections: int,
+    chunk_size: int,
+    print_delay: float,
+    progress: _Progress,
+    sink: typing.Callable[[memoryview], None] | None,
+) -> str:
+    """Fetch url from scratch, return its SHA-256 digest."""
+    # The first request doubles as a probe. If the server ignores the Range header,
+    # it will send the whole file with status 200, which is handled just like a
+    # regular single stream download.
+    with _request(url, 0 if connections > 1 else None) as response:
+        etag = response.headers.get("ETag")
+        if etag is not None and etag.startswith("W/"):
+            # Weak validators cannot be used in If-Range.
+            etag = None
+        last_modified = response.headers.get("Last-Modified")
+
+        content_range = _content_range(response)
+        if content_range is None or content_range[0] != 0:
+            length = response.headers.get("Content-Length")
+            if response.status == 200 and length is not None and length.isdigit():
+                parts = [[0, int(length) - 1, 0]]
+            else:
+                parts = [[0, None, 0]]
+        else:
+            total = content_range[2]
+            part_count = max(1, min(connections, total // _min_part_size))
+            part_size = total // part_count
+            parts = [
+                [part_size * index, part_size * (index + 1) - 1, 0]
+                for index in range(part_count)
+            ]
+            parts[-1][1] = total - 1
+            if part_count > 1:
+                print(
+                    f"Server supports range requests, using {part_count} connections.",
+                    file=sys.stderr,
+                )
+                # Preallocate the file, parts are written to it out of order.
+                out.truncate(total)
+
+        download = _Download(
+            url,
+            out,
+            state_path,
+            parts,
+            etag,
+            last_modified,
+            print_delay,
+            progress,
+            sink,
+        )
+        _fetch_parts(download, parts, response, connections, chunk_size)
+    return download.hexdigest()
+
+
+def _finish(
+    url: str,
+    path: pathlib.Path,
+    indicator: _Progress,
+    size_history: pathlib.Path | None,
+) -> None:
+    indicator.finish()
+    if size_history is not None:
+        record_size(url, os.path.getsize(path), size_history)
+
+
+def fetch_with_progress(
+    url: str,
+    path: pathlib.Path,
+    connections: int = 4,
+    chunk_size: int = _fileio.buffer_size,
+    print_delay: float = 1.0,
+    sink: typing.Callable[[memoryview], None] | None = None,
+    progress: typing.Callable[[int], None] | None = None,
+    events: typing.TextIO | None = None,
+    size_history: pathlib.Path | None = default_size_history_path,
+) -> str:
+    """Fetch url into path while showing a simplistic progress indicator.
+
+    If the server supports range requests, the file is split into several parts which
+    are fetched concurrently. If it doesn't, the file is fetched in a single stream.
+
+    If the download is interrupted, the partially fetched file is left in path and the
+    state of the download is saved next to it (path with state_suffix appended). The
+    next call of this function with the same url and path resumes the download if the
+    server supports range requests and the remote file hasn't changed since. The
+    state is deleted when the download finishes.
+
+    The SHA-256 digest of the fetched file is returned. It is computed while the file
+    is being fetched. The contents of the file can be processed the same way by
+    passing a sink. If parts are fetched concurrently, sink receives the data of later
+    parts when they are reached, possibly after all of them have been fetched.
+
+    Arguments:
+        url: Remote file to fetch.
+        path: File to write output to.
+        connections: Maximum number of concurrent connections.
+        chunk_size: Download the file in chunks of chunk_size size.
+        print_delay: Print progress every print_delay seconds.
+        sink: Function called with consecutive chunks of the contents of the file.
+          The memoryview is valid only until the function returns.
+        progress: If set, it is called with the number of newly fetched bytes
+          instead of printing progress.
+        events: Text file to write progress events to (see _Progress).
+        size_history: File with the sizes of earlier downloads. It is used to
+          estimate the progress if the server doesn't send the size of the file and
+          it is updated when the download finishes. None disables it.
+    """
+    state_path = path.with_name(path.name + state_suffix)
+    indicator = _Progress(url, print_delay, progress, events, size_history)
+
+    state = _load_state(url, path, state_path)
+    if state is not None:
+        with open(path, "r+b") as out:
+            download = _Download(
+                url,
+                out,
+                state_path,
+                state["parts"],
+                state["etag"],
+                state["last_modified"],
+                print_delay,
+                indicator,
+                sink,
+            )
+            print(
+                f"Resuming download at {download.progress.fetched_size} bytes...",
+                file=sys.stderr,
+            )
+            if _resume(download, connections, chunk_size):
+                sha256 = download.hexdigest()
+                state_path.unlink()
+                _finish(url, path, indicator, size_history)
+                return sha256
+        print(
+            "WARNING: The remote file has changed since the download was interrupted",
+            "or the server doesn't support resuming downloads. Starting over...",
+            file=sys.stderr,
+        )
+
+    # The file is opened for reading too, data written out of order is read back to
+    # compute the digest.
+    with open(path, "w+b") as out:
+        sha256 = _fetch_new(
+            url, out, state_path, connections, chunk_size, print_delay, indicator, sink
+        )
+    state_path.unlink(missing_ok=True)
+    _finish(url, path, indicator, size_history)
+    return sha256
@@ -0,0 +1,164 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper module used to read, hash and copy large files efficiently.
+
+The platform/development archive has about 250 MiB. Reading it in small blocks
+allocates a new bytes object for every block, these functions reuse a single buffer
+or they let the kernel copy the data instead.
+
+This module depends on the Python standard library only.
+"""
+
+# ########################################################
+# #               WARNING WARNING WARNING                #
+# #               =======================                #
+# # If you edit this file, make sure that you rerun      #
+# # initialize_build_template.py, otherwise your changes #
+# # will not take effect in generate_sbom.py!            #
+# ########################################################
+
+import hashlib
+import os
+import shutil
+import sys
+import typing
+
+try:
+    import fcntl
+except ModuleNotFoundError:
+    # Windows.
+    fcntl = None
+
+buffer_size = 2**18
+
+# ioctl which makes a file share the blocks of another file (Linux only). fcntl
+# defines it since Python 3.12.
+_ficlone = getattr(fcntl, "FICLONE", 0x40049409)
+
+
+def iter_readinto(
+    stream: typing.BinaryIO, size: int | None = None, buffer_size: int = buffer_size
+) -> typing.Iterator[memoryview]:
+    """Read stream in chunks using a single reused buffer.
+
+    The yielded memoryview is valid only until the next chunk is requested.
+
+    Arguments:
+        stream: Stream supporting readinto().
+        size: Read at most size bytes. If None, read until EOF.
+        buffer_size: Maximum size of a chunk.
+    """
+    view = memoryview(bytearray(buffer_size))
+    remaining = size
+    while remaining is None or remaining > 0:
+        target = view if remaining is None else view[: min(buffer_size, remaining)]
+        count = stream.readinto(target)
+        if not count:
+            break
+        if remaining is not None:
+            remaining -= count
+        yield view[:count]
+
+
+def hash_file(path: os.PathLike | str, algorithm: str = "sha256") -> str:
+    """Return the hex digest of path."""
+    with open(path, "rb") as file:
+        if hasattr(hashlib, "file_digest"):
+            # Python >=3.11 hashes the file in C, releasing the GIL.
+            return hashlib.file_digest(file, algorithm).hexdigest()
+        digest = hashlib.new(algorithm)
+        for chunk in iter_readinto(file):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
+def copy_file(src: os.PathLike | str, dst: os.PathLike | str) -> None:
+    """Copy contents and permission bits of src to dst.
+
+    On Linux, os.copy_file_range() is used, the data doesn't have to pass through
+    userspace and the filesystem may share the blocks of both files. Other platforms
+    use shutil.copy(), which uses the fastest copy method available there.
+    """
+    if not hasattr(os, "copy_file_range"):
+        shutil.copy(src, dst)
+        return
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        size = os.fstat(src_file.fileno()).st_size
+        try:
+            while size > 0:
+                copied = os.copy_file_range(
+                    src_file.fileno(), dst_file.fileno(), min(size, 2**30)
+                )
+                if copied == 0:
+                    break
+                size -= copied
+        except OSError:
+            # The filesystem doesn't support it (EXDEV before Linux 5.3, ENOSYS,
+            # EINVAL on some special filesystems).
+            src_file.seek(0)
+            dst_file.seek(0)
+            dst_file.truncate()
+            shutil.copyfileobj(src_file, dst_file)
+    shutil.copymode(src, dst)
+
+
+def _reflink(src: os.PathLike | str, dst: os.PathLike | str) -> bool:
+    """Make dst a copy-on-write clone of src, return False if it isn't supported."""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), _ficlone, src_file.fileno())
+    except OSError:
+        # The filesystem doesn't support it (EOPNOTSUPP, EXDEV across filesystems,
+        # EINVAL). Other errors are raised by the next strategy.
+        try:
+            os.unlink(dst)
+        except FileNotFoundError:
+            pass
+        return False
+    shutil.copymode(src, dst)
+    return True
+
+
+def clone_file(
+    src: os.PathLike | str, dst: os.PathLike | str, hardlink: bool = False
+) -> str:
+    """Create dst with the contents of src as cheaply as possible.
+
+    The following strategies are tried in order, the name of the used one is
+    returned:
+
+      reflink: A copy-on-write clone (btrfs, XFS and other Linux filesystems). It
+        doesn't take any space or I/O until one of the files is modified.
+      hardlink: Only if hardlink is True. dst becomes another name of src, it must
+        therefore never be modified in place.
+      copy: copy_file().
+
+    dst must not exist.
+    """
+    if _reflink(src, dst):
+        return "reflink"
+    if hardlink:
+        try:
+            os.link(src, dst)
+        except OSError:
+            # The filesystem doesn't support hard links or src and dst are on
+            # different filesystems.
+            pass
+        else:
+            return "hardlink"
+    copy_file(src, dst)
+    return "copy"
@@ -0,0 +1,178 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper module used to compute and cache SHA-256 digests of files.
+
+Large files (the platform/development archive, the release archive) are hashed by
+several scripts. Digests are therefore recorded either in a manifest next to the file
+or in a persistent digest cache so that every file is read only once.
+
+This module depends on the Python standard library only. If called directly, it
+prints the digests of its arguments in the format of sha256sum --binary.
+"""
+
+# ########################################################
+# #               WARNING WARNING WARNING                #
+# #               =======================                #
+# # If you edit this file, make sure that you rerun      #
+# # initialize_build_template.py, otherwise your changes #
+# # will not take effect in generate_sbom.py!            #
+# ########################################################
+
+import argparse
+import json
+import os
+import pathlib
+import sys
+
+import _fileio
+
+# Suffix of the manifest file recording the digest of a file.
+manifest_suffix = ".sha256.json"
+
+# Location of the digest cache used by the release scripts.
+default_cache_path = pathlib.Path(__file__).parent / "cache" / "digests.json"
+
+
+def _manifest_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(path.name + manifest_suffix)
+
+
+def _stat_key(path: pathlib.Path) -> dict:
+    """Return values which (likely) change when path changes."""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
+
+
+def write_manifest(path: pathlib.Path, sha256: str) -> None:
+    """Record the SHA-256 digest of path into a manifest next to it."""
+    with open(_manifest_path(path), "w") as file:
+        json.dump({"sha256": sha256, **_stat_key(path)}, file)
+
+
+def read_manifest(path: pathlib.Path) -> str | None:
+    """Return the SHA-256 digest of path recorded in its manifest.
+
+    If path is a symlink, it is resolved first; the manifest is placed next to the
+    target. None is returned if there is no manifest or if path has changed since the
+    manifest was written.
+    """
+    path = pathlib.Path(os.path.realpath(path))
+    try:
+        with open(_manifest_path(path), "r") as file:
+            manifest = json.load(file)
+        stat_key = _stat_key(path)
+    except (FileNotFoundError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or any(
+        manifest.get(key) != value for key, value in stat_key.items()
+    ):
+        return None
+    return manifest.get("sha256")
+
+
+class DigestCache:
+    """Persistent cache of SHA-256 digests.
+
+    Entries are keyed by the resolved path of the file. An entry is valid only while
+    the size, mtime_ns and inode of the file stay the same.
+
+    The cache file is shared by several processes. It is reloaded and merged before
+    every write and it is replaced atomically. An entry may get lost if two processes
+    write at the same time, which only means that the file will be hashed again.
+
+    Arguments:
+        path: File holding the cache.
+    """
+
+    def __init__(self, path: pathlib.Path = default_cache_path) -> None:
+        self._path = path
+        self._entries = self._load()
+
+    def _load(self) -> dict[str, dict]:
+        try:
+            with open(self._path, "r") as file:
+                entries = json.load(file)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return entries if isinstance(entries, dict) else {}
+
+    def get(self, path: pathlib.Path) -> str | None:
+        """Return the cached digest of path or None if it isn't cached."""
+        key = os.path.realpath(path)
+        entry = self._entries.get(key)
+        if not isinstance(entry, dict):
+            return None
+        try:
+            stat_key = _stat_key(pathlib.Path(key))
+        except FileNotFoundError:
+            return None
+        if any(entry.get(name) != value for name, value in stat_key.items()):
+            return None
+        return entry.get("sha256")
+
+    def put(self, path: pathlib.Path, sha256: str) -> None:
+        """Record the digest of path and save the cache."""
+        key = os.path.realpath(path)
+        entry = {"sha256": sha256, **_stat_key(pathlib.Path(key))}
+        self._entries = self._load()
+        self._entries[key] = entry
+        # Forget files which no longer exist.
+        self._entries = {
+            name: value
+            for name, value in self._entries.items()
+            if os.access(name, os.F_OK)
+        }
+        os.makedirs(self._path.parent, exist_ok=True)
+        new_path = self._path.with_name(f"{self._path.name}.{os.getpid()}.new")
+        with open(new_path, "w") as file:
+            json.dump(self._entries, file)
+        os.replace(new_path, self._path)
+
+
+def sha256_file(path: pathlib.Path, cache: DigestCache | None = None) -> str:
+    """Return the string sha256sum of provided path.
+
+    The manifest of path is used if it is up to date. If it isn't and cache is not
+    None, the digest is looked up in cache and it is recorded there if it's missing.
+    """
+    sha256 = read_manifest(path)
+    if sha256 is None and cache is not None:
+        sha256 = cache.get(path)
+    if sha256 is None:
+        sha256 = _fileio.hash_file(path)
+        if cache is not None:
+            cache.put(path, sha256)
+    return sha256
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("files", nargs="+", help="Files to hash.")
+    parser.add_argument(
+        "--cache",
+        default=default_cache_path,
+        type=pathlib.Path,
+        help="Digest cache to use. Default: %(default)s",
+    )
+    args = parser.parse_args()
+
+    cache = DigestCache(args.cache)
+    # Output of sha256sum uses LF line endings even on Windows.
+    sys.stdout.reconfigure(newline="\n")
+    for filename in args.files:
+        print(f"{sha256_file(pathlib.Path(filename), cache)} *{filename}")
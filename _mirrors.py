@@ -0,0 +1,254 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper module used to fetch the platform/development archive from mirrors.
+
+A mirror is either a local directory or a URL. Both may contain %(version)s, which
+is replaced with the version of android-tools. If they don't, the file name of the
+archive is appended to them. Mirrors can be used to fetch the archive from a HTTP
+cache, from a directory shared by several build agents or from a local
+http.server in tests.
+
+Local mirrors are tried first. Remote mirrors are probed concurrently and tried in
+the order of their estimated download time, which is computed from the measured
+latency and from the throughput of earlier downloads. The upstream URL is always
+tried last. If a mirror fails, the next one is used.
+
+This module depends on the Python standard library only.
+"""
+
+import concurrent.futures
+import hashlib
+import http.client
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+import typing
+import urllib.parse
+import urllib.request
+
+import _cache_lock
+import _download
+import _fileio
+
+# Environment variable containing whitespace separated mirrors.
+env_var = "ADBWINAPI_MIRRORS"
+
+# Throughput of mirrors measured by earlier downloads.
+default_history_path = pathlib.Path(__file__).parent / "cache" / "mirrors.json"
+
+# Throughput assumed for mirrors which haven't been used yet.
+_assumed_throughput = 10 * 2**20
+
+_fetch_errors = (OSError, http.client.HTTPException)
+
+
+def from_environment() -> list[str]:
+    """Return mirrors listed in the env_var environment variable."""
+    return os.environ.get(env_var, "").split()
+
+
+def is_local(location: str) -> bool:
+    """Return True if location is a local path rather than a URL."""
+    return "://" not in location
+
+
+def locate(mirror: str, version: str, filename: str) -> str:
+    """Return the URL or the path of the archive on mirror."""
+    if "%(" in mirror:
+        location = mirror % {"version": version}
+    elif is_local(mirror):
+        location = os.path.join(mirror, filename)
+    else:
+        location = mirror.rstrip("/") + "/" + filename
+    if location.startswith("file://"):
+        location = urllib.request.url2pathname(urllib.parse.urlsplit(location).path)
+    return location
+
+
+def _load_history(path: pathlib.Path) -> dict:
+    try:
+        with open(path, "r") as file:
+            history = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return history if isinstance(history, dict) else {}
+
+
+# Serializes the updates of the history by the threads of this process, CacheLock
+# serializes them between processes.
+_history_lock = threading.Lock()
+
+
+def _record_throughput(path: pathlib.Path, url: str, throughput: float) -> None:
+    """Remember the throughput of the host of url.
+
+    The history only orders the mirrors, failing to update it is reported as a
+    warning.
+    """
+    try:
+        os.makedirs(path.parent, exist_ok=True)
+        with _history_lock, _cache_lock.CacheLock(path):
+            history = _load_history(path)
+            history[urllib.parse.urlsplit(url).netloc] = throughput
+            tmp_path = path.with_name(f"{path.name}.{os.getpid()}.new")
+            with open(tmp_path, "w") as file:
+                json.dump(history, file)
+            os.replace(tmp_path, path)
+    except OSError as e:
+        print(
+            f"WARNING: Couldn't record the throughput of {url} in {path}: {e}",
+            file=sys.stderr,
+        )
+
+
+def _probe(url: str, timeout: float) -> float | None:
+    """Return the time to first byte of url in seconds, None if it's unreachable."""
+    start = time.monotonic()
+    try:
+        with urllib.request.urlopen(
+            urllib.request.Request(url, headers={"Range": "bytes=0-0"}),
+            timeout=timeout,
+        ):
+            return time.monotonic() - start
+    except _fetch_errors:
+        return None
+
+
+def order_locations(
+    locations: list[str],
+    upstream: str,
+    history_path: pathlib.Path = default_history_path,
+    timeout: float = 5.0,
+) -> list[str]:
+    """Return locations in the order in which they should be tried.
+
+    Missing local files are left out, upstream is always the last location.
+    """
+    local = [
+        location
+        for location in locations
+        if is_local(location) and os.access(location, os.F_OK)
+    ]
+    remote = [
+        location
+        for location in dict.fromkeys(locations)
+        if not is_local(location) and location != upstream
+    ]
+    if not remote:
+        return local + [upstream]
+
+    history = _load_history(history_path)
+    size, _ = _download.estimate_size(upstream)
+    with concurrent.futures.ThreadPoolExecutor(len(remote)) as executor:
+        latencies = list(executor.map(lambda url: _probe(url, timeout), remote))
+
+    def estimate(item: tuple[str, float | None]) -> float:
+        url, latency = item
+        if latency is None:
+            return float("inf")
+        throughput = history.get(urllib.parse.urlsplit(url).netloc)
+        if not isinstance(throughput, (int, float)) or throughput <= 0:
+            throughput = _assumed_throughput
+        return latency + size / throughput
+
+    # Unreachable mirrors are kept at the end, the probe may have failed by chance.
+    ordered = sorted(zip(remote, latencies), key=estimate)
+    return local + [url for url, _ in ordered] + [upstream]
+
+
+def _copy_local(
+    source: str, path: pathlib.Path, sink: typing.Callable[[memoryview], None] | None
+) -> str:
+    """Copy local archive source to path, return its SHA-256 digest."""
+    if sink is None:
+        # Mirrors may be shared, the copy mustn't be a hard link.
+        path.unlink(missing_ok=True)
+        _fileio.clone_file(source, path)
+        return _fileio.hash_file(path)
+    sha256 = hashlib.sha256()
+    with open(source, "rb") as src_file, open(path, "wb") as dst_file:
+        for chunk in _fileio.iter_readinto(src_file):
+            dst_file.write(chunk)
+            sha256.update(chunk)
+            sink(chunk)
+    return sha256.hexdigest()
+
+
+def fetch(
+    locations: list[str],
+    path: pathlib.Path,
+    connections: int = 4,
+    sink: typing.Callable[[memoryview], None] | None = None,
+    progress: typing.Callable[[int], None] | None = None,
+    events: typing.TextIO | None = None,
+    history_path: pathlib.Path = default_history_path,
+) -> str:
+    """Fetch the archive from the first working location into path.
+
+    The arguments have the same meaning as in _download.fetch_with_progress(). If sink
+    has already received data from a mirror which failed, the error is raised, the
+    data can't be taken back.
+
+    Return the SHA-256 digest of the archive.
+    """
+    fed = False
+
+    def counting_sink(data: memoryview) -> None:
+        nonlocal fed
+        fed = True
+        sink(data)
+
+    for index, location in enumerate(locations):
+        last = index == len(locations) - 1
+        try:
+            if is_local(location):
+                print(f"Copying {location}...", file=sys.stderr)
+                sha256 = _copy_local(
+                    location, path, None if sink is None else counting_sink
+                )
+                if progress is not None:
+                    progress(os.path.getsize(path))
+                # A download of another location may have been interrupted before.
+                state_path = path.with_name(path.name + _download.state_suffix)
+                state_path.unlink(missing_ok=True)
+                return sha256
+            print(f"Fetching {location}...", file=sys.stderr)
+            start = time.monotonic()
+            sha256 = _download.fetch_with_progress(
+                location,
+                path,
+                connections=connections,
+                sink=None if sink is None else counting_sink,
+                progress=progress,
+                events=events,
+            )
+            _record_throughput(
+                history_path,
+                location,
+                os.path.getsize(path) / max(time.monotonic() - start, 1e-3),
+            )
+            return sha256
+        except _fetch_errors as e:
+            if last or fed:
+                raise
+            print(
+                f"WARNING: Fetching from {location} failed: {e}.",
+                "Trying the next mirror...",
+                file=sys.stderr,
+            )
+    raise ValueError("No location to fetch the archive from!")
@@ -0,0 +1,202 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper module used to create a slim copy of the platform/development archive.
+
+The build uses only a few files of the ~250 MiB platform/development archive. Meson
+would extract all of it into every new source directory. A slim archive containing
+only the needed subtree is used instead. Its provenance (the name and the SHA-256
+digest of the original archive) is recorded in a small JSON file next to it so that
+generate_sbom.py can refer to the original archive.
+
+This module depends on the Python standard library only.
+"""
+
+# ########################################################
+# #               WARNING WARNING WARNING                #
+# #               =======================                #
+# # If you edit this file, make sure that you rerun      #
+# # initialize_build_template.py, otherwise your changes #
+# # will not take effect in generate_sbom.py!            #
+# ########################################################
+
+import gzip
+import json
+import os
+import pathlib
+import queue
+import tarfile
+import threading
+import typing
+
+# Members of the archive needed for the build. The patches in
+# build_template/subprojects/packagefiles/diff_files must apply to this subtree too.
+member_prefixes = ("host/windows/usb/",)
+
+# Suffix of the file recording the provenance of a slim archive.
+provenance_suffix = ".provenance.json"
+
+
+def slim_filename(filename: str) -> str:
+    """Return the name of the slim archive created from archive filename."""
+    return filename.removesuffix(".tar.gz") + "-slim.tar.gz"
+
+
+def provenance_path(path: pathlib.Path) -> pathlib.Path:
+    """Return the path of the provenance file of slim archive path."""
+    return path.with_name(path.name + provenance_suffix)
+
+
+def is_needed(name: str) -> bool:
+    """Return True if the archive member name is needed for the build."""
+    return name.removeprefix("./").startswith(member_prefixes)
+
+
+def read_provenance(path: pathlib.Path) -> dict | None:
+    """Return the provenance of slim archive path or None if it isn't recorded."""
+    try:
+        with open(provenance_path(path), "r") as file:
+            provenance = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    return provenance if isinstance(provenance, dict) else None
+
+
+def copy_needed_members(source: tarfile.TarFile, destination: tarfile.TarFile) -> None:
+    """Copy needed members of streamed source into destination."""
+    for member in source:
+        if not is_needed(member.name):
+            continue
+        fileobj = source.extractfile(member) if member.isfile() else None
+        destination.addfile(member, fileobj)
+
+
+def open_slim_writer(out: typing.BinaryIO) -> tuple[gzip.GzipFile, tarfile.TarFile]:
+    """Open a tar stream writing a reproducible .tar.gz into out."""
+    # mtime=0 makes the output depend only on the contents of the original archive.
+    compressed = gzip.GzipFile(fileobj=out, mode="wb", mtime=0)
+    return compressed, tarfile.open(fileobj=compressed, mode="w|")
+
+
+def create_slim_archive(
+    source: pathlib.Path, destination: pathlib.Path, source_sha256: str
+) -> None:
+    """Create slim archive destination from source in a single streaming pass.
+
+    Arguments:
+        source: The original platform/development archive.
+        destination: The slim archive to create. Its provenance is written next to
+          it.
+        source_sha256: SHA-256 digest of source.
+    """
+    tmp_path = destination.with_name("tmp." + destination.name)
+    try:
+        with open(tmp_path, "wb") as out:
+            compressed, slim = open_slim_writer(out)
+            with compressed, slim, tarfile.open(source, "r|gz") as original:
+                copy_needed_members(original, slim)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, destination)
+    write_provenance(destination, source.name, source_sha256)
+
+
+class SlimArchiveStream:
+    """Create a slim archive from the original archive fed to it in chunks.
+
+    The original archive is decompressed and filtered in a background thread, so that
+    the slim archive can be created while the original archive is being fetched.
+
+    Arguments:
+        destination: The slim archive to create.
+        max_queued: Maximum number of chunks waiting to be processed. write() blocks
+          when the background thread can't keep up.
+    """
+
+    def __init__(self, destination: pathlib.Path, max_queued: int = 64) -> None:
+        self._destination = destination
+        self._tmp_path = destination.with_name("tmp." + destination.name)
+        self._queue = queue.Queue(max_queued)
+        self._buffer = memoryview(b"")
+        self._eof = False
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def write(self, data: bytes | memoryview) -> None:
+        """Feed the next chunk of the original archive."""
+        # data may be a view of a reused buffer.
+        self._queue.put(bytes(data))
+
+    def read(self, size: int = -1) -> bytes:
+        """Return at most size next bytes of the original archive, used by tarfile."""
+        while not self._buffer and not self._eof:
+            chunk = self._queue.get()
+            if chunk is None:
+                self._eof = True
+            else:
+                self._buffer = memoryview(chunk)
+        if size < 0:
+            size = len(self._buffer)
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return bytes(data)
+
+    def _run(self) -> None:
+        try:
+            with open(self._tmp_path, "wb") as out:
+                compressed, slim = open_slim_writer(out)
+                original = tarfile.open(fileobj=self, mode="r|gz")
+                with compressed, slim, original:
+                    copy_needed_members(original, slim)
+        except BaseException as e:
+            self._error = e
+        finally:
+            # tarfile doesn't read the end-of-archive padding. Consume everything
+            # until finish() or abort() is called, write() would block forever
+            # otherwise.
+            while not self._eof:
+                self._eof = self._queue.get() is None
+
+    def finish(self, source_filename: str, source_sha256: str) -> None:
+        """Finish the slim archive after the whole original archive has been fed."""
+        self._queue.put(None)
+        self._thread.join()
+        if self._error is not None:
+            self._tmp_path.unlink(missing_ok=True)
+            raise self._error
+        os.replace(self._tmp_path, self._destination)
+        write_provenance(self._destination, source_filename, source_sha256)
+
+    def abort(self) -> None:
+        """Stop processing and remove the incomplete slim archive."""
+        self._queue.put(None)
+        self._thread.join()
+        self._tmp_path.unlink(missing_ok=True)
+
+
+def write_provenance(
+    path: pathlib.Path, source_filename: str, source_sha256: str
+) -> None:
+    """Record the provenance of slim archive path."""
+    with open(provenance_path(path), "w") as file:
+        json.dump(
+            {
+                "source_filename": source_filename,
+                "source_sha256": source_sha256,
+                "member_prefixes": list(member_prefixes),
+            },
+            file,
+        )
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Random access to members of the cached platform/development archive.
+
+Reaching a single member of a .tar.gz requires decompressing everything before it.
+This module builds a persistent index of the archive: the offset and size of every
+member in the uncompressed tarball and a list of checkpoints at which decompression
+can start.
+
+Python's zlib can't resume decompression at an arbitrary position of a deflate
+stream (it would need inflatePrime()), so the checkpoints can't point into the
+original archive. A seekable copy of the archive is created instead. It is a single
+valid gzip stream compressed with a full flush every checkpoint_interval bytes of
+uncompressed data. A full flush resets the compressor and aligns the output to a
+byte boundary, decompression can start right after it without any prior state.
+
+The index records the SHA-256 digest of the original archive. It is rebuilt when the
+digest changes.
+
+This module depends on the Python standard library only.
+"""
+
+import argparse
+import bisect
+import gzip
+import json
+import os
+import pathlib
+import struct
+import sys
+import tarfile
+import typing
+import zlib
+
+script_dir = pathlib.Path(__file__).parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(script_dir.absolute()))
+
+    import _cache_lock
+    import _fileio
+    import _hashing
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+# Amount of uncompressed data between two checkpoints. At most this much data has to
+# be decompressed and thrown away to reach any member. Every checkpoint makes the
+# seekable copy slightly larger.
+checkpoint_interval = 2**20
+
+seekable_suffix = ".seekable.gz"
+index_suffix = ".index.json"
+
+_gzip_header = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def seekable_path(archive: pathlib.Path) -> pathlib.Path:
+    """Return the path of the seekable copy of archive."""
+    return archive.with_name(archive.name + seekable_suffix)
+
+
+def index_path(archive: pathlib.Path) -> pathlib.Path:
+    """Return the path of the index of archive."""
+    return archive.with_name(archive.name + index_suffix)
+
+
+class _CheckpointWriter:
+    """Compress a stream into a gzip file with a full flush every interval bytes."""
+
+    def __init__(self, out: typing.BinaryIO, interval: int) -> None:
+        self._out = out
+        self._interval = interval
+        self._compressor = zlib.compressobj(
+            zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15
+        )
+        self._crc = 0
+        self._size = 0
+        out.write(_gzip_header)
+        # [uncompressed offset, compressed offset] pairs.
+        self.checkpoints = [[0, out.tell()]]
+
+    def write(self, data: bytes | memoryview) -> None:
+        data = memoryview(data)
+        while data:
+            until_checkpoint = self._interval - self._size % self._interval
+            piece = data[:until_checkpoint]
+            data = data[len(piece) :]
+            self._crc = zlib.crc32(piece, self._crc)
+            self._size += len(piece)
+            self._out.write(self._compressor.compress(piece))
+            if self._size % self._interval == 0:
+                self._out.write(self._compressor.flush(zlib.Z_FULL_FLUSH))
+                self.checkpoints.append([self._size, self._out.tell()])
+
+    def close(self) -> None:
+        self._out.write(self._compressor.flush(zlib.Z_FINISH))
+        self._out.write(struct.pack("<II", self._crc, self._size & 0xFFFFFFFF))
+
+
+class _TeeReader:
+    """Pass everything read from source to writer."""
+
+    def __init__(self, source: typing.BinaryIO, writer: _CheckpointWriter) -> None:
+        self._source = source
+        self._writer = writer
+
+    def read(self, size: int = -1) -> bytes:
+        data = self._source.read(size)
+        self._writer.write(data)
+        return data
+
+    def drain(self) -> None:
+        for chunk in _fileio.iter_readinto(self._source):
+            self._writer.write(chunk)
+
+
+def build_index(archive: pathlib.Path, sha256: str) -> dict:
+    """Create the seekable copy and the index of archive, return the index.
+
+    Arguments:
+        archive: The .tar.gz to index.
+        sha256: SHA-256 digest of archive.
+    """
+    members = {}
+    seekable = seekable_path(archive)
+    tmp_path = seekable.with_name("tmp." + seekable.name)
+    try:
+        with open(tmp_path, "wb") as out, gzip.open(archive, "rb") as source:
+            writer = _CheckpointWriter(out, checkpoint_interval)
+            tee = _TeeReader(source, writer)
+            with tarfile.open(fileobj=tee, mode="r|") as tar:
+                for member in tar:
+                    if member.isfile():
+                        members[member.name.removeprefix("./")] = [
+                            member.offset_data,
+                            member.size,
+                        ]
+            # tarfile doesn't read the end-of-archive padding.
+            tee.drain()
+            writer.close()
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, seekable)
+
+    index = {
+        "source_sha256": sha256,
+        "checkpoint_interval": checkpoint_interval,
+        "checkpoints": writer.checkpoints,
+        "members": members,
+    }
+    path = index_path(archive)
+    tmp_path = path.with_name("tmp." + path.name)
+    with open(tmp_path, "w") as file:
+        json.dump(index, file)
+    os.replace(tmp_path, path)
+    return index
+
+
+def load_index(archive: pathlib.Path, sha256: str) -> dict | None:
+    """Return the index of archive or None if it's missing or outdated."""
+    try:
+        with open(index_path(archive), "r") as file:
+            index = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if (
+        not isinstance(index, dict)
+        or index.get("source_sha256") != sha256
+        or not os.access(seekable_path(archive), os.F_OK)
+    ):
+        return None
+    return index
+
+
+def get_index(
+    archive: pathlib.Path, cache: _hashing.DigestCache | None = None
+) -> dict:
+    """Return an up to date index of archive, build it if necessary."""
+    sha256 = _hashing.sha256_file(archive, cache)
+    index = load_index(archive, sha256)
+    if index is None:
+        # initialize_build_template.py may be replacing the archive or removing
+        # temporary files right now.
+        with _cache_lock.CacheLock(archive):
+            index = load_index(archive, sha256)
+            if index is None:
+                print(f"Indexing {archive.name}...", file=sys.stderr)
+                index = build_index(archive, sha256)
+    return index
+
+
+def read_member(archive: pathlib.Path, index: dict, name: str) -> bytes:
+    """Return the contents of member name of archive.
+
+    Raises:
+        KeyError: The archive has no regular file called name.
+    """
+    offset, size = index["members"][name.removeprefix("./")]
+    checkpoints = index["checkpoints"]
+    position = bisect.bisect_right(checkpoints, [offset, float("inf")]) - 1
+    uncompressed_offset, compressed_offset = checkpoints[position]
+
+    decompressor = zlib.decompressobj(-15)
+    skip = offset - uncompressed_offset
+    result = bytearray()
+    with open(seekable_path(archive), "rb") as file:
+        file.seek(compressed_offset)
+        while len(result) < size:
+            chunk = file.read(_fileio.buffer_size)
+            if not chunk:
+                raise EOFError(f"{seekable_path(archive)} is truncated")
+            data = decompressor.decompress(chunk)
+            if skip:
+                dropped = min(skip, len(data))
+                data = data[dropped:]
+                skip -= dropped
+            result += data
+    return bytes(result[:size])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("archive", help="The .tar.gz archive.")
+    parser.add_argument(
+        "--cache",
+        default=_hashing.default_cache_path,
+        type=pathlib.Path,
+        help="Digest cache to use. Default: %(default)s",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="Build the index if it is missing or outdated.")
+    subparsers.add_parser("list", help="List regular files of the archive.")
+    extract_parser = subparsers.add_parser(
+        "extract", help="Extract members of the archive."
+    )
+    extract_parser.add_argument("members", nargs="+", help="Members to extract.")
+    extract_parser.add_argument(
+        "-C",
+        "--directory",
+        default=".",
+        help=" ".join(
+            (
+                "Directory to extract the members into. Their paths in the archive",
+                "are kept. Default: current directory",
+            )
+        ),
+    )
+    args = parser.parse_args()
+
+    archive = pathlib.Path(args.archive)
+    index = get_index(archive, _hashing.DigestCache(args.cache))
+
+    if args.command == "list":
+        for name in index["members"]:
+            print(name)
+    elif args.command == "extract":
+        directory = pathlib.Path(args.directory)
+        for name in args.members:
+            name = name.removeprefix("./")
+            try:
+                data = read_member(archive, index, name)
+            except KeyError:
+                sys.exit(f"{name} is not a regular file in {archive}!")
+            # The index contains member names as they appear in the archive.
+            if pathlib.PurePosixPath(name).is_absolute() or ".." in name.split("/"):
+                sys.exit(f"Refusing to extract {name} outside of {directory}!")
+            destination = directory / name
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            destination.write_bytes(data)
@@ -0,0 +1,139 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper module used to keep the Meson source directory in sync with its template.
+
+Meson reconfigures (and rebuilds) the project when its build files are modified.
+Files are therefore written only when their contents differ from the wanted
+contents, unchanged files keep their modification time. A manifest in the
+destination directory records the files written by the previous sync along with
+their digests, unchanged files don't even have to be read. Files recorded in the
+manifest which are no longer wanted (they were removed from the template) are
+removed.
+
+This module depends on the Python standard library only.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import typing
+
+import _fileio
+
+# Name of the manifest in the destination directory.
+manifest_name = ".build_template.json"
+
+
+def _load_manifest(path: pathlib.Path) -> dict:
+    try:
+        with open(path, "r") as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def _stat_key(path: pathlib.Path) -> list[int] | None:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _current_digest(path: pathlib.Path, entry: dict | None) -> str | None:
+    """Return the SHA-256 digest of path, None if it doesn't exist."""
+    stat_key = _stat_key(path)
+    if stat_key is None:
+        return None
+    if entry is not None and entry.get("stat") == stat_key:
+        # The file hasn't been touched since the previous sync.
+        return entry["sha256"]
+    return _fileio.hash_file(path)
+
+
+def _remove(dest_dir: pathlib.Path, relpath: str) -> None:
+    """Remove dest_dir/relpath and its parent directories which became empty."""
+    path = dest_dir / relpath
+    path.unlink(missing_ok=True)
+    parent = path.parent
+    while parent != dest_dir:
+        try:
+            parent.rmdir()
+        except OSError:
+            # Not empty.
+            break
+        parent = parent.parent
+
+
+def sync(
+    dest_dir: pathlib.Path,
+    files: typing.Mapping[pathlib.PurePath, pathlib.Path | bytes],
+) -> dict[str, list[str]]:
+    """Make dest_dir contain files.
+
+    Arguments:
+        dest_dir: The destination directory. It is created if it doesn't exist.
+        files: Maps paths relative to dest_dir to the file which should be copied
+          there or to the contents which should be written there.
+
+    Returns a dict with lists of "written", "unchanged" and "removed" paths and
+    with the list of "strategies" used to copy files (see _fileio.clone_file()).
+    """
+    manifest_path = dest_dir / manifest_name
+    old_entries = _load_manifest(manifest_path).get("files", {})
+    if not isinstance(old_entries, dict):
+        old_entries = {}
+    entries = {}
+    result = {"written": [], "unchanged": [], "removed": [], "strategies": []}
+
+    for relpath, source in files.items():
+        relpath = pathlib.PurePath(relpath).as_posix()
+        path = dest_dir / relpath
+        if isinstance(source, bytes):
+            wanted = hashlib.sha256(source).hexdigest()
+        else:
+            wanted = _fileio.hash_file(source)
+        if _current_digest(path, old_entries.get(relpath)) != wanted:
+            os.makedirs(path.parent, exist_ok=True)
+            # Replace the file atomically, an interrupted sync mustn't leave a
+            # truncated file behind which the manifest doesn't know about.
+            tmp_path = path.with_name("tmp." + path.name)
+            if isinstance(source, bytes):
+                with open(tmp_path, "wb") as file:
+                    file.write(source)
+            else:
+                tmp_path.unlink(missing_ok=True)
+                strategy = _fileio.clone_file(source, tmp_path)
+                if strategy not in result["strategies"]:
+                    result["strategies"].append(strategy)
+            os.replace(tmp_path, path)
+            result["written"].append(relpath)
+        else:
+            result["unchanged"].append(relpath)
+        entries[relpath] = {"sha256": wanted, "stat": _stat_key(path)}
+
+    for relpath in old_entries:
+        if relpath not in entries:
+            _remove(dest_dir, relpath)
+            result["removed"].append(relpath)
+
+    if entries != old_entries:
+        tmp_path = manifest_path.with_name("tmp." + manifest_path.name)
+        with open(tmp_path, "w") as file:
+            json.dump({"files": entries}, file)
+        os.replace(tmp_path, manifest_path)
+    return result
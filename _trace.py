@@ -0,0 +1,167 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helper module used to record how long the phases of the release scripts take.
+
+Spans are written to a file in the JSON array format of the Chrome trace event format,
+which can be opened in chrome://tracing or https://ui.perfetto.dev. Every event is
+appended to the file as soon as its span ends, the closing bracket of the array is
+omitted (it is optional in this format). Several processes can therefore append to
+the same file, the timestamps are Unix times in microseconds, so all scripts of a
+release end up on a single timeline.
+
+Tracing is enabled by the --trace option of the scripts or by the env_var environment
+variable. Spans are no-ops when tracing is disabled.
+
+This module depends on the Python standard library only.
+"""
+
+# ########################################################
+# #               WARNING WARNING WARNING                #
+# #               =======================                #
+# # If you edit this file, make sure that you rerun      #
+# # initialize_build_template.py, otherwise your changes #
+# # will not take effect in generate_sbom.py!            #
+# ########################################################
+
+import argparse
+import atexit
+import contextlib
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+import typing
+
+# Environment variable containing the path of the trace file. It is inherited by
+# child processes, which append to the same file.
+env_var = "ADBWINAPI_TRACE"
+
+_fd = None
+_process_name = None
+
+
+def add_argument(parser: argparse.ArgumentParser) -> None:
+    """Add the --trace option to parser."""
+    parser.add_argument(
+        "--trace",
+        type=pathlib.Path,
+        default=os.environ.get(env_var) or None,
+        metavar="FILE",
+        help=" ".join(
+            (
+                "Append a Chrome trace of the phases of this script to FILE. Several",
+                "scripts can append to the same file. Default: the value of the",
+                f"{env_var} environment variable (tracing is disabled if unset)",
+            )
+        ),
+    )
+
+
+def _write(event: dict) -> None:
+    # A single write to a file opened in append mode isn't interleaved with writes of
+    # other processes.
+    os.write(_fd, (json.dumps(event) + ",\n").encode())
+
+
+def enable(path: pathlib.Path | None, process_name: str | None = None) -> None:
+    """Start appending spans to the trace file path. Do nothing if path is None.
+
+    process_name is shown in the trace instead of the PID, it defaults to the name of
+    the running script. A span covering the whole run of the process is recorded when
+    it exits.
+    """
+    global _fd, _process_name
+    if path is None or _fd is not None:
+        return
+    if process_name is None:
+        process_name = pathlib.Path(sys.argv[0]).name
+    _process_name = process_name
+
+    os.makedirs(path.parent, exist_ok=True)
+    # The opening bracket must be written exactly once, before any event. The file is
+    # prepared under a temporary name and linked into place, which fails if another
+    # process has been faster.
+    tmp_path = path.with_name(f"tmp.{os.getpid()}.{path.name}")
+    with open(tmp_path, "w") as file:
+        file.write("[\n")
+    try:
+        os.link(tmp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        tmp_path.unlink()
+    _fd = os.open(path, os.O_WRONLY | os.O_APPEND | getattr(os, "O_BINARY", 0))
+
+    _write(
+        {
+            "name": "process_name",
+            "ph": "M",
+            "pid": os.getpid(),
+            "args": {"name": process_name},
+        }
+    )
+    start = time.time_ns() // 1000
+    start_counter = time.perf_counter_ns()
+
+    def finish() -> None:
+        _write(
+            {
+                "name": process_name,
+                "cat": "process",
+                "ph": "X",
+                "ts": start,
+                "dur": (time.perf_counter_ns() - start_counter) // 1000,
+                "pid": os.getpid(),
+                "tid": threading.get_native_id(),
+            }
+        )
+        os.close(_fd)
+
+    atexit.register(finish)
+
+
+def is_enabled() -> bool:
+    """Return True if spans are recorded."""
+    return _fd is not None
+
+
+@contextlib.contextmanager
+def span(name: str, **args: typing.Any) -> typing.Iterator[None]:
+    """Record the time spent in the with block as a span named name.
+
+    args are shown in the details of the span, they must be serializable to JSON.
+    """
+    if _fd is None:
+        yield
+        return
+    start = time.time_ns() // 1000
+    start_counter = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        event = {
+            "name": name,
+            "cat": _process_name,
+            "ph": "X",
+            "ts": start,
+            "dur": (time.perf_counter_ns() - start_counter) // 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+        }
+        if args:
+            event["args"] = args
+        _write(event)
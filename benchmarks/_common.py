@@ -0,0 +1,256 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Helpers shared by the benchmarks.
+
+This module depends on the Python standard library only.
+"""
+
+import datetime
+import functools
+import gzip
+import http.server
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tarfile
+import threading
+import typing
+
+repo_dir = pathlib.Path(__file__).parent.parent
+
+_range_re = re.compile(r"^bytes=(\d+)-(\d*)$")
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file handler supporting single range requests and ETags.
+
+    This is a minimal stand-in for android.googlesource.com (which doesn't support
+    range requests) or for a HTTP cache (which usually does).
+    """
+
+    protocol_version = "HTTP/1.1"
+    support_ranges = True
+
+    def log_message(self, format, *args) -> None:  # noqa: A002
+        pass
+
+    def handle(self) -> None:
+        try:
+            super().handle()
+        except ConnectionResetError:
+            # Clients may reset the connection when they stop a download.
+            pass
+
+    def do_HEAD(self) -> None:  # noqa: N802
+        self._serve(send_body=False)
+
+    def do_GET(self) -> None:  # noqa: N802
+        self._serve(send_body=True)
+
+    def _serve(self, send_body: bool) -> None:
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        stat = os.stat(path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        start, end = 0, stat.st_size - 1
+        match = _range_re.match(self.headers.get("Range", ""))
+        if_range = self.headers.get("If-Range")
+        if (
+            self.support_ranges
+            and match is not None
+            and (if_range is None or if_range == etag)
+        ):
+            start = int(match[1])
+            if match[2]:
+                end = min(end, int(match[2]))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{stat.st_size}")
+        else:
+            self.send_response(200)
+        if self.support_ranges:
+            self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        if not send_body:
+            return
+        with open(path, "rb") as file:
+            file.seek(start)
+            remaining = end - start + 1
+            try:
+                while remaining > 0:
+                    block = file.read(min(2**18, remaining))
+                    if not block:
+                        break
+                    self.wfile.write(block)
+                    remaining -= len(block)
+            except (BrokenPipeError, ConnectionResetError):
+                # Clients close the connection when they have enough data.
+                pass
+
+
+class ArchiveServer:
+    """Serve files of a directory over HTTP in a background thread.
+
+    Arguments:
+        directory: Directory to serve.
+        support_ranges: Whether range requests should be honored.
+        handler: Request handler class, it must be derived from
+          RangeRequestHandler.
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path,
+        support_ranges: bool = True,
+        handler: type["RangeRequestHandler"] | None = None,
+    ) -> None:
+        handler = type(
+            "_Handler",
+            (handler or RangeRequestHandler,),
+            {"support_ranges": support_ranges},
+        )
+        self._server = http.server.ThreadingHTTPServer(
+            ("127.0.0.1", 0), functools.partial(handler, directory=str(directory))
+        )
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        """Return the URL of the served directory (with a trailing slash)."""
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def __enter__(self) -> "ArchiveServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def make_fake_archive(path: pathlib.Path, size: int, seed: int = 0) -> None:
+    """Create a .tar.gz resembling the platform/development archive.
+
+    The archive contains the host/windows/usb/ subtree used by the build and filler
+    files. It is compressed with level 1, the compression would take too long
+    otherwise. Its size is roughly size bytes.
+    """
+    rng = random.Random(seed)
+    usb_files = [
+        "host/windows/usb/api/AdbWinApi.cpp",
+        "host/windows/usb/api/AdbWinApi.rc",
+        "host/windows/usb/api/adb_api.cpp",
+        "host/windows/usb/api/adb_api.h",
+        "host/windows/usb/api/stdafx.cpp",
+        "host/windows/usb/api/stdafx.h",
+        "host/windows/usb/winusb/AdbWinUsbApi.cpp",
+        "host/windows/usb/winusb/AdbWinUsbApi.rc",
+        "host/windows/usb/winusb/stdafx.cpp",
+        "host/windows/usb/winusb/stdafx.h",
+    ]
+    with open(path, "wb") as raw, gzip.GzipFile(
+        fileobj=raw, mode="wb", compresslevel=1, mtime=0
+    ) as compressed, tarfile.open(fileobj=compressed, mode="w|") as tar:
+
+        def add(name: str, data: bytes) -> None:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+        for name in usb_files:
+            add(name, f"// {name}\n".encode() * 64)
+        index = 0
+        # Random data doesn't compress, the compressed size is close to the
+        # uncompressed size.
+        while raw.tell() < size:
+            add(f"filler/{index // 100}/{index}.bin", rng.randbytes(2**20))
+            index += 1
+
+
+def make_fake_patches(directory: pathlib.Path, count: int) -> list[pathlib.Path]:
+    """Create count unified diffs in directory, return their paths."""
+    directory.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for index in range(count):
+        path = directory / f"{index:04}-fake-patch.patch"
+        hunks = "".join(
+            f"@@ -{line},3 +{line},3 @@\n context\n-old line {line}\n+new line {line}\n"
+            for line in range(1, 400, 10)
+        )
+        path.write_text(
+            f"From: Fake Author <fake@example.com>\nSubject: [PATCH] Patch {index}\n\n"
+            f"--- a/host/windows/usb/api/file{index}.cpp\n"
+            f"+++ b/host/windows/usb/api/file{index}.cpp\n{hunks}"
+        )
+        paths.append(path)
+    return paths
+
+
+def git_commit() -> str | None:
+    """Return the commit the benchmarked tree is based on, if it can be determined."""
+    git_exe = shutil.which("git")
+    if git_exe is None:
+        return None
+    result = subprocess.run(
+        [git_exe, "rev-parse", "--verify", "HEAD"],
+        cwd=repo_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+
+def metadata() -> dict:
+    """Return info about the environment the benchmarks run in."""
+    return {
+        "timestamp": datetime.datetime.now(datetime.UTC).isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version,
+        "platform": platform.platform(),
+    }
+
+
+def write_results(path: pathlib.Path, results: dict) -> None:
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+        file.write("\n")
+
+
+def load_results(path: pathlib.Path) -> dict:
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def import_repo_module(name: str) -> typing.Any:
+    """Import a module of this repository the way the scripts import them."""
+    orig_path = sys.path.copy()
+    try:
+        sys.path.insert(1, str(repo_dir.absolute()))
+        return __import__(name)
+    finally:
+        sys.path = orig_path
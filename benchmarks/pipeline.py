@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End-to-end benchmark of the Python side of the release process.
+
+The steps of .github/workflows/release.yml which run Python scripts are run in order
+in a copy of this repository:
+
+1. initialize_build_template.py --full-archive fetches a fake platform/development
+   archive from a local HTTP server
+2. generate_sbom.py --fake-windows-version generates SBOMs for x86_64, x86 and
+   aarch64 (MSVC is replaced by fixed compiler info)
+3. initialize_wrap_build_template.py and zipfile create the release archive (MSVC
+   build artifacts are replaced by random data)
+4. finalize_sbom.py finalizes all SBOMs
+5. generate_wrap_file.py generates the wrap file
+6. _hashing.py generates SHA256SUM.txt
+
+Wall time and peak RSS of every stage are reported. If --baseline is specified, the
+results are compared with a previous run and this script fails if any stage regresses
+past the configured thresholds.
+
+Peak RSS is read from /proc on Linux and measured with os.wait4() on other POSIX
+systems (where it may be overestimated). It is unavailable on Windows.
+
+This script depends on the Python standard library only.
+"""
+
+import argparse
+import os
+import pathlib
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+if sys.version_info[0] != 3 or sys.version_info[1] < 11:
+    sys.exit("This script requires Python version >=3.11")
+
+script_dir = pathlib.Path(__file__).parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(script_dir.absolute()))
+
+    import _common
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+_archs = ("x86_64", "x86", "aarch64")
+
+# On Linux, ru_maxrss returned by os.wait4() includes the RSS this process had when
+# it spawned the stage. Stages are therefore run through this wrapper which reports
+# the peak RSS of the stage itself (VmHWM is reset by exec).
+_peak_rss_wrapper = """
+import atexit, runpy, sys
+
+def report(path=sys.argv.pop(1)):
+    with open("/proc/self/status") as status, open(path, "w") as out:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                out.write(line.split()[1])
+
+atexit.register(report)
+if sys.argv[1] == "-m":
+    del sys.argv[:2]
+    runpy.run_module(sys.argv[0], run_name="__main__", alter_sys=True)
+else:
+    del sys.argv[0]
+    runpy.run_path(sys.argv[0], run_name="__main__")
+"""
+
+
+def _run_stage(
+    commands: list[tuple[list[str], str | None]], cwd: pathlib.Path
+) -> dict:
+    """Run Python commands one after another, return their wall time and peak RSS.
+
+    Each command is an (args, stdout) tuple where args are arguments of the Python
+    interpreter. The standard output of the command is written into the file stdout
+    (relative to cwd) or it is discarded if stdout is None. Peak RSS is the maximum
+    of peak RSS of all commands.
+    """
+    peak_rss = None
+    use_wrapper = os.path.exists("/proc/self/status")
+    start = time.perf_counter()
+    for command, stdout_name in commands:
+        stdout_path = os.devnull if stdout_name is None else cwd / stdout_name
+        # stderr is kept in case something fails. It is not a pipe, the process
+        # could block on a full pipe before os.wait4() returns.
+        with open(stdout_path, "wb") as stdout, tempfile.TemporaryFile() as stderr:
+            if use_wrapper:
+                rss_path = cwd / "peak_rss.txt"
+                args = [sys.executable, "-c", _peak_rss_wrapper, rss_path, *command]
+            else:
+                args = [sys.executable, *command]
+            process = subprocess.Popen(args, cwd=cwd, stdout=stdout, stderr=stderr)
+            rss = None
+            if use_wrapper:
+                process.wait()
+                if process.returncode == 0:
+                    rss = int(rss_path.read_text()) * 1024
+                    rss_path.unlink()
+            elif hasattr(os, "wait4"):
+                _, status, rusage = os.wait4(process.pid, 0)
+                process.returncode = os.waitstatus_to_exitcode(status)
+                # ru_maxrss is in bytes on macOS and in kibibytes elsewhere.
+                rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+            else:
+                process.wait()
+            if process.returncode != 0:
+                stderr.seek(0)
+                sys.exit(
+                    f"Command {command} failed with exit status "
+                    f"{process.returncode}:\n" + stderr.read().decode(errors="replace")
+                )
+            if rss is not None:
+                peak_rss = rss if peak_rss is None else max(peak_rss, rss)
+    return {"wall_s": time.perf_counter() - start, "peak_rss_bytes": peak_rss}
+
+
+def _copy_checkout(destination: pathlib.Path) -> None:
+    """Copy this repository without generated files the way actions/checkout would."""
+    shutil.copytree(
+        _common.repo_dir,
+        destination,
+        ignore=shutil.ignore_patterns(
+            ".git", "cache", "benchmarks", "__pycache__", "requests.jsonl"
+        ),
+    )
+
+
+def _make_release_dir(release_dir: pathlib.Path, size: int) -> None:
+    """Create fake build artifacts resembling the installed libraries."""
+    rng = random.Random(0)
+    for arch in _archs:
+        arch_dir = release_dir if arch == "x86_64" else release_dir / arch
+        (arch_dir / arch).mkdir(parents=True, exist_ok=True)
+        for library in ("AdbWinApi", "AdbWinUsbApi"):
+            for suffix, share in ((".dll", 0.3), (".lib", 0.03), (".pdb", 0.67)):
+                size_share = int(size / len(_archs) / 2 * share)
+                (arch_dir / arch / (library + suffix)).write_bytes(
+                    rng.randbytes(size_share)
+                )
+    include_dir = release_dir / "include" / "host" / "windows" / "usb" / "api"
+    include_dir.mkdir(parents=True)
+    for header in ("adb_api.h", "adb_winusb_api.h", "adb_api_legacy.h"):
+        (include_dir / header).write_text(f"// {header}\n" * 100)
+
+
+def run_pipeline(
+    workdir: pathlib.Path, archive: pathlib.Path, release_size: int
+) -> dict[str, dict]:
+    """Run the whole pipeline once in workdir, return results of all stages."""
+    checkout = workdir / "checkout"
+    _copy_checkout(checkout)
+    with open(checkout / "VERSION.txt", "r") as file:
+        project_version = file.read().strip()
+    android_tools_version = archive.name.removeprefix(
+        "platform-tools-"
+    ).removesuffix(".tar.gz")
+    results = {}
+
+    with _common.ArchiveServer(archive.parent) as server:
+        results["initialize_build_template"] = _run_stage(
+            [
+                (
+                    [
+                        "initialize_build_template.py",
+                        "build_source",
+                        # Like release.yml, the source release archive must be complete.
+                        "--full-archive",
+                        "--android-tools-version",
+                        android_tools_version,
+                        "--source-archive-url",
+                        server.url + "platform-tools-%(version)s.tar.gz",
+                    ],
+                    None,
+                )
+            ],
+            checkout,
+        )
+
+    release_dir_name = f"AdbWinApi-{project_version}"
+    sbom_names = [
+        f"AdbWinApi-{project_version}-{arch}-sbom.cyclonedx.json" for arch in _archs
+    ]
+    results["generate_sbom"] = _run_stage(
+        [
+            (
+                [
+                    "build_source/generate_sbom.py",
+                    "build_source",
+                    "pkg:github/meator/AdbWinApi",
+                    project_version,
+                    android_tools_version,
+                    "https://github.com/meator/AdbWinApi/blob/${ref}/${path}",
+                    "--ref",
+                    "0" * 40,
+                    "https://github.com/meator/AdbWinApi",
+                    "--fake-windows-version",
+                    "--github-runner",
+                    "windows-2022",
+                    "--msvc-dev-cmd",
+                    "0b201ec74fa43914dc39ae48a89fd1d8cb592756",
+                    "--action-gh-release",
+                    "72f2c25fcb47643c292f7107632f7a47c1df5cd8",
+                    arch,
+                    "little",
+                    "1.8.2",
+                    "19.44.35211",
+                    "1944",
+                    "194435211",
+                    "0x0E00",
+                ],
+                sbom_name,
+            )
+            for arch, sbom_name in zip(_archs, sbom_names)
+        ],
+        checkout,
+    )
+
+    _make_release_dir(checkout / release_dir_name, release_size)
+    release_archive = f"{release_dir_name}.zip"
+    results["create_release_archive"] = _run_stage(
+        [
+            (["initialize_wrap_build_template.py", release_dir_name], None),
+            (["-m", "zipfile", "-c", release_archive, release_dir_name], None),
+        ],
+        checkout,
+    )
+
+    results["finalize_sbom"] = _run_stage(
+        [
+            (
+                [
+                    "finalize_sbom.py",
+                    release_archive,
+                    "https://github.com/meator/AdbWinApi/releases/download/"
+                    f"{project_version}/{release_archive}",
+                    *sbom_names,
+                ],
+                None,
+            )
+        ],
+        checkout,
+    )
+
+    results["generate_wrap_file"] = _run_stage(
+        [(["generate_wrap_file.py", release_archive, "AdbWinApi.wrap"], None)],
+        checkout,
+    )
+
+    results["sha256sum"] = _run_stage(
+        [(["_hashing.py", release_archive, *sbom_names], "SHA256SUM.txt")],
+        checkout,
+    )
+
+    return results
+
+
+def _aggregate(runs: list[dict[str, dict]]) -> dict[str, dict]:
+    """Return the median wall time and the maximum peak RSS of every stage."""
+    result = {}
+    for stage in runs[0]:
+        rss = [run[stage]["peak_rss_bytes"] for run in runs]
+        result[stage] = {
+            "runs": len(runs),
+            "wall_s": statistics.median(run[stage]["wall_s"] for run in runs),
+            "peak_rss_bytes": None if None in rss else max(rss),
+        }
+    rss = [
+        stage["peak_rss_bytes"]
+        for stage in result.values()
+        if stage["peak_rss_bytes"] is not None
+    ]
+    result["total"] = {
+        "runs": len(runs),
+        "wall_s": sum(stage["wall_s"] for stage in result.values()),
+        "peak_rss_bytes": max(rss) if rss else None,
+    }
+    return result
+
+
+def _find_regressions(
+    results: dict[str, dict],
+    baseline: dict[str, dict],
+    max_ratio: float,
+    min_delta_s: float,
+) -> list[str]:
+    """Return descriptions of stages regressed compared to baseline.
+
+    A stage regresses if its wall time or peak RSS is more than max_ratio times the
+    baseline. Wall time differences smaller than min_delta_s are ignored, short
+    stages are too noisy.
+    """
+    regressions = []
+    for stage, result in results.items():
+        if stage not in baseline:
+            continue
+        old = baseline[stage]
+        if (
+            result["wall_s"] > old["wall_s"] * max_ratio
+            and result["wall_s"] - old["wall_s"] > min_delta_s
+        ):
+            regressions.append(
+                f"{stage}: wall time {old['wall_s']:.3f}s -> {result['wall_s']:.3f}s"
+            )
+        if (
+            result["peak_rss_bytes"] is not None
+            and old.get("peak_rss_bytes") is not None
+            and result["peak_rss_bytes"] > old["peak_rss_bytes"] * max_ratio
+        ):
+            regressions.append(
+                f"{stage}: peak RSS {old['peak_rss_bytes'] / 2**20:.1f}MiB -> "
+                f"{result['peak_rss_bytes'] / 2**20:.1f}MiB"
+            )
+    return regressions
+
+
+def _print_results(results: dict[str, dict]) -> None:
+    for stage, result in results.items():
+        rss = result["peak_rss_bytes"]
+        rss_str = "n/a" if rss is None else f"{rss / 2**20:.1f} MiB"
+        print(f"{stage:<28} {result['wall_s']:>9.3f} s   peak RSS {rss_str:>11}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--archive-size",
+        type=int,
+        default=250,
+        help="Size of the fake platform/development archive in MiB. "
+        "Default: %(default)s",
+    )
+    parser.add_argument(
+        "--release-size",
+        type=int,
+        default=4,
+        help="Size of the fake build artifacts in MiB. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of runs of the whole pipeline. Default: %(default)s",
+    )
+    parser.add_argument("--output", help="Save the results as JSON into this file.")
+    parser.add_argument(
+        "--baseline",
+        help="Compare the results with results saved in this file and fail if any "
+        "stage has regressed.",
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=1.25,
+        help="Maximum allowed ratio of wall time and peak RSS of a stage to the "
+        "baseline. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--min-delta",
+        type=float,
+        default=0.1,
+        help="Wall time differences (in seconds) smaller than this are never "
+        "considered a regression. Default: %(default)s",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="adbwinapi-bench-") as tmpdir:
+        workdir = pathlib.Path(tmpdir)
+        with open(_common.repo_dir / "ANDROID_TOOLS_VERSION.txt", "r") as file:
+            # Avoid importing _strip_comments, the benchmarked scripts are run as
+            # subprocesses only.
+            android_tools_version = [
+                line for line in file.read().splitlines() if not line.startswith("#")
+            ][-1].strip()
+        archive = workdir / "server" / f"platform-tools-{android_tools_version}.tar.gz"
+        archive.parent.mkdir()
+        print("Creating the fake archive...", file=sys.stderr)
+        _common.make_fake_archive(archive, args.archive_size * 2**20)
+
+        runs = []
+        for index in range(args.repeat):
+            print(
+                f"Running the pipeline ({index + 1}/{args.repeat})...", file=sys.stderr
+            )
+            run_dir = workdir / f"run{index}"
+            run_dir.mkdir()
+            runs.append(run_pipeline(run_dir, archive, args.release_size * 2**20))
+            shutil.rmtree(run_dir)
+
+    results = _aggregate(runs)
+    _print_results(results)
+
+    if args.output is not None:
+        _common.write_results(
+            pathlib.Path(args.output),
+            {"metadata": _common.metadata(), "results": results},
+        )
+
+    if args.baseline is not None:
+        baseline = _common.load_results(pathlib.Path(args.baseline))["results"]
+        regressions = _find_regressions(
+            results, baseline, args.max_regression, args.min_delta
+        )
+        if regressions:
+            sys.exit("Regressed stages:\n" + "\n".join(regressions))
+        print("No stage has regressed.")
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Micro-benchmarks of the I/O primitives used by the release scripts.
+
+Synthetic inputs (a fake platform/development archive, patches) are created in a
+temporary directory, the archive is served by a local HTTP server. Nothing is fetched
+from the internet.
+
+Results are printed and optionally saved as JSON. Use --compare to compare them with
+results saved earlier (for example on another commit).
+
+This script depends on the Python standard library only.
+"""
+
+import argparse
+import contextlib
+import io
+import pathlib
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import typing
+
+# generate_sbom.py requires 3.11
+if sys.version_info[0] != 3 or sys.version_info[1] < 11:
+    sys.exit("This script requires Python version >=3.11")
+
+script_dir = pathlib.Path(__file__).parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(script_dir.absolute()))
+
+    import _common
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+_download = _common.import_repo_module("_download")
+_hashing = _common.import_repo_module("_hashing")
+_strip_comments = _common.import_repo_module("_strip_comments")
+_tar_index = _common.import_repo_module("_tar_index")
+generate_sbom = _common.import_repo_module("generate_sbom")
+
+
+def _measure(
+    function: typing.Callable[[], typing.Any],
+    repeat: int,
+    size: int | None = None,
+    setup: typing.Callable[[], typing.Any] | None = None,
+) -> dict:
+    """Run function repeat times, return latency and throughput statistics.
+
+    Arguments:
+        function: Benchmarked function.
+        repeat: Number of runs.
+        size: Number of bytes processed by a single run. Throughput is reported only
+          if set.
+        setup: Function run before every run, it isn't measured.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        # Progress output of the measured functions would only slow them down.
+        with contextlib.redirect_stderr(io.StringIO()):
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+    result = {
+        "runs": repeat,
+        "min_s": min(times),
+        "median_s": statistics.median(times),
+        "max_s": max(times),
+    }
+    if size is not None:
+        result["bytes"] = size
+        result["throughput_mib_s"] = size / 2**20 / min(times)
+    return result
+
+
+def _unlink(path: pathlib.Path) -> typing.Callable[[], None]:
+    """Return a function removing path and its download state."""
+
+    def unlink() -> None:
+        for leftover in (path, path.with_name(path.name + _download.state_suffix)):
+            leftover.unlink(missing_ok=True)
+
+    return unlink
+
+
+def run(
+    workdir: pathlib.Path, archive_size: int, patch_count: int, repeat: int
+) -> dict:
+    """Run all benchmarks in workdir, return the results."""
+    results = {}
+
+    archive_dir = workdir / "server"
+    archive_dir.mkdir()
+    archive = archive_dir / "platform-tools-0.0.0.tar.gz"
+    print("Creating the fake archive...", file=sys.stderr)
+    _common.make_fake_archive(archive, archive_size)
+    size = archive.stat().st_size
+
+    print("Benchmarking hashing...", file=sys.stderr)
+    results["sha256_file"] = _measure(
+        lambda: _hashing.sha256_file(archive), repeat, size
+    )
+    digest_cache_path = workdir / "digests.json"
+    _hashing.sha256_file(archive, _hashing.DigestCache(digest_cache_path))
+    results["sha256_file[cached]"] = _measure(
+        lambda: _hashing.sha256_file(archive, _hashing.DigestCache(digest_cache_path)),
+        repeat,
+    )
+
+    print("Benchmarking the archive index...", file=sys.stderr)
+    archive_sha256 = _hashing.sha256_file(archive)
+    results["tar_index_build"] = _measure(
+        lambda: _tar_index.build_index(archive, archive_sha256), repeat, size
+    )
+    index = _tar_index.load_index(archive, archive_sha256)
+    results["tar_index_read_member"] = _measure(
+        lambda: _tar_index.read_member(
+            archive, index, "host/windows/usb/winusb/stdafx.h"
+        ),
+        repeat * 100,
+    )
+    for path in (_tar_index.seekable_path(archive), _tar_index.index_path(archive)):
+        path.unlink()
+
+    print("Benchmarking fetching...", file=sys.stderr)
+    fetched = workdir / "fetched.tar.gz"
+    for support_ranges in (False, True):
+        with _common.ArchiveServer(archive_dir, support_ranges) as server:
+            url = server.url + archive.name
+            for connections in (1, 4):
+                name = (
+                    f"fetch_with_progress[ranges={support_ranges},"
+                    f"connections={connections}]"
+                )
+                results[name] = _measure(
+                    lambda: _download.fetch_with_progress(
+                        url, fetched, connections=connections, size_history=None
+                    ),
+                    repeat,
+                    size,
+                    setup=_unlink(fetched),
+                )
+    _unlink(fetched)()
+
+    print("Benchmarking patch processing...", file=sys.stderr)
+    patches = _common.make_fake_patches(workdir / "patches", patch_count)
+    patches_size = sum(patch.stat().st_size for patch in patches)
+
+    def process_patches() -> list[dict]:
+        return [
+            generate_sbom._process_patch(
+                patch,
+                workdir,
+                pathlib.Path("build_template"),
+                lambda path: f"https://example.com/{path.as_posix()}",
+            )
+            for patch in patches
+        ]
+
+    results["process_patch"] = _measure(process_patches, repeat, patches_size)
+    processed = process_patches()
+    half = len(processed) // 2
+    results["merge_patches"] = _measure(
+        lambda: generate_sbom._merge_patches(processed[:half], processed), repeat
+    )
+    without_urls = [
+        {**patch, "diff": {"text": patch["diff"]["text"]}} for patch in processed
+    ]
+    results["merge_patches[no_urls]"] = _measure(
+        lambda: generate_sbom._merge_patches(without_urls[:half], without_urls),
+        repeat,
+    )
+
+    print("Benchmarking the remaining primitives...", file=sys.stderr)
+
+    def read_version() -> str:
+        with open(_common.repo_dir / "ANDROID_TOOLS_VERSION.txt", "r") as file:
+            return _strip_comments.read_file_with_comments(file)
+
+    results["read_file_with_comments"] = _measure(read_version, repeat * 100)
+
+    template_copy = workdir / "build_template"
+    results["copytree_build_template"] = _measure(
+        lambda: shutil.copytree(
+            _common.repo_dir / "build_template", template_copy, dirs_exist_ok=True
+        ),
+        repeat,
+        setup=lambda: shutil.rmtree(template_copy, ignore_errors=True),
+    )
+
+    return results
+
+
+def _print_results(results: dict, baseline: dict | None) -> None:
+    for name, result in results.items():
+        line = f"{name:<52} median {result['median_s'] * 1000:>10.3f} ms"
+        if "throughput_mib_s" in result:
+            line += f" {result['throughput_mib_s']:>9.1f} MiB/s"
+        if baseline is not None and name in baseline:
+            ratio = result["median_s"] / baseline[name]["median_s"]
+            line += f"  ({ratio:.2f}x baseline)"
+        print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "--archive-size",
+        type=int,
+        default=250,
+        help="Size of the fake archive in MiB. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--patches",
+        type=int,
+        default=500,
+        help="Number of fake patches. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=3,
+        help="Number of runs of every benchmark. Default: %(default)s",
+    )
+    parser.add_argument("--output", help="Save the results as JSON into this file.")
+    parser.add_argument(
+        "--compare", help="Compare the results with results saved in this file."
+    )
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare is not None:
+        baseline = _common.load_results(pathlib.Path(args.compare))["results"]
+
+    with tempfile.TemporaryDirectory(prefix="adbwinapi-bench-") as workdir:
+        results = run(
+            pathlib.Path(workdir), args.archive_size * 2**20, args.patches, args.repeat
+        )
+
+    _print_results(results, baseline)
+
+    if args.output is not None:
+        _common.write_results(
+            pathlib.Path(args.output),
+            {"metadata": _common.metadata(), "results": results},
+        )
@@ -14,9 +14,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-"""Script used to point SBOM to a release archive.
+"""Script used to point SBOMs to a release archive.
 
-This script expects the output of generate_sbom.py as input.
+This script expects the output of generate_sbom.py as input. Any number of SBOMs can be
+finalized at once, the release archive is hashed only once.
 
 See https://github.com/meator/AdbWinApi/blob/main/README.md#software-bill-of-materials
 for more info.
@@ -25,45 +26,39 @@ for more info.
 # https://cyclonedx.org/docs/1.6/json/
 
 import argparse
-import hashlib
+import concurrent.futures
+import glob
 import json
+import os
+import shutil
+import sys
+import tempfile
 from pathlib import Path
 
-_block_size = 4096
+script_dir = Path(__file__).parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(script_dir.absolute()))
 
+    import _hashing
+    import _trace
+finally:
+    sys.path = _orig_path
+    del _orig_path
 
-def _sha256_hash_file(path: Path) -> str:
-    """Return the string sha256sum of provided path."""
-    with path.open("rb") as file:
-        sha256hash = hashlib.sha256()
-        while True:
-            block = file.read(_block_size)
-            if not block:
-                break
-            sha256hash.update(block)
-        return sha256hash.hexdigest()
 
+def _finalize_sbom(
+    transform_file: Path, archive_path: Path, archive_url: str, archive_hash: dict
+) -> None:
+    """Point the SBOM in transform_file to the release archive.
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
-    parser.add_argument("archive_path", help="Path to the release archive.")
-    parser.add_argument("archive_url", help="URL of the archive")
-    parser.add_argument(
-        "transform_file",
-        help="File to read original SBOM from and to write the modified SBOM into.",
-    )
-    args = parser.parse_args()
-
-    archive_path = Path(args.archive_path)
-
-    with open(args.transform_file) as input:
+    The file is replaced atomically.
+    """
+    with _trace.span("JSON load", file=transform_file.name), open(
+        transform_file
+    ) as input:
         document = json.load(input)
 
-    archive_hash = {
-        "alg": "SHA-256",
-        "content": _sha256_hash_file(archive_path),
-    }
-
     root = document["metadata"]["component"]
     root["type"] = "file"
     root["name"] = archive_path.name
@@ -71,10 +66,83 @@ if __name__ == "__main__":
     root["externalReferences"].append(
         {
             "type": "distribution",
-            "url": args.archive_url,
+            "url": archive_url,
             "hashes": [archive_hash],
         }
     )
 
-    with open(args.transform_file, "w") as output:
-        json.dump(document, output)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=transform_file.parent, prefix="tmp", suffix=".json", delete=False
+    ) as output:
+        try:
+            with _trace.span("JSON dump", file=transform_file.name):
+                json.dump(document, output)
+        except BaseException:
+            output.close()
+            os.remove(output.name)
+            raise
+    # NamedTemporaryFile() creates files readable only by the owner.
+    shutil.copymode(transform_file, output.name)
+    os.replace(output.name, transform_file)
+
+
+def _expand_globs(patterns: list[str]) -> list[Path]:
+    """Expand patterns containing glob wildcards, keep other paths unchanged.
+
+    The paths are resolved and every file is returned only once, so that no file is
+    transformed by two workers at once.
+    """
+    result = []
+    for pattern in patterns:
+        if not any(char in pattern for char in "*?["):
+            result.append(Path(pattern))
+            continue
+        matches = sorted(glob.glob(pattern))
+        if not matches:
+            sys.exit(f"The pattern '{pattern}' doesn't match any file!")
+        result.extend(Path(match) for match in matches)
+    return list(dict.fromkeys(path.resolve() for path in result))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("archive_path", help="Path to the release archive.")
+    parser.add_argument("archive_url", help="URL of the archive")
+    parser.add_argument(
+        "transform_files",
+        nargs="+",
+        help=(
+            "Files to read original SBOMs from and to write the modified SBOMs into. "
+            "Glob patterns are expanded."
+        ),
+    )
+    _trace.add_argument(parser)
+    args = parser.parse_args()
+
+    _trace.enable(args.trace)
+
+    archive_path = Path(args.archive_path)
+    transform_files = _expand_globs(args.transform_files)
+
+    with _trace.span("hashing", file=archive_path.name):
+        archive_hash = {
+            "alg": "SHA-256",
+            "content": _hashing.sha256_file(archive_path, _hashing.DigestCache()),
+        }
+
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = [
+            executor.submit(
+                _finalize_sbom,
+                transform_file,
+                archive_path,
+                args.archive_url,
+                archive_hash,
+            )
+            for transform_file in transform_files
+        ]
+        for future in futures:
+            future.result()
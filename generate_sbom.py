@@ -48,12 +48,18 @@ info about the SBOM generation process.
 # https://cyclonedx.org/docs/1.6/json/
 
 import argparse
+import base64
+import concurrent.futures
 import configparser
+import copy
 import datetime
+import gzip
 import hashlib
-import itertools
+import io
 import json
+import os
 import platform
+import re
 import shutil
 import string
 import subprocess
@@ -62,8 +68,6 @@ import typing
 import uuid
 from pathlib import Path
 
-_block_size = 4096
-
 # string.Template().get_identifiers() requires 3.11
 if sys.version_info[0] != 3 or sys.version_info[1] < 11:
     sys.exit("This script requires Python version >=3.11")
@@ -73,6 +77,9 @@ _orig_path = sys.path.copy()
 try:
     sys.path.insert(1, str(script_dir.absolute()))
 
+    import _hashing
+    import _slim_archive
+    import _trace
     import source_archive_url
 finally:
     sys.path = _orig_path
@@ -80,17 +87,124 @@ finally:
 
 url_func = typing.Callable[[Path], str] | None
 
+# Environment variable containing the directory in which generated SBOMs are cached.
+# This script is run from the Meson source directory, it mustn't write a cache there
+# unless it is asked to.
+sbom_cache_env_var = "ADBWINAPI_SBOM_CACHE"
+
+# Number of cached SBOMs kept.
+_sbom_cache_size = 32
+
+# Names of the cached SBOMs. The cache directory may be shared with other files (it
+# is chosen by the user), only files with these names are ever removed.
+_sbom_cache_entry_re = re.compile(r"^[0-9a-f]{64}\.json$")
+
+# Patches which are described in this script.
+_known_patches = (
+    "0001-fix-bool-to-ptr-implicit-cast-errors.patch",
+    "0002-fix-build.patch",
+)
+
+# Keys of config (the arguments of this script) which affect the SBOM.
+_document_config_keys = (
+    "purl",
+    "project_version",
+    "underlying_version",
+    "repolink_format",
+    "ref",
+    "base_repoling",
+    "fake_windows_version",
+    "github_runner",
+    "msvc_dev_cmd",
+    "action_gh_release",
+    "meson_version",
+    "msvc_version",
+    "_MSC_VER",
+    "_MSC_FULL_VER",
+    "_ATL_VER",
+    "patch_mode",
+)
+
+
+_object_name_re = re.compile(r"^(?:[0-9a-f]{40}|[0-9a-f]{64})$")
+
+
+def _find_git_dir(start: Path) -> Path | None:
+    """Return the git directory of the repository containing start.
+
+    If the repository has a .git file which doesn't point to the git directory, the
+    .git file is returned. _read_head() can't resolve HEAD of it.
+    """
+    for directory in (start, *start.parents):
+        dot_git = directory / ".git"
+        if dot_git.is_dir():
+            return dot_git
+        if dot_git.is_file():
+            # Worktrees and submodules have a .git file pointing to the real git
+            # directory.
+            with open(dot_git, "r") as file:
+                content = file.read().strip()
+            if not content.startswith("gitdir:"):
+                # An unknown layout, leave it to git.
+                return dot_git
+            return directory / content.removeprefix("gitdir:").strip()
+    return None
+
+
+def _read_packed_ref(common_dir: Path, ref: str) -> str | None:
+    try:
+        with open(common_dir / "packed-refs", "r") as file:
+            for line in file:
+                if line.startswith(("#", "^")):
+                    continue
+                object_name, _, name = line.strip().partition(" ")
+                if name == ref:
+                    return object_name
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def _read_head(git_dir: Path) -> str | None:
+    """Resolve HEAD of git_dir without running git.
+
+    None is returned if the repository uses a layout this function doesn't
+    understand (reftable, broken symbolic refs...).
+    """
+    if not git_dir.is_dir():
+        return None
+    try:
+        with open(git_dir / "commondir", "r") as file:
+            # Linked worktrees share refs with the main repository.
+            common_dir = git_dir / file.read().strip()
+    except FileNotFoundError:
+        common_dir = git_dir
+    if (common_dir / "reftable").is_dir():
+        return None
 
-def _sha256_hash_file(path: Path) -> str:
-    """Return the string sha256sum of provided path."""
-    with path.open("rb") as file:
-        sha256hash = hashlib.sha256()
-        while True:
-            block = file.read(_block_size)
-            if not block:
-                break
-            sha256hash.update(block)
-        return sha256hash.hexdigest()
+    try:
+        with open(git_dir / "HEAD", "r") as file:
+            value = file.read().strip()
+        # Follow a limited number of symbolic refs like git does.
+        for _ in range(5):
+            if not value.startswith("ref:"):
+                return value if _object_name_re.match(value) else None
+            ref = value.removeprefix("ref:").strip()
+            # Some refs are private to a worktree, the rest is shared.
+            if ref.startswith(("refs/bisect/", "refs/worktree/")):
+                base = git_dir
+            else:
+                base = common_dir
+            try:
+                with open(base / ref, "r") as file:
+                    value = file.read().strip()
+            except FileNotFoundError:
+                value = _read_packed_ref(common_dir, ref)
+                if value is None:
+                    return None
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        pass
+    return None
 
 
 def _git_get_current_commit_hash() -> str | None:
@@ -104,6 +218,23 @@ def _git_get_current_commit_hash() -> str | None:
         "--ref flag to specify the commit SHA/tag manually."
     )
 
+    # Spawning git is slow (especially on Windows). HEAD of a regular repository can
+    # be read directly, git is used only if that fails or if the location of the
+    # repository is overridden by the environment.
+    if "GIT_DIR" not in os.environ:
+        git_dir = _find_git_dir(Path.cwd())
+        if git_dir is None:
+            print(
+                f"WARNING: '{Path.cwd()}' isn't in a git repository! Are you in a",
+                "release archive not managed by git?",
+                enderror,
+                file=sys.stderr,
+            )
+            return None
+        commit = _read_head(git_dir)
+        if commit is not None:
+            return commit
+
     git_exe = shutil.which("git")
     if git_exe is None:
         print("WARNING: Couldn't find git executable!", enderror, file=sys.stderr)
@@ -142,11 +273,29 @@ def _get_patches(wrap_file: Path) -> typing.Iterable[str]:
     ]
 
 
+def _get_source_filename(wrap_file: Path) -> str:
+    """Return the name of the archive Meson extracts the source from."""
+    config = configparser.ConfigParser()
+    config.read(wrap_file)
+    return config["wrap-file"]["source_filename"].strip()
+
+
+# Keys of the digest and of the data of the patch file in the dicts returned by
+# _process_patch(). They aren't part of CycloneDX, _build_shared() removes them.
+_patch_digest_key = "_sha256"
+_patch_data_key = "_data"
+
+
 def _process_patch(
     patch: Path, base_path: Path, prefix: Path, get_url: url_func
 ) -> dict:
     """Generate CycloneDX info for a single patch.
 
+    The SHA-256 digest of the patch file is stored under _patch_digest_key, it
+    identifies the patch in _merge_patches(). The data of the file is stored under
+    _patch_data_key. The embedded text has normalized newlines, the patches have CRLF
+    newlines (see .gitattributes), so the digest isn't computed from it.
+
     Arguments:
         patch: Path to the patch.
         base_path: Base path of the patch which should be removed from the patch path
@@ -156,16 +305,84 @@ def _process_patch(
         get_url: Function accepting a Path object and returning an URL pointing to that
           path.
     """
-    with patch.open() as patch_file:
+    with _trace.span("patch processing", patch=patch.name):
+        data = patch.read_bytes()
+        # The text is decoded like by patch.open().
+        content = io.TextIOWrapper(io.BytesIO(data)).read()
         result = {
             "type": "unofficial",
-            "diff": {"text": {"content": patch_file.read()}},
+            "diff": {"text": {"content": content}},
+            _patch_digest_key: hashlib.sha256(data).hexdigest(),
+            _patch_data_key: data,
         }
     if get_url is not None:
         result["diff"]["url"] = get_url(prefix / patch.relative_to(base_path))
     return result
 
 
+def _reference_patch(
+    patch: dict, digest: str | None, data: bytes | None, mode: str
+) -> dict:
+    """Replace the text of patch by a reference, return an external reference.
+
+    The permanent link of the patch is kept. If mode is "gzip", the patch file (data)
+    is kept compressed with gzip and encoded with base64, if mode is "hash", it is
+    dropped. CycloneDX can't attach hashes to patches, the SHA-256 digest of the patch
+    file is put into the returned external reference of the patched component
+    instead. digest and data are None if patch doesn't come from _process_patch(),
+    its text is used then.
+    """
+    if digest is None:
+        digest = _patch_digest(patch)
+    content = patch["diff"].pop("text")["content"]
+    if data is None:
+        data = content.encode()
+    if mode == "gzip":
+        patch["diff"]["text"] = {
+            "contentType": "application/gzip",
+            "encoding": "base64",
+            # mtime is fixed to make the output reproducible.
+            "content": base64.b64encode(gzip.compress(data, mtime=0)).decode("ascii"),
+        }
+    return {
+        "type": "other",
+        "url": patch["diff"]["url"],
+        "comment": "Patch applied to this component (see pedigree.patches)",
+        "hashes": [{"alg": "SHA-256", "content": digest}],
+    }
+
+
+def _process_patches(
+    patches: typing.Iterable[Path], base_path: Path, prefix: Path, get_url: url_func
+) -> dict[Path, dict]:
+    """Run _process_patch() on patches concurrently.
+
+    Every patch is read only once even if it is listed several times. Returns a dict
+    mapping the paths to the results in the order of patches.
+    """
+    unique_patches = list(dict.fromkeys(patches))
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=min(8, len(unique_patches) or 1)
+    ) as executor:
+        return dict(
+            zip(
+                unique_patches,
+                executor.map(
+                    lambda patch: _process_patch(patch, base_path, prefix, get_url),
+                    unique_patches,
+                ),
+            )
+        )
+
+
+def _patch_digest(patch: dict) -> str:
+    digest = patch.get(_patch_digest_key)
+    if digest is None:
+        # The patch doesn't come from _process_patch().
+        digest = hashlib.sha256(patch["diff"]["text"]["content"].encode()).hexdigest()
+    return digest
+
+
 def _merge_patches(
     primary_group: typing.Iterable[dict], secondary_group: typing.Iterable[dict]
 ) -> list[dict]:
@@ -179,47 +396,25 @@ def _merge_patches(
     autodetected (purpose of the patch, external source). They should therefore have
     precedence.
 
+    Patches are identified by the digest of their file (see _process_patch()). Both
+    groups are iterated only once, they can be arbitrary iterables.
+
     Arguments:
         primary_group: Patches which have priority (they will not be overwritten by
           second group).
         secondary_group: Patches which will be added to the returned list of patches
           if they do not collide with any patch from the primary group.
     """
-    # Try to retrieve a patch from any of the groups. It does not matter which one is
-    # picked. If both groups are empty, get None.
-    first_patch = next(
-        (patch for patch in primary_group),
-        next((patch for patch in secondary_group), None),
-    )
-    if first_patch is None:
+    merged = list(primary_group)
+    digests = {_patch_digest(patch) for patch in merged}
+    for secondary_patch in secondary_group:
+        digest = _patch_digest(secondary_patch)
+        if digest not in digests:
+            digests.add(digest)
+            merged.append(secondary_patch)
+    if not merged:
         raise ValueError("No patches for merging specified!")
-
-    allowed_secondary_group = []
-
-    if "url" in first_patch["diff"]:
-        # If the first patch in any of the groups has the "url" key specified,
-        # then all of the patches have to have the "url" key specified.
-        # If that's the case, use the "url" key as the main key in the set as it
-        # isn't that long, it doesn't contain newlines and it describes the
-        # patch better.
-        urls = {patch["diff"]["url"] for patch in primary_group}
-        for secondary_patch in secondary_group:
-            if secondary_patch["diff"]["url"] not in urls:
-                allowed_secondary_group.append(secondary_patch)
-    else:
-        sources = {patch["diff"]["text"]["content"] for patch in primary_group}
-        for secondary_patch in secondary_group:
-            if secondary_patch["diff"]["text"]["content"] not in sources:
-                allowed_secondary_group.append(secondary_patch)
-    if isinstance(primary_group, list):
-        return primary_group + allowed_secondary_group
-    else:
-        return list(
-            itertools.chain(
-                (patch for patch in primary_group),
-                (patch for patch in allowed_secondary_group),
-            )
-        )
+    return merged
 
 
 def _decode_atl_version(encoded_version_number: int) -> str:
@@ -249,155 +444,117 @@ def _get_windows_version() -> str:
     return f"{platform.version()}.{ubr}"
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(
-        description=__doc__,
-        formatter_class=argparse.RawDescriptionHelpFormatter,
-    )
-    parser.add_argument("source_dir", help="Path of the source directory")
-    parser.add_argument("purl", help="purl of this package")
-    parser.add_argument(
-        "project_version", help="Real version (possibly with p suffix) of AdbWinApi"
-    )
-    parser.add_argument(
-        "underlying_version", help="Version of platform/development underlying project"
-    )
-    parser.add_argument(
-        "repolink_format",
-        help=(
-            "A format string representing a permanent link to a file. Must contain "
-            "the ${path} substitution. May contain the ${ref} substitution."
-        ),
-    )
-    parser.add_argument(
-        "--ref",
-        help=(
-            "Specify ${ref} for repolink_format argument. Unused if not used in "
-            "repolink_format. If repolink_format requests ${ref} but it is not "
-            "overriden, this script will try to retrieve the current git hash with "
-            "git. If that is not successful, a warning is issued and sections "
-            "requiring file links are ommited."
-        ),
-    )
-    parser.add_argument(
-        "base_repoling",
-        help=(
-            "A link to the repository. It is used to fill out the homepage, the vcs "
-            "link (base_repoling + .git) and the issue tracker link (base_repoling + "
-            "/issues)."
-        ),
-    )
-    parser.add_argument(
-        "--fake-windows-version",
-        help=(
-            "Fake the Windows version. Useful when testing this script on non-Windows "
-            "hosts"
-        ),
-        action="store_true",
-    )
-    parser.add_argument(
-        "--github-runner",
-        help=(
-            "Name of the GitHub runner used to build the library. If not specified, "
-            "it is left out of the SBOM (it is assumed that this component was not "
-            "used during the build)."
-        ),
-    )
-    parser.add_argument(
-        "--msvc-dev-cmd",
-        help=(
-            "Version of ilammy/msvc-dev-cmd GitHub Action. If not specified, it is "
-            "left out of the SBOM (it is assumed that this component was not used "
-            "during the build)."
-        ),
-    )
-    parser.add_argument(
-        "--action-gh-release",
-        help=(
-            "Version of softprops/action-gh-release GitHub Action. If not specified, "
-            "it is left out of the SBOM (it is assumed that this component was not "
-            "used during the build)."
-        ),
-    )
-    parser.add_argument("target_architecture", help="Target architecture")
-    parser.add_argument("target_endian", help="Target endian")
-    parser.add_argument("meson_version", help="Version of Meson used")
-    parser.add_argument("msvc_version", help="Version of MSVC")
-    parser.add_argument("_MSC_VER", help="Value of _MSC_VER MSVC macro")
-    parser.add_argument("_MSC_FULL_VER", help="Value of _MSC_FULL_VER MSVC macro")
-    parser.add_argument(
-        "_ATL_VER", help="Value of _ATL_VER ATL macro (may be specified in hex)"
+def _collect_inputs(config: typing.Mapping[str, typing.Any]) -> dict:
+    """Gather the inputs of the SBOM which aren't part of config.
+
+    The commit of this repository is determined (if repolink_format needs it and
+    config doesn't specify it), the Windows version is read and the digest of the
+    source archive is looked up.
+    """
+    identifiers = string.Template(config["repolink_format"]).get_identifiers()
+    if "path" not in identifiers:
+        raise ValueError(
+            "The repolink_format argument must contain a ${path} substitution!"
+        )
+
+    ref = config.get("ref")
+    if "ref" in identifiers and ref is None:
+        with _trace.span("git rev-parse"):
+            ref = _git_get_current_commit_hash()
+
+    if config.get("fake_windows_version"):
+        windows_version = "invalid_version_this_SBOM_is_invalid"
+    else:
+        windows_version = _get_windows_version()
+
+    sourcedir = Path(config["source_dir"])
+
+    source_archive = sourcedir / "subprojects/packagefiles" / _get_source_filename(
+        sourcedir / "subprojects/development.wrap"
     )
-    args = parser.parse_args()
+    provenance = _slim_archive.read_provenance(source_archive)
+    if provenance is not None:
+        # The build uses a slim archive created by initialize_build_template.py.
+        # The SBOM must refer to the original archive.
+        archive_sha256 = provenance["source_sha256"]
+    else:
+        # initialize_build_template.py records the digest of the archive when
+        # fetching it, the archive doesn't have to be read again.
+        with _trace.span("hashing", file=source_archive.name):
+            archive_sha256 = _hashing.sha256_file(source_archive)
+
+    return {
+        "ref": ref,
+        "windows_version": windows_version,
+        "archive_sha256": archive_sha256,
+    }
+
 
-    repolink_template = string.Template(args.repolink_format)
+def _make_get_file_link(repolink_format: str, ref: str | None) -> url_func:
+    """Return a function making permanent links to files of this repository.
 
-    if "path" not in repolink_template.get_identifiers():
-        sys.exit("The repolink_format argument must contain a ${path} substitution!")
+    None is returned if repolink_format requires ${ref} and ref is None.
+    """
+    repolink_template = string.Template(repolink_format)
 
     # Facilitate a flexible mechanism for making repo links to files.
     # This mechanism does not hardcode the repository name or owner.
     # It optionaly supports ref substitution, which will include the commit SHA/tag
     # in the link making it permanent.
     if "ref" in repolink_template.get_identifiers():
-        if args.ref is not None:
+        if ref is None:
+            return None
 
-            def get_file_link(path: str) -> str:  # noqa: D103
-                return repolink_template.substitute(path=path, ref=args.ref)
-
-        else:
-            hash = _git_get_current_commit_hash()
-            if hash is None:
-                get_file_link = None
-            else:
-
-                # This is used as a more advanced and easy to read lambda, no need to
-                # docstring it for D103.
-                def get_file_link(path: str) -> str:  # noqa: D103
-                    return repolink_template.substitute(path=path, ref=hash)
+        # This is used as a more advanced and easy to read lambda, no need to
+        # docstring it for D103.
+        def get_file_link(path: str) -> str:  # noqa: D103
+            return repolink_template.substitute(path=path, ref=ref)
 
     else:
 
         def get_file_link(path: str) -> str:  # noqa: D103
             return repolink_template.substitute(path=path)
 
-    if args.fake_windows_version:
-        windows_version = "invalid_version_this_SBOM_is_invalid"
-        lifecycle = "design"
-    else:
-        windows_version = _get_windows_version()
-        lifecycle = "build"
+    return get_file_link
 
-    sourcedir = Path(args.source_dir)
 
-    platform_tools_archive_sha256sum = _sha256_hash_file(
-        sourcedir
-        / f"subprojects/packagefiles/platform-tools-{args.underlying_version}.tar.gz"
-    )
+def _build_shared(config: typing.Mapping[str, typing.Any], inputs: dict) -> dict:
+    """Build the parts of the SBOM which don't depend on the target architecture.
+
+    This reads the patches, it should be done only once for all architectures.
+    inputs are returned by _collect_inputs().
+    """
+    get_file_link = _make_get_file_link(config["repolink_format"], inputs["ref"])
+
+    windows_version = inputs["windows_version"]
+    lifecycle = "design" if config.get("fake_windows_version") else "build"
 
-    atl_version = _decode_atl_version(int(args._ATL_VER, 0))
+    sourcedir = Path(config["source_dir"])
+    platform_tools_archive_sha256sum = inputs["archive_sha256"]
+
+    atl_version = _decode_atl_version(int(config["_ATL_VER"], 0))
 
     purl_db = {
-        "adbwinapi": f"{args.purl}@{args.project_version}",
+        "adbwinapi": f"{config['purl']}@{config['project_version']}",
         "windows": "pkg:microsoft/windows@" + windows_version,
-        "msvc": "pkg:generic/msvc@" + args.msvc_version,
+        "msvc": "pkg:generic/msvc@" + config["msvc_version"],
         "atl": "pkg:generic/atl@" + atl_version,
-        "meson": "pkg:pypi/meson@" + args.meson_version,
+        "meson": "pkg:pypi/meson@" + config["meson_version"],
     }
 
-    if args.msvc_dev_cmd is not None:
+    if config.get("msvc_dev_cmd") is not None:
         purl_db["ilammy/msvc-dev-cmd"] = (
-            "pkg:github/ilammy/msvc-dev-cmd@" + args.msvc_dev_cmd
+            "pkg:github/ilammy/msvc-dev-cmd@" + config["msvc_dev_cmd"]
         )
 
-    if args.action_gh_release is not None:
+    if config.get("action_gh_release") is not None:
         purl_db["softprops/action-gh-release"] = (
-            "pkg:github/softprops/action-gh-release@" + args.action_gh_release
+            "pkg:github/softprops/action-gh-release@" + config["action_gh_release"]
         )
 
-    if args.github_runner is not None:
+    if config.get("github_runner") is not None:
         purl_db["github_runner"] = (
-            "pkg:generic/github-actions-runner@" + args.github_runner
+            "pkg:generic/github-actions-runner@" + config["github_runner"]
         )
 
     #
@@ -424,21 +581,6 @@ if __name__ == "__main__":
         "content": platform_tools_archive_sha256sum,
     }
 
-    target_arch_prop = [
-        {
-            "name": "target.architecture",
-            "value": args.target_architecture,
-        },
-        {
-            "name": "target.endian",
-            "value": args.target_endian,
-        },
-        {
-            "name": "target.os",
-            "value": "windows",
-        },
-    ]
-
     platform_development = {
         "type": "library",
         "supplier": {
@@ -448,7 +590,7 @@ if __name__ == "__main__":
         "description": (
             "Official and original source code for AdbWinApi and AdbWinUsbApi"
         ),
-        "version": args.underlying_version,
+        "version": config["underlying_version"],
         "hashes": [platform_tools_archive_hash],
         "externalReferences": [
             {
@@ -459,7 +601,7 @@ if __name__ == "__main__":
                 "type": "distribution",
                 "url": (
                     source_archive_url.source_archive_url
-                    % {"version": args.underlying_version}
+                    % {"version": config["underlying_version"]}
                 ),
                 "comment": (
                     "GitHub's git server does not provide stable release archives. "
@@ -473,13 +615,22 @@ if __name__ == "__main__":
         ],
     }
 
-    cast_errors_patch = _process_patch(
-        sourcedir
-        / "subprojects/packagefiles/diff_files/0001-fix-bool-to-ptr-implicit-cast-errors.patch",
+    wrap_patches = [
+        sourcedir / "subprojects/packagefiles" / patch_relpath
+        for patch_relpath in _get_patches(sourcedir / "subprojects/development.wrap")
+    ]
+    known_patch_paths = [
+        sourcedir / "subprojects/packagefiles/diff_files" / patch
+        for patch in _known_patches
+    ]
+    processed_patches = _process_patches(
+        known_patch_paths + wrap_patches,
         sourcedir,
         Path("build_template"),
         get_file_link,
     )
+
+    cast_errors_patch = processed_patches[known_patch_paths[0]]
     cast_errors_patch["resolves"] = [
         {
             "type": "defect",
@@ -492,12 +643,7 @@ if __name__ == "__main__":
         }
     ]
 
-    fix_build_patch = _process_patch(
-        sourcedir / "subprojects/packagefiles/diff_files/0002-fix-build.patch",
-        sourcedir,
-        Path("build_template"),
-        get_file_link,
-    )
+    fix_build_patch = processed_patches[known_patch_paths[1]]
     fix_build_patch["resolves"] = [
         {
             "type": "defect",
@@ -514,20 +660,26 @@ if __name__ == "__main__":
         fix_build_patch,
     ]
 
-    all_patches = _merge_patches(
-        known_patches,
-        (
-            _process_patch(
-                sourcedir / "subprojects/packagefiles" / patch_relpath,
-                sourcedir,
-                Path("build_template"),
-                get_file_link,
-            )
-            for patch_relpath in _get_patches(
-                sourcedir / "subprojects/development.wrap"
-            )
-        ),
-    )
+    with _trace.span("merge patches"):
+        all_patches = _merge_patches(
+            known_patches, (processed_patches[patch] for patch in wrap_patches)
+        )
+    patch_mode = config.get("patch_mode") or "text"
+    if patch_mode not in ("text", "hash", "gzip"):
+        raise ValueError(f"Unknown patch mode {patch_mode}!")
+    if patch_mode != "text" and get_file_link is None:
+        print(
+            "WARNING: Patches can be referenced only by permanent links, which are "
+            "unavailable. Their text is embedded instead.",
+            file=sys.stderr,
+        )
+        patch_mode = "text"
+    patch_extrefs = []
+    for patch in all_patches:
+        digest = patch.pop(_patch_digest_key, None)
+        data = patch.pop(_patch_data_key, None)
+        if patch_mode != "text":
+            patch_extrefs.append(_reference_patch(patch, digest, data, patch_mode))
 
     msys2_adbwinapi = {
         "type": "library",
@@ -553,7 +705,7 @@ if __name__ == "__main__":
 
     github_actions = []
 
-    if args.msvc_dev_cmd is not None:
+    if config.get("msvc_dev_cmd") is not None:
         github_actions.append(
             {
                 # Close enough.
@@ -564,7 +716,7 @@ if __name__ == "__main__":
                     "name": "GitHub, Inc.",
                     "url": ["https://github.com/"],
                 },
-                "version": args.msvc_dev_cmd,
+                "version": config["msvc_dev_cmd"],
                 "bom-ref": purl_db["ilammy/msvc-dev-cmd"],
                 "purl": purl_db["ilammy/msvc-dev-cmd"],
                 "externalReferences": [
@@ -583,7 +735,7 @@ if __name__ == "__main__":
             }
         )
 
-    if args.action_gh_release is not None:
+    if config.get("action_gh_release") is not None:
         github_actions.append(
             {
                 "type": "library",
@@ -593,7 +745,7 @@ if __name__ == "__main__":
                     "name": "GitHub, Inc.",
                     "url": ["https://github.com/"],
                 },
-                "version": args.action_gh_release,
+                "version": config["action_gh_release"],
                 "bom-ref": purl_db["softprops/action-gh-release"],
                 "purl": purl_db["softprops/action-gh-release"],
                 "externalReferences": [
@@ -612,18 +764,19 @@ if __name__ == "__main__":
             }
         )
 
-    if args.github_runner is not None:
+    if config.get("github_runner") is not None:
+        github_runner = config["github_runner"]
         # It is unnecessary to remove all common prefixes from all supported GitHub
         # runners since only Windows runners are able to build AdbWinApi. But let's do
         # it anyway.
         for runner in ("windows", "macos", "ubuntu"):
-            if args.github_runner.startswith(runner + "-"):
+            if github_runner.startswith(runner + "-"):
                 github_runner_name = runner
-                github_runner_version = args.github_runner.removeprefix(runner + "-")
+                github_runner_version = github_runner.removeprefix(runner + "-")
                 break
         else:
-            sys.exit(
-                f"The GitHub runner '{args.github_runner}' has an unrecognized "
+            raise ValueError(
+                f"The GitHub runner '{github_runner}' has an unrecognized "
                 "prefix. If it is a custom runner, you should know that this script "
                 "currently supports official GitHub runners only (but adding support "
                 "for it shouldn't be difficult)."
@@ -652,12 +805,54 @@ if __name__ == "__main__":
                 "properties": [
                     {
                         "name": "github_runner_name",
-                        "value": args.github_runner,
+                        "value": github_runner,
                     }
                 ],
             }
         )
 
+    return {
+        "windows_version": windows_version,
+        "lifecycle": lifecycle,
+        "atl_version": atl_version,
+        "purl_db": purl_db,
+        "apache_license": apache_license,
+        "apache_license_extref": apache_license_extref,
+        "all_patches": all_patches,
+        "patch_extrefs": patch_extrefs,
+        "msys2_adbwinapi": msys2_adbwinapi,
+        "github_actions": github_actions,
+    }
+
+
+def _assemble(
+    config: typing.Mapping[str, typing.Any],
+    shared: dict,
+    target_architecture: str,
+    target_endian: str,
+) -> dict:
+    """Build the SBOM of target_architecture from the parts built by _build_shared()."""
+    # Every document gets its own copy, the caller may modify it.
+    shared = copy.deepcopy(shared)
+    purl_db = shared["purl_db"]
+    apache_license = shared["apache_license"]
+    apache_license_extref = shared["apache_license_extref"]
+
+    target_arch_prop = [
+        {
+            "name": "target.architecture",
+            "value": target_architecture,
+        },
+        {
+            "name": "target.endian",
+            "value": target_endian,
+        },
+        {
+            "name": "target.os",
+            "value": "windows",
+        },
+    ]
+
     document = {
         "$schema": "https://cyclonedx.org/schema/bom-1.6.schema.json",
         "bomFormat": "CycloneDX",
@@ -666,7 +861,7 @@ if __name__ == "__main__":
         "version": 1,
         "metadata": {
             "timestamp": _generate_timestamp(),
-            "lifecycles": [{"phase": lifecycle}],
+            "lifecycles": [{"phase": shared["lifecycle"]}],
             "supplier": {
                 "name": "GitHub, Inc.",
                 "url": ["https://github.com/"],
@@ -680,19 +875,23 @@ if __name__ == "__main__":
                     }
                 ],
                 "name": "AdbWinApi",
-                "version": args.project_version,
+                "version": config["project_version"],
                 "bom-ref": purl_db["adbwinapi"],
                 "purl": purl_db["adbwinapi"],
                 "description": "Windows support libraries for android-tools",
                 "pedigree": {
-                    "ancestors": [msys2_adbwinapi],
-                    "patches": all_patches,
+                    "ancestors": [shared["msys2_adbwinapi"]],
+                    "patches": shared["all_patches"],
                 },
                 "externalReferences": [
-                    {"type": "website", "url": args.base_repoling},
-                    {"type": "vcs", "url": args.base_repoling + ".git"},
-                    {"type": "issue-tracker", "url": args.base_repoling + "/issues"},
+                    {"type": "website", "url": config["base_repoling"]},
+                    {"type": "vcs", "url": config["base_repoling"] + ".git"},
+                    {
+                        "type": "issue-tracker",
+                        "url": config["base_repoling"] + "/issues",
+                    },
                     apache_license_extref,
+                    *shared["patch_extrefs"],
                 ],
                 "licenses": [{"license": apache_license}],
                 "properties": target_arch_prop,
@@ -703,14 +902,14 @@ if __name__ == "__main__":
                 {
                     "type": "operating-system",
                     "name": "Microsoft Windows",
-                    "version": windows_version,
+                    "version": shared["windows_version"],
                     "bom-ref": purl_db["windows"],
                     "purl": purl_db["windows"],
                 },
                 {
                     "type": "application",
                     "name": "MSVC",
-                    "version": args.msvc_version,
+                    "version": config["msvc_version"],
                     "supplier": {
                         "name": "Microsoft",
                     },
@@ -720,11 +919,11 @@ if __name__ == "__main__":
                         [
                             {
                                 "name": "_MSC_VER",
-                                "value": args._MSC_VER,
+                                "value": config["_MSC_VER"],
                             },
                             {
                                 "name": "_MSC_FULL_VER",
-                                "value": args._MSC_FULL_VER,
+                                "value": config["_MSC_FULL_VER"],
                             },
                         ]
                         + target_arch_prop
@@ -734,14 +933,14 @@ if __name__ == "__main__":
                     "type": "library",
                     "name": "ATL",
                     "description": "Active Template Library",
-                    "version": atl_version,
+                    "version": shared["atl_version"],
                     "supplier": {
                         "name": "Microsoft",
                     },
                     "bom-ref": purl_db["atl"],
                     "purl": purl_db["atl"],
                     "properties": (
-                        [{"name": "_ATL_VER", "value": str(int(args._ATL_VER, 0))}]
+                        [{"name": "_ATL_VER", "value": str(int(config["_ATL_VER"], 0))}]
                         + target_arch_prop
                     ),
                 },
@@ -749,7 +948,7 @@ if __name__ == "__main__":
                     "type": "application",
                     "name": "meson",
                     "description": "Meson build system",
-                    "version": args.meson_version,
+                    "version": config["meson_version"],
                     "supplier": {
                         "name": "Python Package Index",
                         "url": ["https://pypi.org/"],
@@ -760,7 +959,7 @@ if __name__ == "__main__":
                     "externalReferences": [apache_license_extref],
                 },
             ]
-            + github_actions
+            + shared["github_actions"]
         ),
         "dependencies": [
             {
@@ -775,18 +974,325 @@ if __name__ == "__main__":
         ],
     }
 
-    if args.msvc_dev_cmd is not None:
+    if config.get("msvc_dev_cmd") is not None:
         document["dependencies"][0]["dependsOn"].append(purl_db["ilammy/msvc-dev-cmd"])
 
-    if args.action_gh_release is not None:
+    if config.get("action_gh_release") is not None:
         document["dependencies"][0]["dependsOn"].append(
             purl_db["softprops/action-gh-release"]
         )
 
-    if args.github_runner is not None:
+    if config.get("github_runner") is not None:
         document["dependencies"][0]["dependsOn"].append(purl_db["github_runner"])
 
+    return document
+
+
+def _input_digest(
+    config: typing.Mapping[str, typing.Any],
+    targets: list[tuple[str, str]],
+    inputs: dict,
+) -> str:
+    """Return a digest of everything the SBOMs of targets are generated from."""
+    digest = hashlib.sha256()
+
+    def add(label: str, value: typing.Any) -> None:
+        digest.update(json.dumps([label, value]).encode() + b"\n")
+
+    add("config", {key: config.get(key) for key in _document_config_keys})
+    add("targets", targets)
+    add("inputs", inputs)
+
+    sourcedir = Path(config["source_dir"])
+    wrap_file = sourcedir / "subprojects/development.wrap"
+    # The generator itself and the helper modules copied next to it.
+    for path in (
+        Path(__file__),
+        Path(source_archive_url.__file__),
+        *sorted(script_dir.glob("_*.py")),
+        wrap_file,
+        *(
+            sourcedir / "subprojects/packagefiles/diff_files" / patch
+            for patch in _known_patches
+        ),
+        *(
+            sourcedir / "subprojects/packagefiles" / patch
+            for patch in _get_patches(wrap_file)
+        ),
+    ):
+        add("file", path.name)
+        with open(path, "rb") as file:
+            digest.update(hashlib.file_digest(file, "sha256").digest())
+    return digest.hexdigest()
+
+
+def _load_cached(path: Path, count: int) -> list[dict] | None:
+    try:
+        with open(path, "r") as file:
+            documents = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+    if (
+        not isinstance(documents, list)
+        or len(documents) != count
+        or not all(isinstance(document, dict) for document in documents)
+    ):
+        return None
+    return documents
+
+
+def _store_cached(cache_dir: Path, path: Path, documents: list[dict]) -> None:
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = path.with_name(f"tmp.{os.getpid()}.{path.name}")
+    with open(tmp_path, "w") as file:
+        json.dump(documents, file)
+    os.replace(tmp_path, path)
+
+    # Entries of old inputs are never used again, keep only the recent ones.
+    entries = sorted(
+        (
+            entry
+            for entry in cache_dir.iterdir()
+            if _sbom_cache_entry_re.match(entry.name)
+        ),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True,
+    )
+    for entry in entries[_sbom_cache_size:]:
+        entry.unlink(missing_ok=True)
+
+
+def build_sboms(
+    config: typing.Mapping[str, typing.Any],
+    targets: typing.Iterable[tuple[str, str]],
+    cache_dir: Path | None = None,
+    reproducible: bool = False,
+) -> list[dict]:
+    """Build the SBOMs of several (architecture, endian) targets.
+
+    The work which doesn't depend on the target architecture (hashing, reading
+    patches, running git) is done only once. See build_sbom() for config.
+
+    If cache_dir is set, the SBOMs are cached there. They are keyed by a digest of
+    all inputs (config, targets, the patches, the digest of the source archive, the
+    commit of this repository and the source of this script). Cached SBOMs get a new
+    serial number and timestamp unless reproducible is True.
+    """
+    targets = [tuple(target) for target in targets]
+    inputs = _collect_inputs(config)
+
+    if cache_dir is not None:
+        with _trace.span("SBOM cache lookup"):
+            cache_path = cache_dir / (
+                _input_digest(config, targets, inputs) + ".json"
+            )
+            documents = _load_cached(cache_path, len(targets))
+        if documents is not None:
+            if not reproducible:
+                for document in documents:
+                    document["serialNumber"] = uuid.uuid4().urn
+                    document["metadata"]["timestamp"] = _generate_timestamp()
+            # Mark the entry as recently used.
+            os.utime(cache_path)
+            return documents
+
+    shared = _build_shared(config, inputs)
+    documents = [
+        _assemble(config, shared, target_architecture, target_endian)
+        for target_architecture, target_endian in targets
+    ]
+    if cache_dir is not None:
+        try:
+            _store_cached(cache_dir, cache_path, documents)
+        except OSError as exc:
+            # The cache is an optimization only.
+            print(f"WARNING: Couldn't cache the SBOM: {exc}", file=sys.stderr)
+    return documents
+
+
+def build_sbom(
+    config: typing.Mapping[str, typing.Any],
+    cache_dir: Path | None = None,
+    reproducible: bool = False,
+) -> dict:
+    """Build the SBOM described by config and return it.
+
+    config maps the names of the command line arguments of this script (with dashes
+    replaced by underscores, like argparse does) to their values. Optional arguments
+    may be left out. The SBOM targets config["target_architecture"] and
+    config["target_endian"]. See build_sboms() for the other arguments.
+
+    ValueError is raised if config is invalid.
+    """
+    return build_sboms(
+        config,
+        [(config["target_architecture"], config["target_endian"])],
+        cache_dir,
+        reproducible,
+    )[0]
+
+
+def _parse_arch_spec(spec: str) -> tuple[str, str, Path]:
+    """Parse --arch ARCH[:ENDIAN]=FILE, return (architecture, endian, file)."""
+    target, separator, output = spec.partition("=")
+    target_architecture, _, target_endian = target.partition(":")
+    if not separator or not output or not target_architecture:
+        raise ValueError(
+            f"Invalid --arch '{spec}'! Expected ARCH[:ENDIAN]=FILE, for example "
+            "aarch64:little=AdbWinApi-aarch64-sbom.cyclonedx.json."
+        )
+    return target_architecture, target_endian or "little", Path(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("source_dir", help="Path of the source directory")
+    parser.add_argument("purl", help="purl of this package")
+    parser.add_argument(
+        "project_version", help="Real version (possibly with p suffix) of AdbWinApi"
+    )
+    parser.add_argument(
+        "underlying_version", help="Version of platform/development underlying project"
+    )
+    parser.add_argument(
+        "repolink_format",
+        help=(
+            "A format string representing a permanent link to a file. Must contain "
+            "the ${path} substitution. May contain the ${ref} substitution."
+        ),
+    )
+    parser.add_argument(
+        "--ref",
+        help=(
+            "Specify ${ref} for repolink_format argument. Unused if not used in "
+            "repolink_format. If repolink_format requests ${ref} but it is not "
+            "overriden, this script will try to retrieve the current git hash with "
+            "git. If that is not successful, a warning is issued and sections "
+            "requiring file links are ommited."
+        ),
+    )
+    parser.add_argument(
+        "base_repoling",
+        help=(
+            "A link to the repository. It is used to fill out the homepage, the vcs "
+            "link (base_repoling + .git) and the issue tracker link (base_repoling + "
+            "/issues)."
+        ),
+    )
+    parser.add_argument(
+        "--fake-windows-version",
+        help=(
+            "Fake the Windows version. Useful when testing this script on non-Windows "
+            "hosts"
+        ),
+        action="store_true",
+    )
+    parser.add_argument(
+        "--github-runner",
+        help=(
+            "Name of the GitHub runner used to build the library. If not specified, "
+            "it is left out of the SBOM (it is assumed that this component was not "
+            "used during the build)."
+        ),
+    )
+    parser.add_argument(
+        "--msvc-dev-cmd",
+        help=(
+            "Version of ilammy/msvc-dev-cmd GitHub Action. If not specified, it is "
+            "left out of the SBOM (it is assumed that this component was not used "
+            "during the build)."
+        ),
+    )
+    parser.add_argument(
+        "--action-gh-release",
+        help=(
+            "Version of softprops/action-gh-release GitHub Action. If not specified, "
+            "it is left out of the SBOM (it is assumed that this component was not "
+            "used during the build)."
+        ),
+    )
+    parser.add_argument("target_architecture", help="Target architecture")
+    parser.add_argument("target_endian", help="Target endian")
+    parser.add_argument("meson_version", help="Version of Meson used")
+    parser.add_argument("msvc_version", help="Version of MSVC")
+    parser.add_argument("_MSC_VER", help="Value of _MSC_VER MSVC macro")
+    parser.add_argument("_MSC_FULL_VER", help="Value of _MSC_FULL_VER MSVC macro")
+    parser.add_argument(
+        "_ATL_VER", help="Value of _ATL_VER ATL macro (may be specified in hex)"
+    )
+    parser.add_argument(
+        "--arch",
+        action="append",
+        default=[],
+        metavar="SPEC",
+        help=(
+            "Also write the SBOM of another target architecture into a file. SPEC is "
+            "ARCH[:ENDIAN]=FILE, ENDIAN defaults to little. All other values are "
+            "shared with the main SBOM. Can be specified multiple times, the work "
+            "which doesn't depend on the architecture is done only once."
+        ),
+    )
+    parser.add_argument(
+        "--patch-mode",
+        choices=("text", "hash", "gzip"),
+        default="text",
+        help=(
+            "How patches are included. text: their full text is embedded. hash: "
+            "only their permanent link and the SHA-256 digest of their text are "
+            "included. gzip: like hash, but their text is also embedded compressed "
+            "with gzip and encoded with base64. hash and gzip require a permanent "
+            "link (see --ref). Default: %(default)s"
+        ),
+    )
+    parser.add_argument(
+        "--reproducible",
+        action="store_true",
+        help=(
+            "Reuse the serial number and the timestamp of a cached SBOM, the output "
+            "is then identical for identical inputs."
+        ),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        type=Path,
+        default=os.environ.get(sbom_cache_env_var) or None,
+        metavar="DIR",
+        help=(
+            "Cache generated SBOMs in DIR. Default: the value of the "
+            f"{sbom_cache_env_var} environment variable (caching is disabled if "
+            "unset)"
+        ),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always generate the SBOM, ignore --cache-dir.",
+    )
+    _trace.add_argument(parser)
+    args = parser.parse_args()
+
+    _trace.enable(args.trace)
+
+    try:
+        arch_outputs = [_parse_arch_spec(spec) for spec in args.arch]
+        documents = build_sboms(
+            vars(args),
+            [(args.target_architecture, args.target_endian)]
+            + [(arch, endian) for arch, endian, _ in arch_outputs],
+            None if args.no_cache else args.cache_dir,
+            args.reproducible,
+        )
+    except ValueError as exc:
+        sys.exit(str(exc))
+
     try:
-        json.dump(document, sys.stdout)
+        with _trace.span("JSON dump"):
+            json.dump(documents[0], sys.stdout)
+        for (_, _, output), document in zip(arch_outputs, documents[1:]):
+            with _trace.span("JSON dump", file=output.name), open(output, "w") as file:
+                json.dump(document, file)
     except OSError as exc:
         sys.exit(str(exc))
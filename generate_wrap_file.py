@@ -22,11 +22,20 @@ info about the build process.
 """
 
 import argparse
-import hashlib
 import pathlib
 import string
+import sys
 
-_buffer_size = 8192
+script_dir = pathlib.Path(__file__).parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(script_dir.absolute()))
+
+    import _hashing
+    import _trace
+finally:
+    sys.path = _orig_path
+    del _orig_path
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
@@ -56,11 +65,12 @@ if __name__ == "__main__":
             )
         ),
     )
+    _trace.add_argument(parser)
     args = parser.parse_args()
 
-    # Argument validation and processing.
+    _trace.enable(args.trace)
 
-    script_dir = pathlib.Path(__file__).parent
+    # Argument validation and processing.
 
     if args.project_version:
         project_version = args.project_version
@@ -68,18 +78,17 @@ if __name__ == "__main__":
         with open(script_dir / "VERSION.txt", "r") as file:
             project_version = file.read().strip()
 
-    sha256sum = hashlib.sha256(usedforsecurity=False)
-    with open(args.input_release_archive, "rb") as file:
-        while True:
-            chunk = file.read(_buffer_size)
-            if not chunk:
-                break
-            sha256sum.update(chunk)
+    # The release archive is hashed by several scripts, share the digest.
+    input_release_archive = pathlib.Path(args.input_release_archive)
+    with _trace.span("hashing", file=input_release_archive.name):
+        sha256sum = _hashing.sha256_file(input_release_archive, _hashing.DigestCache())
 
-    with open(script_dir / "AdbWinApi.wrap.in", "r") as file:
+    with _trace.span("substitution"), open(
+        script_dir / "AdbWinApi.wrap.in", "r"
+    ) as file:
         wrap_file_contents = string.Template(file.read()).substitute(
             version=project_version,
-            sha256sum=sha256sum.hexdigest(),
+            sha256sum=sha256sum,
         )
 
     # Write the result into destination directory.
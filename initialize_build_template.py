@@ -32,72 +32,47 @@ import argparse
 import os
 import pathlib
 import platform
-import re
-import shutil
 import string
 import sys
-import tempfile
 import time
 import typing
-import urllib.request
 
 script_dir = pathlib.Path(__file__).parent
 _orig_path = sys.path.copy()
 try:
     sys.path.insert(1, str(script_dir.absolute()))
 
+    import _archive_cache
+    import _archive_store
+    import _fileio
+    import _mirrors
+    import _slim_archive
     import _strip_comments
+    import _template_sync
+    import _trace
     import source_archive_url
 finally:
     sys.path = _orig_path
     del _orig_path
 
+build_template = script_dir / "build_template"
 
-def _fetch_with_progress(
-    url: str, out: typing.BinaryIO, chunk_size: int = 8192, print_delay: float = 1.0
-) -> None:
-    """Fetch url while showing a simplistic progress indicator.
+# generate_sbom.py and the modules it uses, they are copied into the source directory.
+sbom_files = (
+    "generate_sbom.py",
+    "source_archive_url.py",
+    "_hashing.py",
+    "_fileio.py",
+    "_slim_archive.py",
+    "_trace.py",
+)
 
-    Arguments:
-        url: Remote file to fetch.
-        out: File to write output to.
-        chunk_size: Download the file in chunks of chunk_size size.
-        print_delay: Print progress every print_delay seconds.
-    """
-    approximate_size_mib = round(
-        source_archive_url.source_archive_approximate_size / 2**20
-    )
-    fetched_size = 0
-    log_delay = time.monotonic()
-    with urllib.request.urlopen(url) as response:
-        while True:
-            chunk = response.read(chunk_size)
-            if not chunk:
-                break
-            out.write(chunk)
-            fetched_size += len(chunk)
-
-            new_log_delay = time.monotonic()
-            if (new_log_delay - log_delay) >= print_delay:
-                log_delay = new_log_delay
-                progress = round(
-                    fetched_size
-                    / source_archive_url.source_archive_approximate_size
-                    * 100,
-                    1,
-                )
-                progress_str = f"~{progress}"
-                fetched_size_mib = round(fetched_size / 2**20)
-                print(
-                    f"{fetched_size_mib:>4}MiB / ~",
-                    approximate_size_mib,
-                    f"MiB = {progress_str:>6} %",
-                    sep="",
-                    file=sys.stderr,
-                )
-
-
-def _universal_symlink(src, dst) -> None:
+# Files watched by --watch in addition to build_template/.
+watched_files = ("ANDROID_TOOLS_VERSION.txt", "VERSION.txt") + sbom_files
+
+
+def _universal_symlink(src, dst) -> str:
+    """Create a symlink, return the strategy used (see _fileio.clone_file())."""
     try:
         os.symlink(src, dst)
     except OSError as exc:
@@ -107,25 +82,202 @@ def _universal_symlink(src, dst) -> None:
         # is not enabled (which enables regular users to create
         # symlinks).
         if platform.system() == "Windows" and exc.winerror == 1314:
-            shutil.copy(os.path.normpath(os.path.join(os.path.dirname(dst), src)), dst)
+            # The archive is never modified in place, it can be hard linked.
+            return _fileio.clone_file(
+                os.path.normpath(os.path.join(os.path.dirname(dst), src)),
+                dst,
+                hardlink=True,
+            )
         else:
             raise
+    return "symlink"
 
 
-def _substitute_file(
-    filename: pathlib.Path,
-    /,
-    sourcedir: pathlib.Path,
-    destdir: pathlib.Path,
-    mapping: typing.Mapping[str, str],
-) -> None:
-    with open(sourcedir / filename, "r") as file:
+def _substitute_template(
+    path: pathlib.Path, mapping: typing.Mapping[str, str]
+) -> bytes:
+    """Return the contents of template path with mapping substituted."""
+    with open(path, "r") as file:
         to_substitute = file.read()
 
     substituted = string.Template(to_substitute).substitute(mapping)
 
-    with open(destdir / filename, "w") as file:
-        file.write(substituted)
+    # Use the newlines of files written in text mode.
+    return substituted.replace("\n", os.linesep).encode()
+
+
+def _read_versions(args: argparse.Namespace) -> tuple[str, str]:
+    """Return the version of android-tools and of this project."""
+    if args.android_tools_version:
+        android_tools_version = args.android_tools_version
+    else:
+        with open(script_dir / "ANDROID_TOOLS_VERSION.txt", "r") as file:
+            android_tools_version = _strip_comments.read_file_with_comments(file)
+
+    if args.project_version:
+        project_version = args.project_version
+    else:
+        with open(script_dir / "VERSION.txt", "r") as file:
+            project_version = file.read().strip()
+    return android_tools_version, project_version
+
+
+def _populate(args: argparse.Namespace, android_tools_version: str) -> pathlib.Path:
+    """Fetch source into cache/ if not cached already, return the archive to use."""
+    with _trace.span("populate cache", version=android_tools_version):
+        source_path, _ = _archive_cache.populate(
+            android_tools_version,
+            url_template=args.source_archive_url,
+            mirrors=args.mirror,
+            connections=args.connections,
+            slim=not args.full_archive,
+            pipeline=args.pipeline,
+            quota=args.cache_quota,
+            events=args.progress_events,
+        )
+    return source_path
+
+
+def _materialize(
+    dest_dir: pathlib.Path,
+    source_path: pathlib.Path,
+    android_tools_version: str,
+    project_version: str,
+    full_archive: bool,
+) -> None:
+    """Bring dest_dir up to date with build_template/.
+
+    Only files which differ from the template are written, Meson would otherwise
+    reconfigure the project needlessly.
+    """
+    source_filename = source_path.name
+    packagefiles_dir = dest_dir / "subprojects" / "packagefiles"
+
+    substitutions = {
+        pathlib.Path("subprojects", "development.wrap"): {
+            "version": android_tools_version,
+            "source_filename": source_filename,
+        },
+        pathlib.Path("meson.build"): {
+            "project_version": project_version,
+            "version": android_tools_version,
+        },
+        pathlib.Path("subprojects", "packagefiles", "patch", "meson.build"): {
+            "project_version": project_version
+        },
+    }
+
+    files = {
+        path.relative_to(build_template): path
+        for path in sorted(build_template.rglob("*"))
+        if path.is_file()
+    }
+    with _trace.span("substitution"):
+        for relpath, mapping in substitutions.items():
+            files[relpath] = _substitute_template(build_template / relpath, mapping)
+
+    if not full_archive:
+        # generate_sbom.py refers to the original archive in the SBOM.
+        provenance = _slim_archive.provenance_path(packagefiles_dir / source_filename)
+        files[provenance.relative_to(dest_dir)] = _slim_archive.provenance_path(
+            source_path
+        )
+
+    # Copy SBOM generator script and the modules it uses.
+    for filename in sbom_files:
+        files[pathlib.Path(filename)] = script_dir / filename
+
+    with _trace.span("sync template"):
+        synced = _template_sync.sync(dest_dir, files)
+    for relpath in synced["removed"]:
+        print(f"Removed {relpath}, it is no longer in the template.", file=sys.stderr)
+    strategies = ""
+    if synced["strategies"]:
+        strategies = f" (using {', '.join(synced['strategies'])})"
+    print(
+        f"Template files: {len(synced['written'])} updated{strategies},",
+        f"{len(synced['unchanged'])} unchanged.",
+        file=sys.stderr,
+    )
+
+    strategy = None
+    try:
+        strategy = _universal_symlink(
+            os.path.relpath(source_path, packagefiles_dir),
+            packagefiles_dir / source_filename,
+        )
+    except FileExistsError:
+        if not os.path.samefile(
+            os.path.realpath(packagefiles_dir / source_filename), source_path
+        ):
+            (packagefiles_dir / source_filename).unlink()
+            strategy = _universal_symlink(
+                os.path.relpath(source_path, packagefiles_dir),
+                packagefiles_dir / source_filename,
+            )
+    if strategy is not None:
+        print(f"Linked {source_filename} using {strategy}.", file=sys.stderr)
+
+
+def _snapshot() -> dict[pathlib.Path, tuple[int, int]]:
+    """Return the size and modification time of the files watched by --watch."""
+    paths = [path for path in build_template.rglob("*") if path.is_file()]
+    paths.extend(script_dir / filename for filename in watched_files)
+    snapshot = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        snapshot[path] = (stat.st_size, stat.st_mtime_ns)
+    return snapshot
+
+
+def _watch(
+    args: argparse.Namespace,
+    dest_dir: pathlib.Path,
+    source_path: pathlib.Path,
+    android_tools_version: str,
+    project_version: str,
+) -> None:
+    """Keep dest_dir up to date with build_template/ until interrupted."""
+    snapshot = _snapshot()
+    print(
+        f"Watching {build_template} for changes. Press Ctrl+C to stop.",
+        file=sys.stderr,
+    )
+    while True:
+        time.sleep(args.watch_interval)
+        new_snapshot = _snapshot()
+        if new_snapshot == snapshot:
+            continue
+        changed = sorted(
+            path
+            for path in snapshot.keys() | new_snapshot.keys()
+            if snapshot.get(path) != new_snapshot.get(path)
+        )
+        snapshot = new_snapshot
+        print(
+            "Changed:",
+            ", ".join(str(path.relative_to(script_dir)) for path in changed),
+            file=sys.stderr,
+        )
+        # Errors (an invalid template, a failed download) are reported, the next
+        # change may fix them.
+        try:
+            new_android_tools_version, project_version = _read_versions(args)
+            if new_android_tools_version != android_tools_version:
+                source_path = _populate(args, new_android_tools_version)
+                android_tools_version = new_android_tools_version
+            _materialize(
+                dest_dir,
+                source_path,
+                android_tools_version,
+                project_version,
+                args.full_archive,
+            )
+        except Exception as exc:
+            print(f"ERROR: {exc}", file=sys.stderr)
 
 
 if __name__ == "__main__":
@@ -155,135 +307,134 @@ if __name__ == "__main__":
             )
         ),
     )
+    parser.add_argument(
+        "--source-archive-url",
+        default=source_archive_url.source_archive_url,
+        help=" ".join(
+            (
+                "URL of the platform/development archive. %%(version)s is replaced",
+                "with the version of android-tools. Useful for fetching the archive",
+                "from a mirror or from a local server. Default: %(default)s",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--mirror",
+        action="append",
+        help=" ".join(
+            (
+                "Local directory or URL to try before --source-archive-url. Can be",
+                "used more than once. %%(version)s is replaced with the version of",
+                "android-tools, the file name of the archive is appended otherwise.",
+                f"Default: mirrors listed in the {_mirrors.env_var} environment",
+                "variable (separated by whitespace)",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--full-archive",
+        action="store_true",
+        help=" ".join(
+            (
+                "Let Meson extract the whole platform/development archive. By",
+                "default, a slim archive containing only the files needed for the",
+                "build is created in the cache and used instead.",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--pipeline",
+        action="store_true",
+        help=" ".join(
+            (
+                "Create the slim archive while the platform/development archive is",
+                "being fetched instead of reading the fetched archive again",
+                "afterwards. With more than one connection, parts of the archive",
+                "fetched out of order are processed when they are reached.",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--cache-quota",
+        type=_archive_store.parse_size,
+        help=" ".join(
+            (
+                "Maximum size of the cache directory, for example 2G. Least",
+                "recently used archives are evicted when it is exceeded. Default:",
+                "unlimited",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=4,
+        help=" ".join(
+            (
+                "Maximum number of concurrent connections used to fetch the source",
+                "archive. This has an effect only if the server supports range",
+                "requests. Default: %(default)s",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--progress-events",
+        type=argparse.FileType("a"),
+        metavar="FILE",
+        help=" ".join(
+            (
+                "Append download progress events (time to first byte, throughput,",
+                "ETA) to FILE as JSON lines. - means standard output. Default: none",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help=" ".join(
+            (
+                "Keep running and update the destination directory whenever",
+                "build_template/, the version files or the SBOM generator change.",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=0.25,
+        metavar="SECONDS",
+        help="How often --watch checks for changes. Default: %(default)s",
+    )
+    _trace.add_argument(parser)
     args = parser.parse_args()
 
+    _trace.enable(args.trace)
+
     # Argument validation and processing.
 
     dest_dir = pathlib.Path(args.destination_directory)
 
-    if args.android_tools_version:
-        # https://semver.org/#is-there-a-suggested-regular-expression-regex-to-check-a-semver-string
-        if not re.match(
-            r"^(?P<major>0|[1-9]\d*)\.(?P<minor>0|[1-9]\d*)\.(?P<patch>0|[1-9]\d*)"
-            r"(?:-(?P<prerelease>(?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*)"
-            r"(?:\.(?:0|[1-9]\d*|\d*[a-zA-Z-][0-9a-zA-Z-]*))*))?"
-            r"(?:\+(?P<buildmetadata>[0-9a-zA-Z-]+(?:\.[0-9a-zA-Z-]+)*))?$",
-            args.android_tools_version,
-        ):
-            sys.exit("Overriden android_tools_version is not a valid SemVer version!")
-        android_tools_version = args.android_tools_version
-    else:
-        with open(script_dir / "ANDROID_TOOLS_VERSION.txt", "r") as file:
-            android_tools_version = _strip_comments.read_file_with_comments(file)
+    if args.android_tools_version and not _archive_cache.is_semver(
+        args.android_tools_version
+    ):
+        sys.exit("Overriden android_tools_version is not a valid SemVer version!")
+    if args.watch_interval <= 0:
+        sys.exit("--watch-interval must be positive!")
 
-    if args.project_version:
-        project_version = args.project_version
-    else:
-        with open(script_dir / "VERSION.txt", "r") as file:
-            project_version = file.read().strip()
+    android_tools_version, project_version = _read_versions(args)
 
     # Fetch source into cache/ if not cached already.
 
-    url = source_archive_url.source_archive_url % {"version": android_tools_version}
-
-    cache_filename = url[url.rfind("/") + 1 :]
-    cache_dir = script_dir / "cache"
-    cache_path = cache_dir / cache_filename
-
-    # Check for previous failed attempts to download source archive.
-
-    try:
-        cachedir_tmp_listing = os.listdir(cache_dir)
-    except FileNotFoundError:
-        pass
-    else:
-        for filename in cachedir_tmp_listing:
-            if filename.startswith("tmp"):
-                print(
-                    f"WARNING: Found temporary file '{filename}' in cache directory",
-                    f"'{cache_dir}'. Was a previous download abruptly terminated?",
-                    "Removing...",
-                    file=sys.stderr,
-                )
-                (cache_dir / filename).unlink()
-
-    # If the source archive is not present, download it.
-
-    if not os.access(cache_path, os.F_OK):
-        # The cache is likely empty, let's populate it.
-        try:
-            tmpcache = tempfile.NamedTemporaryFile(
-                dir=cache_dir, prefix="tmp", delete=False
-            )
-        except FileNotFoundError:
-            # cache dir doesn't likely exist, create it and retry
-            os.mkdir(cache_dir)
-            tmpcache = tempfile.NamedTemporaryFile(
-                dir=cache_dir, prefix="tmp", delete=False
-            )
-        print(f"Fetching {url}...", file=sys.stderr)
-        try:
-            _fetch_with_progress(url, tmpcache.file)
-        except Exception:
-            # This script handles leftover temporary files, but we try
-            # to clean them up here anyway.
-            tmpcache.close()
-            os.remove(tmpcache.name)
-            raise
-        tmpcache.close()
-        os.rename(tmpcache.name, cache_path)
+    source_path = _populate(args, android_tools_version)
 
     # Copy template to target directory.
 
-    build_template = script_dir / "build_template"
-
-    shutil.copytree(build_template, dest_dir, dirs_exist_ok=True)
-
-    packagefiles_dir = dest_dir / "subprojects" / "packagefiles"
-
-    try:
-        _universal_symlink(
-            os.path.relpath(cache_path, packagefiles_dir),
-            packagefiles_dir / cache_filename,
-        )
-    except FileExistsError:
-        if not os.path.samefile(
-            os.path.realpath(packagefiles_dir / cache_filename), cache_path
-        ):
-            (packagefiles_dir / cache_filename).unlink()
-            _universal_symlink(
-                os.path.relpath(cache_path, packagefiles_dir),
-                packagefiles_dir / cache_filename,
-            )
-
-    _substitute_file(
-        pathlib.Path("subprojects", "development.wrap"),
-        sourcedir=build_template,
-        destdir=dest_dir,
-        mapping={"version": android_tools_version},
-    )
-    _substitute_file(
-        pathlib.Path("meson.build"),
-        sourcedir=build_template,
-        destdir=dest_dir,
-        mapping={
-            "project_version": project_version,
-            "version": android_tools_version,
-        },
-    )
-    _substitute_file(
-        pathlib.Path("subprojects", "packagefiles", "patch", "meson.build"),
-        sourcedir=build_template,
-        destdir=dest_dir,
-        mapping={"project_version": project_version},
+    _materialize(
+        dest_dir, source_path, android_tools_version, project_version, args.full_archive
     )
 
-    # Copy SBOM generator script.
-    shutil.copyfile(
-        script_dir / "generate_sbom.py",
-        dest_dir / "generate_sbom.py",
-    )
-    shutil.copyfile(
-        script_dir / "source_archive_url.py",
-        dest_dir / "source_archive_url.py",
-    )
+    if args.watch:
+        try:
+            _watch(args, dest_dir, source_path, android_tools_version, project_version)
+        except KeyboardInterrupt:
+            pass
@@ -41,6 +41,7 @@ try:
     sys.path.insert(1, str(script_dir.absolute()))
 
     import _strip_comments
+    import _trace
 finally:
     sys.path = _orig_path
     del _orig_path
@@ -72,8 +73,11 @@ if __name__ == "__main__":
             )
         ),
     )
+    _trace.add_argument(parser)
     args = parser.parse_args()
 
+    _trace.enable(args.trace)
+
     # Argument validation and processing.
 
     dest_dir = pathlib.Path(args.destination_directory)
@@ -101,7 +105,9 @@ if __name__ == "__main__":
 
     # Process substitutions in input wrap_build_template/meson.build file
 
-    with open(script_dir / "wrap_build_template" / "meson.build", "r") as file:
+    with _trace.span("substitution"), open(
+        script_dir / "wrap_build_template" / "meson.build", "r"
+    ) as file:
         meson_build_contents = string.Template(file.read()).substitute(
             project_version=project_version, library_version=android_tools_version
         )
@@ -116,9 +122,10 @@ if __name__ == "__main__":
         with open(dest_dir / "meson.build", "w") as file:
             file.write(meson_build_contents)
 
-    shutil.copytree(
-        script_dir / "wrap_build_template",
-        dest_dir,
-        dirs_exist_ok=True,
-        ignore=shutil.ignore_patterns("meson.build"),
-    )
+    with _trace.span("copytree"):
+        shutil.copytree(
+            script_dir / "wrap_build_template",
+            dest_dir,
+            dirs_exist_ok=True,
+            ignore=shutil.ignore_patterns("meson.build"),
+        )
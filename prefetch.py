@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Script used to fetch platform/development archives of several versions into cache/.
+
+This is useful when bisecting across several android-tools releases or when warming
+up the cache of a new build agent. The archives are fetched concurrently by a bounded
+number of workers, the cache is populated exactly like initialize_build_template.py
+populates it.
+"""
+
+import argparse
+import concurrent.futures
+import pathlib
+import sys
+import threading
+import time
+import typing
+
+script_dir = pathlib.Path(__file__).parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(script_dir.absolute()))
+
+    import _archive_cache
+    import _archive_store
+    import _mirrors
+    import _trace
+    import source_archive_url
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+
+def _expand_versions(specs: list[str]) -> list[str]:
+    """Expand versions and ranges like 35.0.0..35.0.2 into a list of versions."""
+    versions = []
+    for spec in specs:
+        first, separator, last = spec.partition("..")
+        if not separator:
+            if not _archive_cache.is_semver(spec):
+                sys.exit(f"'{spec}' is not a valid SemVer version!")
+            versions.append(spec)
+            continue
+        for version in (first, last):
+            parts = version.split(".")
+            if len(parts) != 3 or not all(part.isdigit() for part in parts):
+                sys.exit(f"'{version}' in range '{spec}' must be major.minor.patch!")
+        first_parts = [int(part) for part in first.split(".")]
+        last_parts = [int(part) for part in last.split(".")]
+        # Releases of other minor or major versions can't be enumerated.
+        if first_parts[:2] != last_parts[:2] or first_parts[2] > last_parts[2]:
+            sys.exit(
+                f"Range '{spec}' must go from a lower to a higher patch version of the "
+                "same major.minor version!"
+            )
+        versions.extend(
+            f"{first_parts[0]}.{first_parts[1]}.{patch}"
+            for patch in range(first_parts[2], last_parts[2] + 1)
+        )
+    return list(dict.fromkeys(versions))
+
+
+class _Summary:
+    """Thread safe progress of all prefetched versions.
+
+    Arguments:
+        versions: Prefetched versions.
+        print_delay: Print progress every print_delay seconds.
+    """
+
+    def __init__(self, versions: list[str], print_delay: float) -> None:
+        self._versions = versions
+        self._status = dict.fromkeys(versions, "waiting")
+        self._fetched = dict.fromkeys(versions, 0)
+        self._times = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+        self._print_delay = print_delay
+        self._start = time.monotonic()
+        self._stop = threading.Event()
+        self._printer = threading.Thread(target=self._print_loop, daemon=True)
+
+    def __enter__(self) -> "_Summary":
+        self._printer.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._printer.join()
+
+    def progress(self, version: str) -> typing.Callable[[int], None]:
+        """Return the progress callback of version."""
+
+        def update(size: int) -> None:
+            with self._lock:
+                self._fetched[version] += size
+
+        return update
+
+    def start(self, version: str) -> None:
+        with self._lock:
+            self._status[version] = "running"
+            self._times[version] = time.monotonic()
+
+    def finish(self, version: str, error: BaseException | None = None) -> None:
+        with self._lock:
+            self._status[version] = "done" if error is None else "failed"
+            self._times[version] = time.monotonic() - self._times[version]
+            if error is not None:
+                self._errors[version] = error
+
+    @property
+    def failed(self) -> bool:
+        return bool(self._errors)
+
+    def _print_loop(self) -> None:
+        while not self._stop.wait(self._print_delay):
+            with self._lock:
+                statuses = list(self._status.values())
+                fetched = sum(self._fetched.values())
+            elapsed = time.monotonic() - self._start
+            print(
+                f"{statuses.count('done')}/{len(statuses)} done,",
+                f"{statuses.count('running')} running,",
+                f"{statuses.count('failed')} failed,",
+                f"{round(fetched / 2**20)}MiB fetched",
+                f"({fetched / 2**20 / elapsed:.1f} MiB/s)",
+                file=sys.stderr,
+            )
+
+    def print_report(self) -> None:
+        for version in self._versions:
+            line = (
+                f"{version:<16} {self._status[version]:<7}"
+                f" {self._fetched[version] / 2**20:>8.1f} MiB"
+                f" {self._times.get(version, 0):>7.1f} s"
+            )
+            if version in self._errors:
+                line += f"  {self._errors[version]}"
+            print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument(
+        "versions",
+        nargs="+",
+        help=" ".join(
+            (
+                "Versions of android-tools to fetch. A range of patch versions can",
+                "be given as FIRST..LAST, for example 35.0.0..35.0.2.",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=4,
+        help="Maximum number of archives fetched at once. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--source-archive-url",
+        default=source_archive_url.source_archive_url,
+        help=" ".join(
+            (
+                "URL of the platform/development archive. %%(version)s is replaced",
+                "with the version of android-tools. Default: %(default)s",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--mirror",
+        action="append",
+        help=" ".join(
+            (
+                "Local directory or URL to try before --source-archive-url. See",
+                "initialize_build_template.py --help. Default: mirrors listed in the",
+                f"{_mirrors.env_var} environment variable",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--full-archive",
+        action="store_true",
+        help="Don't create the slim archives used by initialize_build_template.py.",
+    )
+    parser.add_argument(
+        "--cache-quota",
+        type=_archive_store.parse_size,
+        help=" ".join(
+            (
+                "Maximum size of the cache directory, for example 2G. Least",
+                "recently used archives are evicted when it is exceeded. Default:",
+                "unlimited",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--connections",
+        type=int,
+        default=4,
+        help=" ".join(
+            (
+                "Maximum number of concurrent connections used to fetch a single",
+                "archive. Default: %(default)s",
+            )
+        ),
+    )
+    parser.add_argument(
+        "--progress-events",
+        type=argparse.FileType("a"),
+        metavar="FILE",
+        help=" ".join(
+            (
+                "Append download progress events (time to first byte, throughput,",
+                "ETA) to FILE as JSON lines. - means standard output. Default: none",
+            )
+        ),
+    )
+    _trace.add_argument(parser)
+    args = parser.parse_args()
+
+    _trace.enable(args.trace)
+
+    if args.jobs < 1:
+        sys.exit("--jobs must be at least 1!")
+
+    versions = _expand_versions(args.versions)
+    # Digests of the archives fetched by this run.
+    fetched_sha256s = []
+
+    def prefetch(version: str) -> None:
+        summary.start(version)
+        try:
+            with _trace.span("populate cache", version=version):
+                _, archive_sha256 = _archive_cache.populate(
+                    version,
+                    url_template=args.source_archive_url,
+                    mirrors=args.mirror,
+                    connections=args.connections,
+                    slim=not args.full_archive,
+                    progress=summary.progress(version),
+                    events=args.progress_events,
+                )
+        except Exception as e:
+            summary.finish(version, e)
+        else:
+            fetched_sha256s.append(archive_sha256)
+            summary.finish(version)
+
+    with _Summary(versions, 1.0) as summary, concurrent.futures.ThreadPoolExecutor(
+        args.jobs
+    ) as executor:
+        for future in [executor.submit(prefetch, version) for version in versions]:
+            future.result()
+
+    # Evict archives only after all of them have been fetched, the quota could
+    # otherwise evict the versions fetched first. The archives fetched by this run
+    # are never evicted, even if they don't fit into the quota.
+    if args.cache_quota is not None:
+        store = _archive_store.ArchiveStore(_archive_cache.default_cache_dir)
+        with _trace.span("collect garbage"):
+            evicted = store.collect_garbage(args.cache_quota, keep=fetched_sha256s)
+        for entry in evicted:
+            print(f"Evicted {', '.join(entry['names'])}", file=sys.stderr)
+
+    summary.print_report()
+    if summary.failed:
+        sys.exit("Some archives could not be fetched!")
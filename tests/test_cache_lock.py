@@ -0,0 +1,119 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the cache lock shared by several processes."""
+
+import contextlib
+import io
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+
+repo_dir = pathlib.Path(__file__).parent.parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(repo_dir.absolute()))
+
+    import _cache_lock
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+# Acquires the lock of argv[1] repeatedly. While holding it, it creates argv[2]
+# exclusively, which fails if another process holds the lock at the same time.
+_contender = textwrap.dedent(
+    """
+    import os, pathlib, sys, time
+    sys.path.insert(0, sys.argv[3])
+    import _cache_lock
+    for _ in range(30):
+        with _cache_lock.CacheLock(pathlib.Path(sys.argv[1]), poll_interval=0.001):
+            os.close(os.open(sys.argv[2], os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            time.sleep(0.001)
+            os.unlink(sys.argv[2])
+    """
+)
+
+# Acquires the lock of argv[1], reports it and waits until it is killed.
+_holder = textwrap.dedent(
+    """
+    import pathlib, sys, time
+    sys.path.insert(0, sys.argv[2])
+    import _cache_lock
+    _cache_lock.CacheLock(pathlib.Path(sys.argv[1])).acquire()
+    print("locked", flush=True)
+    time.sleep(60)
+    """
+)
+
+
+class CacheLockTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="adbwinapi-test-")
+        self.addCleanup(tmp_dir.cleanup)
+        self.entry = pathlib.Path(tmp_dir.name) / "entry"
+
+    def test_exclusive(self) -> None:
+        lock = _cache_lock.CacheLock(self.entry)
+        self.assertTrue(lock.acquire(blocking=False))
+        self.assertFalse(_cache_lock.CacheLock(self.entry).acquire(blocking=False))
+        self.assertEqual(lock._read_owner()["pid"], os.getpid())
+        lock.release()
+        other = _cache_lock.CacheLock(self.entry)
+        self.assertTrue(other.acquire(blocking=False))
+        other.release()
+
+    def test_processes(self) -> None:
+        marker = self.entry.with_name("inside")
+        contenders = [
+            subprocess.Popen(
+                [
+                    sys.executable,
+                    "-c",
+                    _contender,
+                    str(self.entry),
+                    str(marker),
+                    str(repo_dir),
+                ],
+                stderr=subprocess.DEVNULL,
+            )
+            for _ in range(6)
+        ]
+        self.assertEqual([contender.wait() for contender in contenders], [0] * 6)
+
+    def test_released_when_owner_dies(self) -> None:
+        holder = subprocess.Popen(
+            [sys.executable, "-c", _holder, str(self.entry), str(repo_dir)],
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self.addCleanup(holder.wait)
+        self.addCleanup(holder.kill)
+        self.assertEqual(holder.stdout.readline().strip(), "locked")
+        self.assertFalse(_cache_lock.CacheLock(self.entry).acquire(blocking=False))
+        holder.kill()
+        holder.wait()
+        holder.stdout.close()
+        lock = _cache_lock.CacheLock(self.entry, poll_interval=0.01)
+        with contextlib.redirect_stderr(io.StringIO()):
+            self.assertTrue(lock.acquire())
+        lock.release()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,270 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of _download.py against a local HTTP server.
+
+The server (benchmarks/_common.py) supports range requests and ETags like a HTTP
+cache or it ignores them like android.googlesource.com.
+"""
+
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import json
+import pathlib
+import random
+import sys
+import tempfile
+import time
+import typing
+import unittest
+import unittest.mock
+import urllib.error
+
+repo_dir = pathlib.Path(__file__).parent.parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(repo_dir.absolute()))
+    sys.path.insert(1, str((repo_dir / "benchmarks").absolute()))
+
+    import _common
+    import _download
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+# Parts are made small, so that small files are fetched over several connections.
+_part_size = 64 * 2**10
+
+
+class _FailingPartsHandler(_common.RangeRequestHandler):
+    """Serve the first part slowly, fail all other parts."""
+
+    def _serve(self, send_body: bool) -> None:
+        range_header = self.headers.get("Range", "")
+        if range_header and not range_header.startswith("bytes=0-"):
+            self.send_error(500)
+            return
+        if send_body:
+            write = self.wfile.write
+
+            def slow_write(data: bytes) -> int:
+                time.sleep(0.5)
+                return write(data)
+
+            self.wfile.write = slow_write
+        super()._serve(send_body)
+
+
+class _StallingHandler(_common.RangeRequestHandler):
+    """Send the headers, then stall."""
+
+    def _serve(self, send_body: bool) -> None:
+        self.send_response(200)
+        self.send_header("Content-Length", "1000")
+        self.end_headers()
+        self.wfile.flush()
+        time.sleep(3)
+
+
+class DownloadTestCase(unittest.TestCase):
+    """Base of the tests, it serves a random file from a temporary directory."""
+
+    size = 2**20
+
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="adbwinapi-test-")
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = pathlib.Path(tmp_dir.name)
+        self.served_dir = self.tmp_dir / "server"
+        self.served_dir.mkdir()
+        self.served = self.served_dir / "platform-tools-0.0.0.tar.gz"
+        self.served.write_bytes(random.Random(0).randbytes(self.size))
+        self.path = self.tmp_dir / "fetched.tar.gz"
+
+        patcher = unittest.mock.patch.object(_download, "_min_part_size", _part_size)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(
+        self,
+        support_ranges: bool = True,
+        handler: type[_common.RangeRequestHandler] | None = None,
+    ) -> str:
+        """Start a server, return the URL of the served file."""
+        server = _common.ArchiveServer(self.served_dir, support_ranges, handler)
+        self.enterContext(server)
+        return server.url + self.served.name
+
+    def fetch(self, url: str, **kwargs: typing.Any) -> tuple[str, bytes, str]:
+        """Fetch url into self.path.
+
+        Return the digest, the data received by the sink and the output of the
+        download.
+        """
+        received = bytearray()
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            sha256 = _download.fetch_with_progress(
+                url,
+                self.path,
+                sink=received.extend,
+                size_history=None,
+                **kwargs,
+            )
+        return sha256, bytes(received), stderr.getvalue()
+
+
+class FetchTest(DownloadTestCase):
+    def _assert_fetched(self, sha256: str, received: bytes) -> None:
+        data = self.served.read_bytes()
+        self.assertEqual(sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(self.path.read_bytes(), data)
+        self.assertEqual(received, data)
+        self.assertFalse(
+            self.path.with_name(self.path.name + _download.state_suffix).exists()
+        )
+
+    def test_ranged(self) -> None:
+        sha256, received, output = self.fetch(self.serve(), connections=4)
+        self.assertIn("using 4 connections", output)
+        self._assert_fetched(sha256, received)
+
+    def test_single_stream(self) -> None:
+        sha256, received, output = self.fetch(
+            self.serve(support_ranges=False), connections=4
+        )
+        self.assertNotIn("connections", output)
+        self._assert_fetched(sha256, received)
+
+    def test_single_connection(self) -> None:
+        sha256, received, output = self.fetch(self.serve(), connections=1)
+        self.assertNotIn("connections", output)
+        self._assert_fetched(sha256, received)
+
+    def test_failed_part_cancels_others(self) -> None:
+        # The first part takes 2 seconds to be served.
+        self.served.write_bytes(random.Random(0).randbytes(32 * 2**20))
+        url = self.serve(handler=_FailingPartsHandler)
+        start = time.monotonic()
+        with unittest.mock.patch.object(_download, "_min_part_size", 8 * 2**20):
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                self.fetch(url, connections=4)
+        self.assertEqual(context.exception.code, 500)
+        self.assertLess(time.monotonic() - start, 1.5)
+
+    def test_stalled_server_times_out(self) -> None:
+        url = self.serve(handler=_StallingHandler)
+        with unittest.mock.patch.object(_download, "_timeout", 0.5):
+            with self.assertRaises(TimeoutError):
+                self.fetch(url, connections=1)
+
+
+class SizeHistoryTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="adbwinapi-test-")
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = pathlib.Path(tmp_dir.name)
+
+    def test_concurrent_updates(self) -> None:
+        history_path = self.tmp_dir / "sizes.json"
+        urls = [f"https://example.com/{index}.tar.gz" for index in range(32)]
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            for future in [
+                executor.submit(_download.record_size, url, index + 1, history_path)
+                for index, url in enumerate(urls)
+            ]:
+                future.result()
+        sizes = _download._load_sizes(history_path)
+        self.assertEqual(sizes, {url: index + 1 for index, url in enumerate(urls)})
+
+    def test_failure_is_a_warning(self) -> None:
+        # The parent of the history is a file, the history can't be written.
+        (self.tmp_dir / "file").touch()
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            _download.record_size(
+                "https://example.com/a.tar.gz", 1, self.tmp_dir / "file" / "sizes.json"
+            )
+        self.assertIn("WARNING", stderr.getvalue())
+
+
+class _Interrupted(Exception):
+    pass
+
+
+class ResumeTest(DownloadTestCase):
+    def _interrupt(self, url: str) -> None:
+        """Start fetching url, interrupt the download after a few chunks."""
+        chunks = 0
+
+        def sink(data: memoryview) -> None:
+            nonlocal chunks
+            chunks += 1
+            if chunks == 4:
+                raise _Interrupted()
+
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(_Interrupted):
+                _download.fetch_with_progress(
+                    url,
+                    self.path,
+                    connections=1,
+                    chunk_size=_part_size,
+                    sink=sink,
+                    size_history=None,
+                )
+        self.assertTrue(
+            self.path.with_name(self.path.name + _download.state_suffix).exists()
+        )
+
+    def _fetch_resumed(self, url: str) -> tuple[str, bytes, str, int]:
+        """Like fetch(), also return the number of reused bytes."""
+        events = io.StringIO()
+        sha256, received, output = self.fetch(url, connections=1, events=events)
+        starts = [
+            event
+            for event in map(json.loads, events.getvalue().splitlines())
+            if event["event"] == "start"
+        ]
+        return sha256, received, output, starts[-1]["resumed_bytes"]
+
+    def test_resume(self) -> None:
+        url = self.serve()
+        self._interrupt(url)
+        sha256, received, output, resumed = self._fetch_resumed(url)
+        data = self.served.read_bytes()
+        self.assertIn("Resuming download", output)
+        self.assertGreater(resumed, 0)
+        self.assertEqual(sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(self.path.read_bytes(), data)
+        self.assertEqual(received, data)
+
+    def test_changed_etag_restarts(self) -> None:
+        url = self.serve()
+        self._interrupt(url)
+        # The server derives the ETag from the size and the modification time.
+        new_data = random.Random(1).randbytes(self.size + 1)
+        self.served.write_bytes(new_data)
+        sha256, received, output, resumed = self._fetch_resumed(url)
+        self.assertIn("Starting over", output)
+        self.assertEqual(resumed, 0)
+        self.assertEqual(sha256, hashlib.sha256(new_data).hexdigest())
+        self.assertEqual(self.path.read_bytes(), new_data)
+        self.assertEqual(received, new_data)
+
+
+if __name__ == "__main__":
+    unittest.main()
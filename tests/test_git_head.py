@@ -0,0 +1,184 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the resolution of git HEAD in generate_sbom.py.
+
+HEAD of repositories created in a temporary directory is resolved without git and
+compared with the output of git rev-parse HEAD.
+"""
+
+import contextlib
+import io
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+repo_dir = pathlib.Path(__file__).parent.parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(repo_dir.absolute()))
+
+    import generate_sbom
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+_git_exe = shutil.which("git")
+
+# subprocess.run is patched by the tests.
+_run = subprocess.run
+
+_git_env = {
+    **os.environ,
+    "GIT_AUTHOR_NAME": "Test",
+    "GIT_AUTHOR_EMAIL": "test@example.com",
+    "GIT_COMMITTER_NAME": "Test",
+    "GIT_COMMITTER_EMAIL": "test@example.com",
+    "GIT_CONFIG_GLOBAL": os.devnull,
+    "GIT_CONFIG_NOSYSTEM": "1",
+}
+_git_env.pop("GIT_DIR", None)
+
+
+def _git(cwd: pathlib.Path, *args: str) -> str:
+    return subprocess.run(
+        [_git_exe, *args],
+        cwd=cwd,
+        env=_git_env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+        check=True,
+    ).stdout.strip()
+
+
+@unittest.skipIf(_git_exe is None, "git isn't installed")
+class GitHeadTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="adbwinapi-test-")
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = pathlib.Path(tmp_dir.name)
+
+    def _init(self, *args: str, commits: int = 2) -> pathlib.Path:
+        work_tree = self.tmp_dir / "repo"
+        _git(self.tmp_dir, "init", "-q", "-b", "main", *args, str(work_tree))
+        for index in range(commits):
+            _git(work_tree, "commit", "-q", "--allow-empty", "-m", f"Commit {index}")
+        return work_tree
+
+    def _resolve(self, work_tree: pathlib.Path) -> tuple[str | None, bool]:
+        """Return HEAD of work_tree as resolved by generate_sbom.py.
+
+        Also return whether git has been run to resolve it.
+        """
+        orig_cwd = os.getcwd()
+        os.chdir(work_tree)
+        try:
+            # git reports errors to stderr.
+            run = unittest.mock.Mock(
+                side_effect=lambda *args, **kwargs: _run(
+                    *args, stderr=subprocess.DEVNULL, **kwargs
+                )
+            )
+            with contextlib.redirect_stderr(io.StringIO()), unittest.mock.patch.object(
+                generate_sbom.subprocess, "run", run
+            ):
+                return generate_sbom._git_get_current_commit_hash(), run.called
+        finally:
+            os.chdir(orig_cwd)
+
+    def _assert_resolved_without_git(self, work_tree: pathlib.Path) -> None:
+        expected = _git(work_tree, "rev-parse", "HEAD")
+        git_dir = generate_sbom._find_git_dir(work_tree)
+        self.assertIsNotNone(git_dir)
+        self.assertEqual(generate_sbom._read_head(git_dir), expected)
+        self.assertEqual(self._resolve(work_tree), (expected, False))
+
+    def test_loose_ref(self) -> None:
+        self._assert_resolved_without_git(self._init())
+
+    def test_packed_refs(self) -> None:
+        work_tree = self._init()
+        _git(work_tree, "pack-refs", "--all")
+        self.assertFalse((work_tree / ".git/refs/heads/main").exists())
+        self._assert_resolved_without_git(work_tree)
+
+    def test_subdirectory(self) -> None:
+        work_tree = self._init()
+        subdirectory = work_tree / "a" / "b"
+        subdirectory.mkdir(parents=True)
+        self.assertEqual(
+            self._resolve(subdirectory), (_git(work_tree, "rev-parse", "HEAD"), False)
+        )
+
+    def test_linked_worktree(self) -> None:
+        work_tree = self._init()
+        linked = self.tmp_dir / "linked"
+        _git(work_tree, "worktree", "add", "-q", "-b", "other", str(linked))
+        _git(linked, "commit", "-q", "--allow-empty", "-m", "Worktree commit")
+        self.assertTrue((linked / ".git").is_file())
+        self.assertNotEqual(
+            _git(linked, "rev-parse", "HEAD"), _git(work_tree, "rev-parse", "HEAD")
+        )
+        self._assert_resolved_without_git(linked)
+        self._assert_resolved_without_git(work_tree)
+
+    def test_linked_worktree_packed_refs(self) -> None:
+        work_tree = self._init()
+        linked = self.tmp_dir / "linked"
+        _git(work_tree, "worktree", "add", "-q", "-b", "other", str(linked))
+        _git(work_tree, "pack-refs", "--all")
+        self._assert_resolved_without_git(linked)
+
+    def test_separate_git_dir(self) -> None:
+        work_tree = self._init(f"--separate-git-dir={self.tmp_dir / 'separate.git'}")
+        self.assertTrue((work_tree / ".git").is_file())
+        self._assert_resolved_without_git(work_tree)
+
+    def test_detached_head(self) -> None:
+        work_tree = self._init(commits=3)
+        _git(work_tree, "checkout", "-q", "--detach", "HEAD~1")
+        self._assert_resolved_without_git(work_tree)
+
+    def test_unborn_branch(self) -> None:
+        work_tree = self._init(commits=0)
+        git_dir = generate_sbom._find_git_dir(work_tree)
+        self.assertIsNone(generate_sbom._read_head(git_dir))
+        # git is asked as a fallback, it can't resolve it either.
+        self.assertEqual(self._resolve(work_tree), (None, True))
+
+    def test_unknown_git_file(self) -> None:
+        work_tree = self._init()
+        (work_tree / ".git").rename(self.tmp_dir / "moved.git")
+        (work_tree / ".git").write_text("not a gitdir line\n")
+        git_dir = generate_sbom._find_git_dir(work_tree)
+        self.assertIsNone(generate_sbom._read_head(git_dir))
+        # The unknown layout is left to git, which rejects this .git file.
+        self.assertEqual(self._resolve(work_tree), (None, True))
+
+    def test_not_a_repository(self) -> None:
+        directory = self.tmp_dir / "plain"
+        directory.mkdir()
+        if generate_sbom._find_git_dir(directory) is not None:
+            self.skipTest("the temporary directory is inside a git repository")
+        self.assertEqual(self._resolve(directory), (None, False))
+
+
+if __name__ == "__main__":
+    unittest.main()
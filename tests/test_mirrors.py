@@ -0,0 +1,181 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the mirror failover of _mirrors.py.
+
+Local HTTP servers and directories stand in for the mirrors and for upstream.
+"""
+
+import concurrent.futures
+import contextlib
+import hashlib
+import http.client
+import io
+import pathlib
+import random
+import socket
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+repo_dir = pathlib.Path(__file__).parent.parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(repo_dir.absolute()))
+    sys.path.insert(1, str((repo_dir / "benchmarks").absolute()))
+
+    import _common
+    import _download
+    import _mirrors
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+
+class _TruncatingHandler(_common.RangeRequestHandler):
+    """Send half of the file, then close the connection."""
+
+    def _serve(self, send_body: bool) -> None:
+        path = self.translate_path(self.path)
+        with open(path, "rb") as file:
+            data = file.read()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(data[: len(data) // 2])
+        self.close_connection = True
+
+
+def _unused_url() -> str:
+    """Return an URL nothing listens on."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        host, port = sock.getsockname()
+    return f"http://{host}:{port}/platform-tools-0.0.0.tar.gz"
+
+
+class FailoverTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="adbwinapi-test-")
+        self.addCleanup(tmp_dir.cleanup)
+        self.tmp_dir = pathlib.Path(tmp_dir.name)
+        self.served_dir = self.tmp_dir / "server"
+        self.served_dir.mkdir()
+        self.data = random.Random(0).randbytes(2**20)
+        self.served = self.served_dir / "platform-tools-0.0.0.tar.gz"
+        self.served.write_bytes(self.data)
+        self.path = self.tmp_dir / "fetched.tar.gz"
+        self.history_path = self.tmp_dir / "mirrors.json"
+
+        # The sizes of the fetched files mustn't be recorded in the cache of this
+        # repository.
+        patcher = unittest.mock.patch.object(_download, "record_size")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def serve(self, handler: type[_common.RangeRequestHandler] | None = None) -> str:
+        """Start a server, return the URL of the served file."""
+        server = _common.ArchiveServer(self.served_dir, handler=handler)
+        self.enterContext(server)
+        return server.url + self.served.name
+
+    def fetch(self, locations: list[str]) -> tuple[str, bytes]:
+        """Fetch the archive from locations, return the digest and the sink data."""
+        received = bytearray()
+        with contextlib.redirect_stderr(io.StringIO()):
+            sha256 = _mirrors.fetch(
+                locations,
+                self.path,
+                sink=received.extend,
+                history_path=self.history_path,
+            )
+        return sha256, bytes(received)
+
+    def _assert_fetched(self, sha256: str, received: bytes) -> None:
+        self.assertEqual(sha256, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.path.read_bytes(), self.data)
+        # Data of the failed mirrors mustn't reach the sink.
+        self.assertEqual(received, self.data)
+
+    def test_failover_before_data(self) -> None:
+        url = self.serve()
+        missing = url.removesuffix(self.served.name) + "missing.tar.gz"
+        sha256, received = self.fetch([_unused_url(), missing, url])
+        self._assert_fetched(sha256, received)
+        self.assertIn(url.split("/")[2], _mirrors._load_history(self.history_path))
+
+    def test_failover_to_local_directory(self) -> None:
+        sha256, received = self.fetch([_unused_url(), str(self.served)])
+        self._assert_fetched(sha256, received)
+
+    def test_error_after_data(self) -> None:
+        truncating = self.serve(handler=_TruncatingHandler)
+        working = self.serve()
+        with self.assertRaises((OSError, http.client.HTTPException)):
+            self.fetch([truncating, working])
+
+    def test_error_after_data_without_sink(self) -> None:
+        # Without a sink nothing has been passed on, the next mirror can be used.
+        truncating = self.serve(handler=_TruncatingHandler)
+        working = self.serve()
+        with contextlib.redirect_stderr(io.StringIO()):
+            sha256 = _mirrors.fetch(
+                [truncating, working], self.path, history_path=self.history_path
+            )
+        self.assertEqual(sha256, hashlib.sha256(self.data).hexdigest())
+        self.assertEqual(self.path.read_bytes(), self.data)
+
+    def test_last_location_error(self) -> None:
+        with self.assertRaises(OSError):
+            self.fetch([_unused_url()])
+
+    def test_order_locations(self) -> None:
+        url = self.serve()
+        unreachable = _unused_url()
+        missing_local = str(self.tmp_dir / "missing.tar.gz")
+        upstream = "https://upstream.invalid/platform-tools-0.0.0.tar.gz"
+        with unittest.mock.patch.object(
+            _download, "estimate_size", return_value=(len(self.data), "history")
+        ):
+            ordered = _mirrors.order_locations(
+                [unreachable, missing_local, url, str(self.served)],
+                upstream,
+                self.history_path,
+                timeout=1.0,
+            )
+        self.assertEqual(ordered, [str(self.served), url, unreachable, upstream])
+
+    def test_concurrent_history_updates(self) -> None:
+        hosts = [f"mirror{index}.example.com" for index in range(32)]
+        with concurrent.futures.ThreadPoolExecutor(8) as executor:
+            for future in [
+                executor.submit(
+                    _mirrors._record_throughput,
+                    self.history_path,
+                    f"https://{host}/platform-tools-0.0.0.tar.gz",
+                    float(index),
+                )
+                for index, host in enumerate(hosts)
+            ]:
+                future.result()
+        self.assertEqual(
+            _mirrors._load_history(self.history_path),
+            {host: float(index) for index, host in enumerate(hosts)},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+# Copyright 2025 meator
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests of the SBOM cache of generate_sbom.py."""
+
+import hashlib
+import os
+import pathlib
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+repo_dir = pathlib.Path(__file__).parent.parent
+_orig_path = sys.path.copy()
+try:
+    sys.path.insert(1, str(repo_dir.absolute()))
+
+    import generate_sbom
+finally:
+    sys.path = _orig_path
+    del _orig_path
+
+
+def _entry_name(index: int) -> str:
+    return hashlib.sha256(str(index).encode()).hexdigest() + ".json"
+
+
+class StoreCachedTest(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp_dir = tempfile.TemporaryDirectory(prefix="adbwinapi-test-")
+        self.addCleanup(tmp_dir.cleanup)
+        self.cache_dir = pathlib.Path(tmp_dir.name)
+
+        patcher = unittest.mock.patch.object(generate_sbom, "_sbom_cache_size", 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_prune_keeps_other_files(self) -> None:
+        # The cache may be pointed at a directory holding other files.
+        others = ["platform-tools-35.0.1.tar.gz", "sizes.json", "abc.json"]
+        for index, name in enumerate(others):
+            (self.cache_dir / name).touch()
+            os.utime(self.cache_dir / name, (index, index))
+        for index in range(4):
+            generate_sbom._store_cached(
+                self.cache_dir, self.cache_dir / _entry_name(index), [{}]
+            )
+            os.utime(self.cache_dir / _entry_name(index), (100 + index, 100 + index))
+        self.assertEqual(
+            sorted(entry.name for entry in self.cache_dir.iterdir()),
+            sorted(others + [_entry_name(2), _entry_name(3)]),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()